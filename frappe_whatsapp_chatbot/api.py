@@ -89,23 +89,19 @@ def is_transferred(phone_number, whatsapp_account=None):
     if not phone_number:
         frappe.throw(_("Phone number is required"))
 
-    from frappe_whatsapp_chatbot.frappe_whatsapp_chatbot.doctype.whatsapp_agent_transfer.whatsapp_agent_transfer import WhatsAppAgentTransfer
+    from frappe_whatsapp_chatbot.chatbot.agent_transfers import get_active_transfer
 
-    is_active = WhatsAppAgentTransfer.is_transferred(
-        phone_number=phone_number,
-        whatsapp_account=whatsapp_account
-    )
+    # Answered from the cached transfer status, no database query
+    transfer = get_active_transfer(phone_number, whatsapp_account)
 
-    if is_active:
-        # Get transfer details
-        transfer = frappe.get_doc("WhatsApp Agent Transfer", is_active)
+    if transfer:
         return {
             "is_transferred": True,
             "phone_number": phone_number,
-            "transfer_name": transfer.name,
-            "agent": transfer.agent,
-            "agent_name": transfer.agent_name,
-            "transferred_at": transfer.transferred_at
+            "transfer_name": transfer["name"],
+            "agent": transfer["agent"],
+            "agent_name": transfer["agent_name"],
+            "transferred_at": transfer["transferred_at"]
         }
     else:
         return {
@@ -140,3 +136,150 @@ def get_active_transfers(whatsapp_account=None, agent=None):
     )
 
     return transfers
+
+
+@frappe.whitelist()
+def get_queue_stats(queue=None):
+    """Get background processing stats for the chatbot queue.
+
+    Args:
+        queue: Optional queue name (defaults to the configured chatbot queue)
+
+    Returns:
+        dict with pending job count, worker count and wait/run time percentiles
+    """
+    frappe.only_for("System Manager")
+
+    from frappe_whatsapp_chatbot.chatbot.dispatcher import get_queue_stats as _get_queue_stats
+    from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+    if not queue:
+        queue = get_settings().background_queue
+
+    return _get_queue_stats(queue)
+
+
+@frappe.whitelist()
+def get_processing_stats():
+    """Get per-stage processing time and query counts of sampled messages.
+
+    Returns:
+        dict with the sample count, the number of replies per branch and
+        p50/p95/p99/max time (seconds) and queries for every stage
+    """
+    frappe.only_for("System Manager")
+
+    from frappe_whatsapp_chatbot.chatbot.tracing import get_processing_stats as _get_processing_stats
+
+    return _get_processing_stats()
+
+
+@frappe.whitelist()
+def evaluate_rules(messages=None, file_url=None, whatsapp_account=None, include_results=False):
+    """Run sample messages through the keyword rules and flow triggers.
+
+    Args:
+        messages: List (or JSON list) of message texts
+        file_url: Alternatively, an uploaded .jsonl, .csv or .txt corpus
+        whatsapp_account: Optional WhatsApp account whose rules are used
+        include_results: Also return the result of every message
+
+    Returns:
+        dict with hits per rule and flow, shadowed and unused rules, the
+        unmatched rate and throughput
+    """
+    frappe.only_for("System Manager")
+
+    from frappe_whatsapp_chatbot.chatbot.rule_evaluation import evaluate_messages, read_corpus
+
+    if file_url:
+        path = frappe.get_doc("File", {"file_url": file_url}).get_full_path()
+        messages = read_corpus(path)
+    else:
+        messages = frappe.parse_json(messages) or []
+
+    results = [] if frappe.utils.cint(include_results) else None
+    report = evaluate_messages(messages, whatsapp_account, results.append if results is not None else None)
+    if results is not None:
+        report["results"] = results
+    return report
+
+
+@frappe.whitelist()
+def get_rule_hits(reference_doctype=None, days=30):
+    """Get how often keyword replies and flow triggers answered messages.
+
+    Args:
+        reference_doctype: "WhatsApp Keyword Reply" or "WhatsApp Chatbot Flow" (default: both)
+        days: Number of days to count
+
+    Returns:
+        list of dicts with the rule, its hits and its last hit, most hits
+        first; enabled rules without hits are included
+    """
+    frappe.only_for("System Manager")
+
+    from frappe_whatsapp_chatbot.chatbot.rule_hits import get_rule_hits as _get_rule_hits
+
+    return _get_rule_hits(reference_doctype, frappe.utils.cint(days) or 30)
+
+
+@frappe.whitelist()
+def exclude_numbers(numbers, reason=None):
+    """Bulk-add phone numbers to the chatbot exclusion list.
+
+    Args:
+        numbers: List (or newline/comma separated string) of phone numbers
+        reason: Optional reason stored on every new entry
+
+    Returns:
+        dict with counts of added, already excluded and invalid numbers
+    """
+    frappe.has_permission("WhatsApp Excluded Contact", "create", throw=True)
+
+    from frappe_whatsapp_chatbot.chatbot.exclusions import exclude_numbers as _exclude_numbers
+
+    return _exclude_numbers(numbers, reason)
+
+
+@frappe.whitelist()
+def include_numbers(numbers):
+    """Bulk-remove phone numbers from the chatbot exclusion list.
+
+    Args:
+        numbers: List (or newline/comma separated string) of phone numbers
+
+    Returns:
+        dict with the number of removed entries
+    """
+    frappe.has_permission("WhatsApp Excluded Contact", "delete", throw=True)
+
+    from frappe_whatsapp_chatbot.chatbot.exclusions import include_numbers as _include_numbers
+
+    return {"removed": _include_numbers(numbers)}
+
+
+@frappe.whitelist()
+def get_business_hours_status(whatsapp_account=None):
+    """Check whether the chatbot is within business hours.
+
+    Answered from the compiled schedule, no database query.
+
+    Args:
+        whatsapp_account: Optional WhatsApp account (uses its own schedule if it has one)
+
+    Returns:
+        dict with open status, timezone and the next opening time
+    """
+    from frappe_whatsapp_chatbot.chatbot.business_hours import get_schedule
+
+    schedule = get_schedule(whatsapp_account)
+    if not schedule:
+        return {"is_open": True, "timezone": None, "next_opening": None}
+
+    next_opening = schedule.next_opening()
+    return {
+        "is_open": schedule.is_open(),
+        "timezone": schedule.timezone,
+        "next_opening": next_opening.isoformat() if next_opening else None
+    }
@@ -0,0 +1,111 @@
+import frappe
+from frappe_whatsapp_chatbot.chatbot.utils import normalize_phone
+
+# Hash of normalized phone number -> {whatsapp_account: transfer details}
+AGENT_TRANSFERS_KEY = "whatsapp_chatbot:agent_transfers"
+# Field of the hash once it has been loaded; never a normalized number, and
+# it goes away with the hash if Redis evicts or loses it
+LOADED_MARKER = "loaded"
+
+TRANSFER_FIELDS = [
+    "name", "phone_number", "normalized_number", "whatsapp_account", "agent", "agent_name", "transferred_at"
+]
+
+
+def get_active_transfer(phone_number, whatsapp_account=None):
+    """Return details of the active agent transfer for a phone number.
+
+    Answered from Redis without touching the database. Without
+    ``whatsapp_account`` a transfer on any account counts.
+
+    Returns:
+        dict with name, agent, agent_name and transferred_at, or None
+    """
+    normalized = normalize_phone(phone_number)
+    if not normalized:
+        return None
+
+    if not frappe.cache.hexists(AGENT_TRANSFERS_KEY, LOADED_MARKER):
+        rebuild_agent_transfers_cache()
+
+    transfers = frappe.cache.hget(AGENT_TRANSFERS_KEY, normalized) or {}
+
+    if whatsapp_account:
+        return transfers.get(whatsapp_account)
+
+    return next(iter(transfers.values()), None)
+
+
+def update_transfer_cache(*normalized_numbers):
+    """Refresh the cached transfers of phone numbers once the transaction commits.
+
+    A rolled back change never reaches the cache.
+    """
+    for normalized in {n for n in normalized_numbers if n}:
+        frappe.db.after_commit.add(lambda normalized=normalized: refresh_cached_transfers(normalized))
+
+
+def refresh_cached_transfers(normalized):
+    """Rewrite the cache entry of a phone number from its active transfers.
+
+    The entry is read from the database and written under a lock, so
+    concurrent changes to the same phone number end with the latest one.
+    """
+    if not frappe.cache.hexists(AGENT_TRANSFERS_KEY, LOADED_MARKER):
+        return  # Will be built from the table on next lookup
+
+    lock = frappe.cache.lock(frappe.cache.make_key(f"{AGENT_TRANSFERS_KEY}:lock:{normalized}"), timeout=10)
+    with lock:
+        transfers = frappe.get_all(
+            "WhatsApp Agent Transfer",
+            filters={"normalized_number": normalized, "status": "Active"},
+            fields=TRANSFER_FIELDS,
+            order_by="transferred_at asc"
+        )
+        value = {transfer.whatsapp_account or "": get_transfer_details(transfer) for transfer in transfers}
+
+        if value:
+            frappe.cache.hset(AGENT_TRANSFERS_KEY, normalized, value)
+        else:
+            frappe.cache.hdel(AGENT_TRANSFERS_KEY, normalized)
+
+
+def rebuild_agent_transfers_cache():
+    """Repopulate the cache from all active WhatsApp Agent Transfer records.
+
+    Entries are overwritten in place and stale ones removed afterwards, so
+    lookups never see an empty cache while it is rebuilt. LOADED_MARKER is
+    set last.
+    """
+    transfers = frappe.get_all(
+        "WhatsApp Agent Transfer",
+        filters={"status": "Active"},
+        fields=TRANSFER_FIELDS,
+        order_by="transferred_at asc"
+    )
+
+    by_phone = {}
+    for transfer in transfers:
+        normalized = transfer.normalized_number or normalize_phone(transfer.phone_number)
+        if normalized:
+            by_phone.setdefault(normalized, {})[transfer.whatsapp_account or ""] = get_transfer_details(transfer)
+
+    for normalized, value in by_phone.items():
+        frappe.cache.hset(AGENT_TRANSFERS_KEY, normalized, value)
+
+    for key in frappe.cache.hkeys(AGENT_TRANSFERS_KEY) or []:
+        key = frappe.safe_decode(key)
+        if key not in by_phone and key != LOADED_MARKER:
+            frappe.cache.hdel(AGENT_TRANSFERS_KEY, key)
+
+    frappe.cache.hset(AGENT_TRANSFERS_KEY, LOADED_MARKER, 1)
+    return len(transfers)
+
+
+def get_transfer_details(transfer):
+    return {
+        "name": transfer.name,
+        "agent": transfer.agent,
+        "agent_name": transfer.agent_name,
+        "transferred_at": transfer.transferred_at
+    }
@@ -1,5 +1,6 @@
 import frappe
 import json
+from frappe_whatsapp_chatbot.chatbot.utils import as_message, fold_text
 
 
 class AIResponder:
@@ -18,12 +19,13 @@ class AIResponder:
         self.history_limit = settings.ai_history_limit or 4
 
     def generate_response(self, message, conversation_history=None):
-        """Generate AI response for message."""
+        """Generate AI response for message (a NormalizedMessage or text)."""
         if not self.api_key:
             frappe.log_error("AI API key not configured")
             return None
 
-        self.current_message = message  # Store for context filtering
+        self.current_message = as_message(message)  # Store for context filtering
+        message = self.current_message.raw
 
         try:
             if self.provider == "OpenAI":
@@ -50,14 +52,14 @@ class AIResponder:
             )
 
             context_parts = []
-            message_lower = (getattr(self, 'current_message', '') or '').lower()
+            message_folded = as_message(getattr(self, 'current_message', '')).folded
 
             for ctx in contexts:
                 try:
                     # Check trigger keywords - skip if message doesn't match
                     if ctx.trigger_keywords:
-                        keywords = [k.strip().lower() for k in ctx.trigger_keywords.split(",") if k.strip()]
-                        if keywords and not any(kw in message_lower for kw in keywords):
+                        keywords = [fold_text(k) for k in ctx.trigger_keywords.split(",") if k.strip()]
+                        if keywords and not any(kw in message_folded for kw in keywords):
                             continue  # Skip this context - no matching keywords
 
                     if ctx.context_type == "Static Text" and ctx.static_content:
@@ -0,0 +1,192 @@
+import frappe
+from bisect import bisect_left
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+class BusinessSchedule:
+    """Weekly business hours compiled for constant-time lookups.
+
+    ``minutes`` has one byte per minute of the week (Monday 00:00 is minute
+    0), set when the business is open, in the schedule's own timezone.
+    ``starts`` lists the minutes at which an open period begins within a
+    day, for finding the next opening. Holiday dates are closed all day.
+    """
+
+    def __init__(self, timezone, minutes, holidays=()):
+        self.timezone = timezone
+        self.minutes = bytes(minutes)
+        self.holidays = frozenset(holidays)
+        self.starts = [
+            minute for minute in range(MINUTES_PER_WEEK)
+            if self.minutes[minute] and (minute % MINUTES_PER_DAY == 0 or not self.minutes[minute - 1])
+        ]
+
+    def localize(self, now=None):
+        """Return ``now`` (default: current time) in the schedule's timezone."""
+        tz = ZoneInfo(self.timezone)
+        if now is None:
+            return datetime.now(tz)
+        if now.tzinfo is None:
+            return now.replace(tzinfo=tz)
+        return now.astimezone(tz)
+
+    def is_open(self, now=None):
+        """Check if the business is open at ``now``."""
+        local = self.localize(now)
+        if local.toordinal() in self.holidays:
+            return False
+        return bool(self.minutes[minute_of_week(local)])
+
+    def next_opening(self, now=None):
+        """Return when the business next opens, or None if it never does.
+
+        Returns ``now`` (localized) when the business is already open.
+        """
+        local = self.localize(now).replace(second=0, microsecond=0)
+        if self.is_open(local):
+            return local
+
+        if not self.starts:
+            return None
+
+        # Every weekday has been checked once past the last holiday
+        for offset in range(len(self.holidays) + 8):
+            day = local.date() + timedelta(days=offset)
+            if day.toordinal() in self.holidays:
+                continue
+
+            day_start = day.weekday() * MINUTES_PER_DAY
+            first = day_start + (local.hour * 60 + local.minute if offset == 0 else 0)
+
+            index = bisect_left(self.starts, first)
+            if index < len(self.starts) and self.starts[index] < day_start + MINUTES_PER_DAY:
+                minute = self.starts[index] - day_start
+                return datetime.combine(day, time(minute // 60, minute % 60), local.tzinfo)
+
+        return None
+
+
+def minute_of_week(value):
+    """Return the minute of the week (Monday 00:00 = 0) of a datetime."""
+    return value.weekday() * MINUTES_PER_DAY + value.hour * 60 + value.minute
+
+
+def compile_schedule(rows, timezone=None, holidays=None):
+    """Compile WhatsApp Business Hours rows into a BusinessSchedule.
+
+    Args:
+        rows: WhatsApp Business Hours rows (day, enabled, start_time, end_time)
+        timezone: IANA timezone of the hours (defaults to the system timezone)
+        holidays: Optional WhatsApp Chatbot Holiday rows, closed all day
+
+    Returns:
+        BusinessSchedule, or None if no hours are configured
+    """
+    if not rows:
+        return None
+
+    minutes = bytearray(MINUTES_PER_WEEK)
+
+    for row in rows:
+        if not row.enabled or row.day not in DAYS:
+            continue
+
+        start = parse_time(row.start_time)
+        end = parse_time(row.end_time)
+
+        day_start = DAYS.index(row.day) * MINUTES_PER_DAY
+        if start is None or end is None:
+            # Day is enabled but no specific times set
+            first, last = 0, MINUTES_PER_DAY
+        else:
+            first = start.hour * 60 + start.minute
+            last = end.hour * 60 + end.minute
+            if last <= first:
+                last += MINUTES_PER_DAY  # Closes after midnight
+
+        for minute in range(day_start + first, day_start + last):
+            minutes[minute % MINUTES_PER_WEEK] = 1
+
+    return BusinessSchedule(
+        get_timezone(timezone),
+        minutes,
+        get_holidays(holidays)
+    )
+
+
+def get_timezone(timezone=None):
+    """Return a valid IANA timezone, falling back to the system timezone."""
+    if timezone:
+        try:
+            ZoneInfo(timezone)
+            return timezone
+        except (ZoneInfoNotFoundError, ValueError):
+            frappe.log_error(f"Unknown business hours timezone: {timezone}")
+
+    from frappe.utils import get_system_timezone
+    return get_system_timezone()
+
+
+def validate_timezone(timezone):
+    """Throw if ``timezone`` is set but not a known IANA timezone."""
+    if not timezone:
+        return
+
+    try:
+        ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        frappe.throw(frappe._("{0} is not a valid timezone (e.g. Asia/Kolkata)").format(timezone))
+
+
+def get_holidays(rows):
+    """Return the dates of WhatsApp Chatbot Holiday rows as day ordinals."""
+    if not rows:
+        return []
+
+    from frappe.utils import getdate
+
+    return [getdate(row.holiday_date).toordinal() for row in rows if row.holiday_date]
+
+
+def parse_time(time_value):
+    """Parse a Time field value (str or timedelta) into a time object."""
+    if time_value is None or time_value == "":
+        return None
+
+    if isinstance(time_value, time):
+        return time_value
+
+    if hasattr(time_value, "total_seconds"):
+        seconds = int(time_value.total_seconds())
+        return time(seconds // 3600 % 24, seconds // 60 % 60, seconds % 60)
+
+    try:
+        parts = str(time_value).split(":")
+        return time(int(parts[0]), int(parts[1]), int(float(parts[2])) if len(parts) > 2 else 0)
+    except (ValueError, IndexError):
+        return None
+
+
+def get_schedule(whatsapp_account=None):
+    """Return the business schedule of an account, or None if not configured.
+
+    An account with its own WhatsApp Business Schedule uses it; all other
+    accounts use the hours of the WhatsApp Chatbot settings.
+    """
+    from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+    settings = get_settings()
+    schedules = settings.account_schedules or {}
+    return schedules.get(whatsapp_account) or settings.business_schedule
+
+
+def format_opening(value):
+    """Format a next opening time for a customer-facing message."""
+    if not value:
+        return frappe._("soon")
+    return value.strftime("%A %d %b, %H:%M")
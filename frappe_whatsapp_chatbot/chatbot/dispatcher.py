@@ -0,0 +1,374 @@
+import frappe
+import json
+import time
+from contextlib import contextmanager
+from redis.exceptions import LockError
+
+DEFAULT_QUEUE = "chatbot"
+FALLBACK_QUEUE = "default"
+
+# Redis list holding the most recent job timings (newest first)
+JOB_STATS_KEY = "whatsapp_chatbot:job_stats"
+JOB_STATS_SIZE = 1000
+
+# A conversation lock expires on its own if its holder dies mid-turn
+LOCK_TIMEOUT = 600
+# How long a web request waits for the conversation lock before queueing
+SYNC_LOCK_WAIT = 2
+# Longest a burst is buffered, in coalescing windows
+COALESCE_MAX_WAIT = 3
+# Sorted set of conversations waiting for their burst to end, by due time
+DEFERRED_CONVERSATIONS_KEY = "whatsapp_chatbot:deferred_conversations"
+
+
+def get_conversation_key(whatsapp_account, phone_number):
+    """Return the key identifying one conversation (account + phone number)."""
+    return f"{whatsapp_account or ''}:{phone_number or ''}"
+
+
+def get_inbox_key(conversation):
+    """Redis list of messages waiting to be processed for a conversation."""
+    return f"whatsapp_chatbot:inbox:{conversation}"
+
+
+@contextmanager
+def conversation_lock(conversation, blocking_timeout=None):
+    """Hold the cluster-wide lock of a conversation.
+
+    Yields True when the lock was acquired. With no ``blocking_timeout``
+    the lock is only tried once.
+    """
+    lock = frappe.cache.lock(
+        frappe.cache.make_key(f"whatsapp_chatbot:lock:{conversation}"),
+        timeout=LOCK_TIMEOUT
+    )
+    acquired = lock.acquire(
+        blocking=bool(blocking_timeout),
+        blocking_timeout=blocking_timeout
+    )
+
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except LockError:
+                pass  # Expired while we were processing
+
+
+def get_queue_name(queue=None):
+    """Return the queue to enqueue chatbot jobs to.
+
+    Custom queues only exist when they are declared under ``workers`` in
+    common_site_config.json, so fall back to the default queue otherwise.
+    """
+    from frappe.utils.background_jobs import get_queues_timeout
+
+    queue = (queue or DEFAULT_QUEUE).strip()
+    if queue in get_queues_timeout():
+        return queue
+    return FALLBACK_QUEUE
+
+
+def enqueue_message(message_data, queue=None):
+    """Hand an incoming message over to a background worker.
+
+    Messages are appended to their conversation's inbox and a job is queued
+    to drain it. Both only happen once the current transaction commits, so
+    the worker can always load the WhatsApp Message that triggered it.
+    """
+    message_data = dict(message_data)
+    message_data["enqueued_at"] = time.time()
+
+    conversation = get_conversation_key(
+        message_data.get("whatsapp_account"),
+        message_data.get("from")
+    )
+    payload = json.dumps(message_data, default=str)
+
+    def push():
+        frappe.cache.rpush(get_inbox_key(conversation), payload)
+        enqueue_conversation(conversation, queue)
+
+    frappe.db.after_commit.add(push)
+
+
+def enqueue_conversation(conversation, queue=None):
+    """Queue a job that processes the pending messages of a conversation."""
+    frappe.enqueue(
+        "frappe_whatsapp_chatbot.chatbot.dispatcher.process_conversation",
+        queue=get_queue_name(queue),
+        conversation=conversation
+    )
+
+
+def process_conversation(conversation):
+    """Background job: process pending messages of one conversation in order.
+
+    Every queued message gets its own job, but only the worker holding the
+    conversation lock drains the inbox; the others return immediately. The
+    holder checks the inbox again after releasing the lock, so a message
+    pushed while it was finishing up is never left behind.
+
+    With a coalescing window configured, a burst of texts is answered in a
+    single pass once the inbox goes quiet. Until then the job queues itself
+    again for later instead of waiting, so it holds neither the lock nor a
+    worker in the meantime.
+    """
+    from frappe_whatsapp_chatbot.chatbot.processor import run_processor
+
+    inbox = get_inbox_key(conversation)
+    window, mode = get_coalesce_settings()
+
+    while frappe.cache.llen(inbox):
+        with conversation_lock(conversation) as acquired:
+            if not acquired:
+                return
+
+            while True:
+                if window:
+                    delay = get_coalesce_delay(inbox, window)
+                    if delay:
+                        defer_conversation(conversation, delay)
+                        return
+
+                messages = pop_messages(inbox)
+                if not messages:
+                    break
+
+                if window:
+                    frappe.cache.zrem(frappe.cache.make_key(DEFERRED_CONVERSATIONS_KEY), conversation)
+                    messages = coalesce_messages(messages, mode)
+
+                for message_data in messages:
+                    run_processor(message_data)
+
+
+def get_coalesce_settings():
+    """Return (window in seconds, mode) for burst coalescing."""
+    from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+    settings = get_settings()
+    return max(settings.coalesce_window_seconds or 0, 0), settings.coalesce_mode or "Join"
+
+
+def get_coalesce_delay(inbox, window):
+    """Return how many seconds are left until a buffered burst is answered.
+
+    That is when no message arrived in the inbox for ``window`` seconds, and
+    at the latest COALESCE_MAX_WAIT windows after the oldest one; 0 when the
+    inbox is quiet (or empty).
+    """
+    oldest = frappe.cache.lrange(inbox, 0, 0)
+    newest = frappe.cache.lrange(inbox, -1, -1)
+    if not oldest or not newest:
+        return 0
+
+    quiet_at = json.loads(newest[0]).get("enqueued_at", 0) + window
+    deadline = json.loads(oldest[0]).get("enqueued_at", 0) + window * COALESCE_MAX_WAIT
+    return max(min(quiet_at, deadline) - time.time(), 0)
+
+
+def defer_conversation(conversation, delay):
+    """Process a conversation again in ``delay`` seconds.
+
+    The conversation is also remembered with its due time, so
+    process_deferred_conversations() picks it up if the delayed job never
+    runs.
+    """
+    from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+    frappe.cache.zadd(
+        frappe.cache.make_key(DEFERRED_CONVERSATIONS_KEY),
+        {conversation: time.time() + delay}
+    )
+    enqueue_in(
+        "frappe_whatsapp_chatbot.chatbot.dispatcher.process_conversation",
+        delay,
+        get_settings().background_queue,
+        conversation=conversation
+    )
+
+
+def enqueue_in(method, delay, queue=None, **kwargs):
+    """Queue a job to run in ``delay`` seconds, or right away if it is 0.
+
+    Delayed jobs are scheduled with RQ and only run where a worker runs
+    RQ's scheduler; callers keep a scheduled job as a fallback.
+    """
+    if delay <= 0:
+        frappe.enqueue(method, queue=get_queue_name(queue), **kwargs)
+        return
+
+    from datetime import timedelta
+    from frappe.utils.background_jobs import execute_job, get_queue
+
+    get_queue(get_queue_name(queue)).enqueue_in(
+        timedelta(seconds=delay),
+        execute_job,
+        kwargs={
+            "site": frappe.local.site,
+            "user": frappe.session.user,
+            "method": method,
+            "event": None,
+            "job_name": method,
+            "is_async": True,
+            "kwargs": kwargs
+        }
+    )
+
+
+def process_deferred_conversations():
+    """Scheduled job: queue coalesced conversations overdue by more than a window.
+
+    Only needed when the delayed job of defer_conversation() did not run
+    (no RQ scheduler); the conversation is deferred again if its burst is
+    still going on.
+    """
+    from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+    key = frappe.cache.make_key(DEFERRED_CONVERSATIONS_KEY)
+    window, _ = get_coalesce_settings()
+
+    for conversation in frappe.cache.zrangebyscore(key, 0, time.time() - max(window, 1)) or []:
+        frappe.cache.zrem(key, conversation)
+        conversation = conversation.decode() if isinstance(conversation, bytes) else conversation
+        enqueue_conversation(conversation, get_settings().background_queue)
+
+
+def pop_messages(inbox):
+    """Take all pending messages out of an inbox, oldest first."""
+    messages = []
+    while True:
+        payload = frappe.cache.lpop(inbox)
+        if payload is None:
+            return messages
+        messages.append(json.loads(payload))
+
+
+def coalesce_messages(messages, mode="Join"):
+    """Merge runs of consecutive text messages into one message.
+
+    Button and flow replies are kept as they are and split runs, so their
+    order relative to the surrounding texts is preserved. The merged message
+    keeps the data (name, timestamps) of the last text of the run.
+    """
+    result = []
+    run = []
+
+    def flush():
+        if not run:
+            return
+        merged = dict(run[-1])
+        if len(run) > 1:
+            if mode != "Latest":
+                merged["message"] = " ".join(
+                    (m.get("message") or "").strip() for m in run if (m.get("message") or "").strip()
+                )
+            merged["coalesced"] = [m.get("name") for m in run]
+        result.append(merged)
+        run.clear()
+
+    for message_data in messages:
+        if (message_data.get("content_type") or "text") == "text":
+            run.append(message_data)
+        else:
+            flush()
+            result.append(message_data)
+
+    flush()
+    return result
+
+
+def process_message(message_data, queue=None):
+    """Process a message in the current request, one at a time per conversation.
+
+    If older messages of the conversation are still queued, or another
+    request is still answering it after SYNC_LOCK_WAIT seconds, the message
+    is queued behind them instead, so it never overtakes them.
+    """
+    from frappe_whatsapp_chatbot.chatbot.processor import run_processor
+
+    conversation = get_conversation_key(
+        message_data.get("whatsapp_account"),
+        message_data.get("from")
+    )
+    inbox = get_inbox_key(conversation)
+
+    acquired = False
+    if not frappe.cache.llen(inbox):
+        with conversation_lock(conversation, blocking_timeout=SYNC_LOCK_WAIT) as acquired:
+            # Checked again: messages may have been queued while we waited
+            if acquired and not frappe.cache.llen(inbox):
+                run_processor(message_data)
+            else:
+                acquired = False
+
+    if not acquired:
+        enqueue_message(message_data, queue)
+    elif frappe.cache.llen(inbox):
+        # Messages were queued behind us while we held the lock
+        enqueue_conversation(conversation, queue)
+
+
+def record_job_stats(message_data, started_at):
+    """Store wait and run time of a finished background job."""
+    enqueued_at = message_data.get("enqueued_at")
+    if not enqueued_at:
+        return
+
+    try:
+        finished_at = time.time()
+        frappe.cache.lpush(JOB_STATS_KEY, json.dumps({
+            "wait": round(started_at - enqueued_at, 3),
+            "run": round(finished_at - started_at, 3),
+            "at": finished_at
+        }))
+        frappe.cache.ltrim(JOB_STATS_KEY, 0, JOB_STATS_SIZE - 1)
+    except Exception:
+        pass  # Stats are best effort, never fail the job because of them
+
+
+def get_queue_stats(queue=None):
+    """Return queue depth, worker count and recent job latency."""
+    from frappe.utils.background_jobs import get_queue, get_workers
+
+    queue_name = get_queue_name(queue)
+    rq_queue = get_queue(queue_name)
+
+    samples = []
+    for row in frappe.cache.lrange(JOB_STATS_KEY, 0, -1) or []:
+        try:
+            samples.append(json.loads(row))
+        except Exception:
+            continue
+
+    return {
+        "queue": queue_name,
+        "pending": rq_queue.count,
+        "workers": len(get_workers(rq_queue)),
+        "samples": len(samples),
+        "wait": summarize([s["wait"] for s in samples]),
+        "run": summarize([s["run"] for s in samples])
+    }
+
+
+def summarize(values):
+    """Return p50/p95/p99/max (in seconds) for a list of durations."""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+
+    values = sorted(values)
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1]
+    }
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, int(round(pct / 100 * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
@@ -0,0 +1,169 @@
+import frappe
+from frappe_whatsapp_chatbot.chatbot.utils import normalize_phone
+
+EXCLUDED_NUMBERS_KEY = "whatsapp_chatbot:excluded_numbers"
+# Member of the set once it has been loaded; never a normalized number, and
+# it goes away with the set if Redis evicts or loses it
+LOADED_MARKER = "loaded"
+
+# Redis and SQL batch size for bulk operations
+CHUNK_SIZE = 1000
+
+
+def is_excluded(phone_number):
+    """Check if a phone number is excluded from chatbot replies.
+
+    A single round trip to Redis; the set is rebuilt from
+    WhatsApp Excluded Contact when it is missing.
+    """
+    normalized = normalize_phone(phone_number)
+    if not normalized:
+        return False
+
+    key = frappe.cache.make_key(EXCLUDED_NUMBERS_KEY)
+    pipe = frappe.cache.pipeline()
+    pipe.sismember(key, LOADED_MARKER)
+    pipe.sismember(key, normalized)
+    loaded, excluded = pipe.execute()
+
+    if not loaded:
+        rebuild_excluded_numbers_cache()
+        excluded = frappe.cache.sismember(EXCLUDED_NUMBERS_KEY, normalized)
+
+    return bool(excluded)
+
+
+def rebuild_excluded_numbers_cache():
+    """Repopulate the Redis set from the database.
+
+    The set is built under a temporary key and swapped in, so lookups never
+    see a half-filled set. It always holds LOADED_MARKER, even when no
+    number is excluded.
+    """
+    numbers = frappe.get_all("WhatsApp Excluded Contact", pluck="normalized_number")
+    numbers = [n for n in numbers if n]
+
+    tmp_key = f"{EXCLUDED_NUMBERS_KEY}:rebuild:{frappe.generate_hash(length=8)}"
+    frappe.cache.sadd(tmp_key, LOADED_MARKER)
+    for chunk in chunked(numbers):
+        frappe.cache.sadd(tmp_key, *chunk)
+    frappe.cache.rename(frappe.cache.make_key(tmp_key), frappe.cache.make_key(EXCLUDED_NUMBERS_KEY))
+
+    return len(numbers)
+
+
+def update_cache(added=(), removed=()):
+    """Add and remove normalized numbers in the cached set once the transaction commits.
+
+    A rolled back change never reaches the cache.
+    """
+    added = [n for n in added if n]
+    removed = [n for n in removed if n]
+    if removed:
+        frappe.db.after_commit.add(lambda: remove_from_cache(*removed))
+    if added:
+        frappe.db.after_commit.add(lambda: add_to_cache(*added))
+
+
+def add_to_cache(*numbers):
+    """Add normalized numbers to the cached set (if it is loaded)."""
+    numbers = [n for n in numbers if n]
+    if numbers and frappe.cache.sismember(EXCLUDED_NUMBERS_KEY, LOADED_MARKER):
+        for chunk in chunked(numbers):
+            frappe.cache.sadd(EXCLUDED_NUMBERS_KEY, *chunk)
+
+
+def remove_from_cache(*numbers):
+    """Remove normalized numbers from the cached set."""
+    numbers = [n for n in numbers if n]
+    for chunk in chunked(numbers):
+        frappe.cache.srem(EXCLUDED_NUMBERS_KEY, *chunk)
+
+
+def exclude_numbers(numbers, reason=None):
+    """Bulk-add phone numbers to the exclusion list.
+
+    Args:
+        numbers: list of phone numbers, or a string separated by newlines/commas
+        reason: Optional reason stored on every new entry
+
+    Returns:
+        dict with counts of added, already excluded and invalid numbers
+    """
+    normalized = {}
+    invalid = 0
+    for phone_number in split_numbers(numbers):
+        key = normalize_phone(phone_number)
+        if key:
+            normalized.setdefault(key, phone_number)
+        else:
+            invalid += 1
+
+    existing = set()
+    for chunk in chunked(list(normalized)):
+        existing.update(frappe.get_all(
+            "WhatsApp Excluded Contact",
+            filters={"normalized_number": ["in", chunk]},
+            pluck="normalized_number"
+        ))
+
+    new_numbers = [key for key in normalized if key not in existing]
+    now = frappe.utils.now_datetime()
+    user = frappe.session.user
+
+    for chunk in chunked(new_numbers):
+        frappe.db.bulk_insert(
+            "WhatsApp Excluded Contact",
+            fields=["name", "phone_number", "normalized_number", "reason", "owner", "modified_by", "creation", "modified"],
+            values=[
+                (frappe.generate_hash(length=10), normalized[key], key, reason, user, user, now, now)
+                for key in chunk
+            ]
+        )
+
+    update_cache(added=new_numbers)
+
+    return {
+        "added": len(new_numbers),
+        "existing": len(existing),
+        "invalid": invalid
+    }
+
+
+def include_numbers(numbers):
+    """Bulk-remove phone numbers from the exclusion list.
+
+    Returns:
+        Number of entries removed
+    """
+    keys = list({normalize_phone(n) for n in split_numbers(numbers)} - {""})
+
+    removed = 0
+    for chunk in chunked(keys):
+        names = frappe.get_all(
+            "WhatsApp Excluded Contact",
+            filters={"normalized_number": ["in", chunk]},
+            pluck="name"
+        )
+        if names:
+            frappe.db.delete("WhatsApp Excluded Contact", {"name": ["in", names]})
+            removed += len(names)
+
+    update_cache(removed=keys)
+    return removed
+
+
+def split_numbers(numbers):
+    """Accept a list or a newline/comma separated string of numbers."""
+    if not numbers:
+        return []
+
+    if isinstance(numbers, str):
+        numbers = frappe.parse_json(numbers) if numbers.strip().startswith("[") else numbers.replace(",", "\n").splitlines()
+
+    return [str(n).strip() for n in numbers if n and str(n).strip()]
+
+
+def chunked(values, size=CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
@@ -0,0 +1,78 @@
+import frappe
+import unicodedata
+from functools import lru_cache
+
+# Compiled expressions kept per process
+EXPRESSION_CACHE_SIZE = 1024
+
+# Available to every expression, next to Frappe's safe_eval globals
+EXPRESSION_GLOBALS = {
+    "len": len,
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": bool,
+}
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_expression(expression):
+    """Compile an expression in Frappe's safe_eval sandbox, once per process.
+
+    Runs the same checks as frappe.safe_eval: the restricted syntax is
+    validated and compiled here, so evaluating it later is a plain eval.
+
+    Raises:
+        SyntaxError or frappe.ValidationError if the expression is not allowed
+    """
+    from RestrictedPython import compile_restricted
+    from frappe.utils.safe_exec import FrappeTransformer, _validate_safe_eval_syntax
+
+    code = unicodedata.normalize("NFKC", expression)
+    _validate_safe_eval_syntax(code)
+
+    return compile_restricted(code, filename="<safe_eval>", policy=FrappeTransformer, mode="eval")
+
+
+def evaluate_expression(expression, variables=None):
+    """Evaluate a cached, sandboxed expression.
+
+    Args:
+        expression: Python expression (e.g. a rule's conditions)
+        variables: Names available to the expression
+
+    Returns:
+        The value of the expression
+    """
+    from frappe.utils.safe_exec import WHITELISTED_SAFE_EVAL_GLOBALS
+
+    code = compile_expression(expression)
+
+    eval_globals = dict(EXPRESSION_GLOBALS)
+    eval_globals.update(variables or {})
+    eval_globals["__builtins__"] = {}
+    eval_globals.update(WHITELISTED_SAFE_EVAL_GLOBALS)
+
+    return eval(code, eval_globals, {})
+
+
+def validate_expression(expression, label="expression"):
+    """Throw if an expression would be rejected by the sandbox."""
+    if not expression or not expression.strip():
+        return
+
+    try:
+        compile_expression(expression)
+    except Exception as e:
+        frappe.throw(f"Invalid {label} '{expression}': {str(e)}")
+
+
+def get_expression_cache_info():
+    """Return hits, misses and size of this process' expression cache."""
+    info = compile_expression.cache_info()
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "maxsize": info.maxsize
+    }
@@ -2,55 +2,42 @@ import frappe
 import json
 import re
 from datetime import datetime
-
-
-def parse_json(value, default=None):
-    """Safely parse JSON - handles both string and already-parsed dict/list."""
-    if value is None:
-        return default if default is not None else {}
-    if isinstance(value, (dict, list)):
-        return value
-    if isinstance(value, str):
-        try:
-            return json.loads(value)
-        except (json.JSONDecodeError, TypeError):
-            return default if default is not None else {}
-    return default if default is not None else {}
+from frappe_whatsapp_chatbot.chatbot.flow_graph import FlowGraph, get_flow_graph, get_flow_trigger_index
+from frappe_whatsapp_chatbot.chatbot.utils import as_message, fold_text, parse_json
 
 
 class FlowEngine:
-    """Execute conversation flows."""
+    """Execute conversation flows.
+
+    The engine only changes documents; the caller's ResponseBatch commits
+    them together with the replies at the end of the turn.
+    """
 
     def __init__(self, phone_number, whatsapp_account):
         self.phone_number = phone_number
         self.account = whatsapp_account
+        self.trigger_index = None
+        # SessionState of this turn, ended if a new flow cancels it
+        self.session = None
 
-    def check_flow_trigger(self, message_text, button_payload=None):
-        """Check if message triggers any flow."""
-        try:
-            flows = frappe.get_all(
-                "WhatsApp Chatbot Flow",
-                filters={"enabled": 1},
-                fields=["name", "trigger_keywords", "trigger_on_button", "whatsapp_account"]
-            )
-
-            for flow in flows:
-                # Check account filter
-                if flow.whatsapp_account and flow.whatsapp_account != self.account:
-                    continue
+    def get_trigger_index(self):
+        """Return the flow trigger index of this account (cached per process)."""
+        if self.trigger_index is None:
+            self.trigger_index = get_flow_trigger_index(self.account)
+        return self.trigger_index
 
-                # Check button trigger
-                if button_payload and flow.trigger_on_button:
-                    if button_payload == flow.trigger_on_button:
-                        return flow.name
+    def get_trigger_flows(self):
+        """Return the enabled flows of this account, with folded trigger keywords."""
+        return self.get_trigger_index().flows
 
-                # Check keyword trigger
-                if flow.trigger_keywords and message_text:
-                    keywords = [k.strip().lower() for k in flow.trigger_keywords.split(",") if k.strip()]
-                    if message_text.lower() in keywords:
-                        return flow.name
+    def check_flow_trigger(self, message, button_payload=None):
+        """Check if message (a NormalizedMessage or text) triggers any flow.
 
-            return None
+        A matching button payload wins over a matching keyword.
+        """
+        message = as_message(message)
+        try:
+            return self.get_trigger_index().match(message.folded, button_payload)
 
         except Exception as e:
             frappe.log_error(f"FlowEngine check_flow_trigger error: {str(e)}")
@@ -59,14 +46,15 @@ class FlowEngine:
     def start_flow(self, flow_name):
         """Start a new conversation flow."""
         try:
-            flow = frappe.get_doc("WhatsApp Chatbot Flow", flow_name)
+            flow = get_flow_graph(flow_name)
 
-            if not flow.steps:
+            first_step = flow.first_step
+            if not first_step:
                 frappe.log_error(f"Flow '{flow_name}' has no steps")
                 return None
 
-            # Get first step
-            first_step = sorted(flow.steps, key=lambda x: x.idx)[0]
+            # A conversation can only have one active session
+            self.close_active_sessions()
 
             # Create session
             session = frappe.get_doc({
@@ -81,7 +69,6 @@ class FlowEngine:
                 "last_activity": datetime.now()
             })
             session.insert(ignore_permissions=True)
-            frappe.db.commit()
 
             # Build and return initial message
             if flow.initial_message_type == "Template" and flow.initial_template:
@@ -101,38 +88,57 @@ class FlowEngine:
                 messages.append(step_msg)
                 return "\n\n".join(messages) if messages else step_msg
             else:
-                # Step returns a complex message (buttons, template)
+                # Step returns a complex message (buttons, template):
+                # send the initial message first, then the step message
                 if messages:
-                    # Send initial message first, then step message
-                    return messages[0]  # We'll handle multi-message later
+                    return messages + [step_msg]
                 return step_msg
 
         except Exception as e:
             frappe.log_error(f"FlowEngine start_flow error: {str(e)}")
             return None
 
+    def close_active_sessions(self):
+        """Cancel sessions still active for this conversation before a new one starts."""
+        from frappe_whatsapp_chatbot.chatbot.session_store import end_session
+
+        active = frappe.get_all(
+            "WhatsApp Chatbot Session",
+            filters={
+                "phone_number": self.phone_number,
+                "whatsapp_account": self.account,
+                "status": "Active"
+            },
+            pluck="name"
+        )
+
+        for session_name in active:
+            # Write what is still queued in Redis before cancelling
+            end_session(session_name, self.account, self.phone_number)
+            frappe.db.set_value("WhatsApp Chatbot Session", session_name, {
+                "status": "Cancelled",
+                "active_conversation": None,
+                "completed_at": datetime.now()
+            })
+
+        if self.session is not None and self.session.name in active:
+            self.session.end("Cancelled")
+
     def process_input(self, session, user_input, button_payload=None):
-        """Process user input in active flow."""
+        """Process user input (a NormalizedMessage or text) in active flow."""
+        message = as_message(user_input)
+        user_input = message.raw
         try:
-            flow = frappe.get_doc("WhatsApp Chatbot Flow", session.current_flow)
+            flow = get_flow_graph(session.current_flow)
 
             # Check for cancel keywords
-            if flow.cancel_keywords:
-                cancel_words = [w.strip().lower() for w in flow.cancel_keywords.split(",") if w.strip()]
-                if user_input.lower() in cancel_words:
-                    session.status = "Cancelled"
-                    session.completed_at = datetime.now()
-                    session.save(ignore_permissions=True)
-                    frappe.db.commit()
-                    return "Your request has been cancelled."
-
-            # Find current step
-            current_step = None
-            for step in flow.steps:
-                if step.step_name == session.current_step:
-                    current_step = step
-                    break
+            if message.folded in flow.cancel_words:
+                session.status = "Cancelled"
+                session.completed_at = datetime.now()
+                session.save(ignore_permissions=True)
+                return "Your request has been cancelled."
 
+            current_step = flow.get_step(session.current_step)
             if not current_step:
                 return self.complete_flow(session, flow)
 
@@ -149,41 +155,31 @@ class FlowEngine:
 
                     if current_step.retry_on_invalid and session.step_retries < max_retries:
                         session.save(ignore_permissions=True)
-                        frappe.db.commit()
                         return error or current_step.validation_error or "Invalid input. Please try again."
                     else:
                         # Max retries reached, cancel flow
                         session.status = "Cancelled"
                         session.completed_at = datetime.now()
                         session.save(ignore_permissions=True)
-                        frappe.db.commit()
                         return "Too many invalid attempts. Please start again."
 
                 # Store input
                 if current_step.store_as:
                     session_data = parse_json(session.session_data, {})
                     session_data[current_step.store_as] = input_value
-                    session.session_data = json.dumps(session_data)
+                    session.session_data = session_data
 
             # Log message in session
             session.add_message("Incoming", user_input, current_step.step_name)
 
             # Determine next step
-            next_step_name = self.get_next_step(current_step, flow.steps, user_input, button_payload)
+            next_step_name = self.get_next_step(current_step, flow, message, button_payload)
 
             if not next_step_name:
                 # No next step, complete flow
-                session.save(ignore_permissions=True)
-                frappe.db.commit()
                 return self.complete_flow(session, flow)
 
-            # Find next step
-            next_step = None
-            for step in flow.steps:
-                if step.step_name == next_step_name:
-                    next_step = step
-                    break
-
+            next_step = flow.get_step(next_step_name)
             if not next_step:
                 return self.complete_flow(session, flow)
 
@@ -192,21 +188,16 @@ class FlowEngine:
             if next_step.skip_condition:
                 if self.evaluate_skip_condition(next_step.skip_condition, session_data):
                     # Skip this step, find the one after
-                    next_step_name = self.get_next_step(next_step, flow.steps, None, None)
+                    next_step_name = self.get_next_step(next_step, flow, None, None)
                     if not next_step_name:
                         return self.complete_flow(session, flow)
 
-                    for step in flow.steps:
-                        if step.step_name == next_step_name:
-                            next_step = step
-                            break
+                    next_step = flow.get_step(next_step_name) or next_step
 
             # Update session
             session.current_step = next_step.step_name
             session.step_retries = 0
             session.last_activity = datetime.now()
-            session.save(ignore_permissions=True)
-            frappe.db.commit()
 
             # Build and return next step message
             response = self.build_step_message(next_step, session)
@@ -215,7 +206,6 @@ class FlowEngine:
             if isinstance(response, str):
                 session.add_message("Outgoing", response, next_step.step_name)
             session.save(ignore_permissions=True)
-            frappe.db.commit()
 
             return response
 
@@ -248,8 +238,8 @@ class FlowEngine:
 
         if input_type == "Select":
             if step.options:
-                options = [o.strip().lower() for o in step.options.split("|") if o.strip()]
-                if user_input.lower() not in options:
+                options = [fold_text(o) for o in step.options.split("|") if o.strip()]
+                if fold_text(user_input) not in options:
                     return False, f"Please choose one of: {step.options.replace('|', ', ')}"
 
         elif input_type == "Number":
@@ -281,23 +271,29 @@ class FlowEngine:
             if not valid_date:
                 return False, "Please enter a valid date (e.g., DD-MM-YYYY)."
 
-        # Custom regex validation
+        # Custom regex validation (time limited, running out counts as invalid)
         if step.validation_regex:
+            from frappe_whatsapp_chatbot.chatbot.regex_guard import get_pattern
+
             try:
-                if not re.match(step.validation_regex, user_input):
-                    return False, step.validation_error or "Invalid format."
+                pattern = get_pattern(step.validation_regex)
             except re.error:
-                pass  # Invalid regex, skip validation
+                pattern = None  # Invalid regex, skip validation
+            if pattern and not pattern.match(user_input, source=f"Flow step {step.step_name}"):
+                return False, step.validation_error or "Invalid format."
 
         return True, None
 
     def get_next_step(self, current_step, all_steps, user_input, button_payload):
-        """Determine the next step based on input."""
+        """Determine the next step based on input (a NormalizedMessage or text).
+
+        ``all_steps`` is the FlowGraph of the flow, or a list of its steps.
+        """
         # Check conditional next
         if current_step.conditional_next:
             conditions = parse_json(current_step.conditional_next, {})
             if conditions:
-                response_key = button_payload or (user_input.lower() if user_input else "")
+                response_key = button_payload or (as_message(user_input).folded if user_input else "")
 
                 if response_key in conditions:
                     return conditions[response_key]
@@ -309,6 +305,9 @@ class FlowEngine:
             return current_step.next_step
 
         # Find next step by order
+        if isinstance(all_steps, FlowGraph):
+            return all_steps.successors.get(current_step.step_name)
+
         sorted_steps = sorted(all_steps, key=lambda x: x.idx)
         current_idx = None
         for i, step in enumerate(sorted_steps):
@@ -372,17 +371,11 @@ class FlowEngine:
         return message
 
     def evaluate_skip_condition(self, condition, data):
-        """Evaluate skip condition."""
+        """Evaluate skip condition (compiled once, then cached)."""
+        from frappe_whatsapp_chatbot.chatbot.expressions import evaluate_expression
+
         try:
-            eval_globals = {
-                "data": data,
-                "len": len,
-                "str": str,
-                "int": int,
-                "float": float,
-                "bool": bool,
-            }
-            return frappe.safe_eval(condition, eval_globals=eval_globals, eval_locals={})
+            return evaluate_expression(condition, {"data": data})
         except Exception:
             return False
 
@@ -404,8 +397,6 @@ class FlowEngine:
             elif flow.on_complete_action == "Run Script":
                 self.run_script(flow.custom_script, session_data)
 
-            frappe.db.commit()
-
             # Build completion message with variable substitution
             completion_msg = flow.completion_message or "Thank you! Your request has been submitted."
             for key, value in session_data.items():
@@ -458,7 +449,6 @@ class FlowEngine:
 
             doc = frappe.get_doc(doc_data)
             doc.insert(ignore_permissions=True)
-            frappe.db.commit()
 
             frappe.log_error(
                 f"create_document: Successfully created {flow.create_doctype} with data: {doc_data}",
@@ -0,0 +1,252 @@
+import frappe
+from typing import NamedTuple
+from frappe_whatsapp_chatbot.chatbot.utils import fold_text, parse_json
+
+FLOW_GRAPH_VERSION_KEY = "whatsapp_chatbot:flow_graph_version"
+
+FLOW_FIELDS = [
+    "name", "flow_name", "enabled", "whatsapp_account", "trigger_keywords", "trigger_on_button",
+    "initial_message", "initial_message_type", "initial_template", "completion_message",
+    "on_complete_action", "create_doctype", "field_mapping", "api_endpoint", "custom_script",
+    "timeout_message", "cancel_keywords"
+]
+
+# Compiled flows kept in process memory, per site and flow
+_graphs = {}
+
+# Flow trigger indexes kept in process memory, per site and account
+_trigger_indexes = {}
+
+TRIGGER_FIELDS = ["name", "flow_name", "whatsapp_account", "trigger_keywords", "trigger_on_button"]
+
+
+class FlowStep(NamedTuple):
+    """A flow step with its JSON fields parsed."""
+
+    idx: int
+    step_name: str
+    message: str
+    message_type: str
+    template: str
+    response_script: str
+    input_type: str
+    options: str
+    buttons: list
+    whatsapp_flow: str
+    flow_cta: str
+    flow_screen: str
+    flow_field_mapping: dict
+    validation_regex: str
+    validation_error: str
+    store_as: str
+    next_step: str
+    conditional_next: dict
+    skip_condition: str
+    retry_on_invalid: int
+    max_retries: int
+
+
+class FlowGraph:
+    """A WhatsApp Chatbot Flow compiled for execution.
+
+    Steps are looked up by name, each step's successor in step order is
+    precomputed and the ``buttons``, ``conditional_next`` and
+    ``flow_field_mapping`` JSON is parsed once. The other flow fields are
+    attributes, so a graph can be used wherever the flow document was.
+
+    Graphs are shared by every turn of a process: treat them as read-only.
+    """
+
+    def __init__(self, flow):
+        for field in FLOW_FIELDS:
+            setattr(self, field, flow.get(field))
+
+        self.field_mapping = parse_json(self.field_mapping, {})
+        self.cancel_words = frozenset(
+            fold_text(word) for word in (self.cancel_keywords or "").split(",") if word.strip()
+        )
+
+        self.steps = tuple(
+            compile_step(step) for step in sorted(flow.get("steps") or [], key=lambda step: step.idx)
+        )
+        self.steps_by_name = {step.step_name: step for step in self.steps}
+        self.first_step = self.steps[0] if self.steps else None
+
+        # Step that follows each one when it has no explicit next step
+        self.successors = {
+            step.step_name: self.steps[i + 1].step_name if i + 1 < len(self.steps) else None
+            for i, step in enumerate(self.steps)
+        }
+
+    def get_step(self, step_name):
+        """Return the step called ``step_name``, or None."""
+        return self.steps_by_name.get(step_name)
+
+
+class FlowTriggerIndex:
+    """Enabled flows of an account, by trigger keyword and button payload.
+
+    Keywords are folded like incoming messages, so triggering a flow is a
+    single dict lookup. When two flows share a trigger (saving prevents
+    it), the oldest one wins.
+    """
+
+    def __init__(self, flows):
+        self.flows = list(flows)
+        self.keywords = {}
+        self.buttons = {}
+
+        for flow in self.flows:
+            flow.keywords = get_trigger_keywords(flow)
+            for keyword in flow.keywords:
+                self.keywords.setdefault(keyword, flow.name)
+            if flow.trigger_on_button:
+                self.buttons.setdefault(flow.trigger_on_button, flow.name)
+
+    def match(self, message, button_payload=None):
+        """Return the flow triggered by a button payload or folded message text."""
+        if button_payload and button_payload in self.buttons:
+            return self.buttons[button_payload]
+        if message:
+            return self.keywords.get(message)
+        return None
+
+
+def get_trigger_keywords(flow):
+    return {fold_text(k) for k in (flow.trigger_keywords or "").split(",") if k.strip()}
+
+
+def compile_step(step):
+    return FlowStep(
+        idx=step.idx,
+        step_name=step.step_name,
+        message=step.message,
+        message_type=step.message_type,
+        template=step.template,
+        response_script=step.response_script,
+        input_type=step.input_type,
+        options=step.options,
+        buttons=parse_json(step.buttons, []),
+        whatsapp_flow=step.whatsapp_flow,
+        flow_cta=step.flow_cta,
+        flow_screen=step.flow_screen,
+        flow_field_mapping=parse_json(step.flow_field_mapping, {}),
+        validation_regex=step.validation_regex,
+        validation_error=step.validation_error,
+        store_as=step.store_as,
+        next_step=step.next_step,
+        conditional_next=parse_json(step.conditional_next, {}),
+        skip_condition=step.skip_condition,
+        retry_on_invalid=step.retry_on_invalid,
+        max_retries=step.max_retries
+    )
+
+
+def get_flow_graph(flow_name):
+    """Return the compiled graph of a flow.
+
+    Each process keeps its compiled flows until the version in Redis
+    changes, which happens whenever a WhatsApp Chatbot Flow is saved or
+    deleted.
+
+    Raises:
+        frappe.DoesNotExistError if the flow does not exist
+    """
+    version = get_flow_graph_version()
+
+    key = (getattr(frappe.local, "site", None), flow_name)
+    cached = _graphs.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    graph = FlowGraph(frappe.get_doc("WhatsApp Chatbot Flow", flow_name))
+    _graphs[key] = (version, graph)
+    return graph
+
+
+def get_flow_trigger_index(whatsapp_account=None):
+    """Return the flow trigger index of an account.
+
+    Kept per process with the compiled flows, until a flow is saved or
+    deleted.
+    """
+    version = get_flow_graph_version()
+
+    key = (getattr(frappe.local, "site", None), whatsapp_account)
+    cached = _trigger_indexes.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    index = FlowTriggerIndex(load_trigger_flows(whatsapp_account))
+    _trigger_indexes[key] = (version, index)
+    return index
+
+
+def load_trigger_flows(whatsapp_account=None):
+    """Load the enabled flows of an account, oldest first."""
+    flows = frappe.get_all(
+        "WhatsApp Chatbot Flow",
+        filters={"enabled": 1},
+        fields=TRIGGER_FIELDS,
+        order_by="creation asc"
+    )
+
+    # Flows without an account apply to every account
+    return [
+        flow for flow in flows
+        if not flow.whatsapp_account or flow.whatsapp_account == whatsapp_account
+    ]
+
+
+def find_trigger_collisions(doc):
+    """Return the triggers a flow being saved shares with other enabled flows.
+
+    Flows collide when their accounts overlap (a flow without an account
+    overlaps every account).
+
+    Returns:
+        list of (trigger, other flow name) tuples
+    """
+    keywords = get_trigger_keywords(doc)
+    collisions = []
+
+    others = frappe.get_all(
+        "WhatsApp Chatbot Flow",
+        filters={"enabled": 1, "name": ["!=", doc.name or ""]},
+        fields=TRIGGER_FIELDS,
+        order_by="creation asc"
+    )
+    for other in others:
+        if doc.whatsapp_account and other.whatsapp_account and doc.whatsapp_account != other.whatsapp_account:
+            continue
+
+        for keyword in sorted(keywords & get_trigger_keywords(other)):
+            collisions.append((keyword, other.name))
+        if doc.trigger_on_button and doc.trigger_on_button == other.trigger_on_button:
+            collisions.append((doc.trigger_on_button, other.name))
+
+    return collisions
+
+
+def get_flow_graph_version():
+    version = frappe.cache.get_value(FLOW_GRAPH_VERSION_KEY)
+    if not version:
+        version = bump_flow_graph_version()
+    return version
+
+
+def bump_flow_graph_version():
+    """Give flows a new version so every process recompiles them."""
+    version = frappe.generate_hash(length=12)
+    frappe.cache.set_value(FLOW_GRAPH_VERSION_KEY, version)
+    return version
+
+
+def clear_flow_graphs(doc=None, method=None):
+    """Invalidate the compiled flows and trigger indexes on every worker.
+
+    The version changes right away and again once the transaction commits,
+    so a flow compiled from the old rows in between is not kept.
+    """
+    bump_flow_graph_version()
+    frappe.db.after_commit.add(bump_flow_graph_version)
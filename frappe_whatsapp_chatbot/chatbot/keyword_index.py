@@ -0,0 +1,477 @@
+import frappe
+import heapq
+import re
+from collections import deque
+from datetime import datetime, timedelta
+from frappe_whatsapp_chatbot.chatbot.regex_guard import GuardedPattern, get_regex_timeout
+from frappe_whatsapp_chatbot.chatbot.utils import as_message, fold_text, normalize_text, strip_accents
+
+KEYWORD_INDEX_VERSION_KEY = "whatsapp_chatbot:keyword_index_version"
+
+RULE_FIELDS = [
+    "name", "title", "priority", "whatsapp_account", "keywords", "match_type",
+    "case_sensitive", "max_edit_distance", "conditions", "active_from", "active_until",
+    "response_type", "response_text", "response_template", "template_parameters",
+    "media_type", "media_url", "media_caption", "trigger_flow", "script"
+]
+
+# Compiled indexes kept in process memory, per site and account
+_indexes = {}
+
+# Group references change meaning once patterns are combined
+GROUP_REFERENCE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+DEFAULT_EDIT_DISTANCE = 1
+MAX_EDIT_DISTANCE = 3
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton: finds every keyword contained in a text in one pass."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def add(self, keyword, value):
+        node = 0
+        for char in keyword:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = next_node
+        self.output[node].append(value)
+
+    def build(self):
+        """Compute failure links; call once after all keywords are added."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def search(self, text):
+        """Return the values of all keywords found in ``text``."""
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            if self.output[node]:
+                found.update(self.output[node])
+        return found
+
+
+class PrefixTrie:
+    """Trie finding every keyword that ``text`` starts with."""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, keyword, value):
+        node = self.root
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(value)
+
+    def search(self, text):
+        found = set()
+        node = self.root
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            found.update(node.get(None, ()))
+        return found
+
+
+class BKTree:
+    """Burkhard-Keller tree finding the keywords within ``max_distance`` edits of a text.
+
+    Each child hangs off its parent by their edit distance, so by the
+    triangle inequality a search only descends into the children whose edge
+    is within ``max_distance`` of the text's distance to the parent.
+    """
+
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        self.max_length = 0
+        self.root = None
+
+    def add(self, keyword, value):
+        self.max_length = max(self.max_length, len(keyword))
+
+        # Nodes are [keyword, values, children by distance, longest edge]
+        if self.root is None:
+            self.root = [keyword, [value], {}, 0]
+            return
+
+        node = self.root
+        while True:
+            distance = levenshtein(keyword, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [keyword, [value], {}, 0]
+                node[3] = max(node[3], distance)
+                return
+            node = child
+
+    def search(self, text):
+        """Return the values of all keywords close enough to ``text``."""
+        found = set()
+        radius = self.max_distance
+        if self.root is None or len(text) > self.max_length + radius:
+            return found
+
+        stack = [self.root]
+        while stack:
+            keyword, values, children, max_edge = stack.pop()
+            # Past max_edge + radius neither the node nor its children can match
+            distance = levenshtein(text, keyword, max_edge + radius)
+            if distance <= radius:
+                found.update(values)
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+def levenshtein(a, b, limit=None):
+    """Edit distance between two strings (insertions, deletions, substitutions).
+
+    With ``limit``, stops as soon as the distance is known to exceed it and
+    returns ``limit + 1``.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class KeywordIndex:
+    """Keyword rules of one account compiled for matching.
+
+    Rules are ranked by priority (rank 0 is tried first). Keywords are
+    normalized like NormalizedMessage (NFKC, casefolded unless case
+    sensitive). Each match type has its own structure, for case sensitive
+    and insensitive rules:
+    Exact a dict, Contains an Aho-Corasick automaton, Starts With a trie,
+    Fuzzy a BK-tree and Regex precompiled patterns behind one combined
+    alternation that rejects most texts with a single search. Regex
+    searches are time limited (see GuardedPattern).
+
+    Every rule carries its prebuilt outgoing message as ``payload``.
+
+    Given ``now``, only the rules active at that time are indexed, and
+    ``expires_at`` is the next time a rule starts or ends (None if no rule
+    ever changes). Without ``now`` every rule is indexed.
+    """
+
+    def __init__(self, rules, now=None):
+        self.expires_at = None
+        if now is None:
+            self.rules = list(rules)
+        else:
+            self.rules = self.select_active(rules, now)
+
+        self.exact = {True: {}, False: {}}
+        self.contains = {True: AhoCorasick(), False: AhoCorasick()}
+        self.starts_with = {True: PrefixTrie(), False: PrefixTrie()}
+        # One BK-tree per edit distance, so a strict rule doesn't widen every search
+        self.fuzzy = {True: {}, False: {}}
+        self.regex = {True: [], False: []}
+        self.regex_filter = {}
+
+        patterns = {True: [], False: []}
+
+        for rank, rule in enumerate(self.rules):
+            rule.payload = build_payload(rule)
+
+            case_sensitive = bool(rule.case_sensitive)
+            keywords = [k.strip() for k in (rule.keywords or "").split(",") if k.strip()]
+
+            if rule.match_type == "Regex":
+                compiled = self.compile_patterns(rule, keywords, case_sensitive)
+                if compiled:
+                    filtered = not any(GROUP_REFERENCE.search(p.pattern) for p in compiled)
+                    self.regex[case_sensitive].append((rank, compiled, filtered))
+                    if filtered:
+                        patterns[case_sensitive].extend(p.pattern for p in compiled)
+                continue
+
+            for keyword in keywords:
+                # Keys are normalized like the message they are compared to
+                keyword = normalize_text(keyword) if case_sensitive else fold_text(keyword)
+
+                if rule.match_type == "Exact":
+                    self.exact[case_sensitive].setdefault(keyword, []).append(rank)
+                elif rule.match_type == "Contains":
+                    self.contains[case_sensitive].add(keyword, rank)
+                elif rule.match_type == "Starts With":
+                    self.starts_with[case_sensitive].add(keyword, rank)
+                elif rule.match_type == "Fuzzy":
+                    if not case_sensitive:
+                        keyword = strip_accents(keyword)
+                    distance = get_edit_distance(rule)
+                    tree = self.fuzzy[case_sensitive].setdefault(distance, BKTree(distance))
+                    tree.add(normalize_spaces(keyword), rank)
+
+        for case_sensitive in (True, False):
+            self.contains[case_sensitive].build()
+            self.regex_filter[case_sensitive] = self.compile_filter(
+                patterns[case_sensitive], case_sensitive
+            )
+
+    def select_active(self, rules, now):
+        """Return the rules active at ``now`` and set ``expires_at``."""
+        from frappe.utils import get_datetime
+
+        active = []
+        boundaries = []
+
+        for rule in rules:
+            active_from = get_datetime(rule.active_from) if rule.active_from else None
+            active_until = get_datetime(rule.active_until) if rule.active_until else None
+
+            if active_from and now < active_from:
+                boundaries.append(active_from)
+                continue
+            if active_until and now > active_until:
+                continue
+
+            if active_until:
+                # Still active at active_until itself
+                boundaries.append(active_until + timedelta(microseconds=1))
+            active.append(rule)
+
+        self.expires_at = min(boundaries) if boundaries else None
+        return active
+
+    def is_expired(self, now):
+        """Check if a rule has started or ended since the index was built."""
+        return self.expires_at is not None and now >= self.expires_at
+
+    @staticmethod
+    def compile_patterns(rule, keywords, case_sensitive):
+        flags = 0 if case_sensitive else re.IGNORECASE
+        compiled = []
+        for keyword in keywords:
+            try:
+                compiled.append(GuardedPattern(keyword, flags))
+            except re.error as e:
+                frappe.log_error(f"Invalid regex in keyword rule '{rule.name}': {str(e)}")
+        return compiled
+
+    @staticmethod
+    def compile_filter(patterns, case_sensitive):
+        """Combine patterns into one alternation, or None if they can't be.
+
+        Patterns with named groups or inline flags may not combine; their
+        rules are then all checked one by one.
+        """
+        if not patterns:
+            return None
+        try:
+            return GuardedPattern(
+                "|".join(f"(?:{p})" for p in patterns),
+                0 if case_sensitive else re.IGNORECASE
+            )
+        except re.error:
+            return None
+
+    def iter_matches(self, message):
+        """Yield the rules matching a message, highest priority first.
+
+        Args:
+            message: NormalizedMessage or text
+        """
+        message = as_message(message)
+        text, folded = message.text, message.folded
+
+        ranks = set()
+        ranks.update(self.exact[True].get(text, ()))
+        ranks.update(self.exact[False].get(folded, ()))
+        ranks.update(self.contains[True].search(text))
+        ranks.update(self.contains[False].search(folded))
+        ranks.update(self.starts_with[True].search(text))
+        ranks.update(self.starts_with[False].search(folded))
+        # Typos also cover missing accents in case-insensitive fuzzy keywords
+        for case_sensitive, value in ((True, text), (False, message.unaccented)):
+            if self.fuzzy[case_sensitive]:
+                value = normalize_spaces(value)
+                for tree in self.fuzzy[case_sensitive].values():
+                    ranks.update(tree.search(value))
+
+        # Regex rules are only searched when reached in priority order
+        merged = heapq.merge(
+            sorted(ranks),
+            self.iter_regex_matches(text, True),
+            self.iter_regex_matches(text, False)
+        )
+        for rank in merged:
+            yield self.rules[rank]
+
+    def iter_regex_matches(self, text, case_sensitive):
+        rules = self.regex[case_sensitive]
+        if not rules:
+            return
+
+        # Every search is time limited; one that runs out counts as no match
+        # (for the combined pattern: as a possible match)
+        timeout = get_regex_timeout()
+
+        # Rules behind the combined pattern can be skipped when it finds
+        # nothing; rules using group references are always checked
+        combined = self.regex_filter[case_sensitive]
+        rejected = bool(combined) and not combined.search(
+            text, source="Keyword regex filter", default=True, timeout=timeout
+        )
+
+        for rank, patterns, filtered in rules:
+            if filtered and rejected:
+                continue
+            source = self.rules[rank].name
+            if any(pattern.search(text, source=source, timeout=timeout) for pattern in patterns):
+                yield rank
+
+
+def normalize_spaces(text):
+    """Trim a text and collapse its runs of whitespace to single spaces."""
+    return " ".join(text.split())
+
+
+def get_edit_distance(rule):
+    """Return the number of typos a Fuzzy rule tolerates."""
+    if rule.max_edit_distance is None:
+        return DEFAULT_EDIT_DISTANCE
+    return min(max(int(rule.max_edit_distance), 0), MAX_EDIT_DISTANCE)
+
+
+def build_payload(rule):
+    """Build the outgoing message of a Text, Template or Media rule.
+
+    Flow and Script rules are answered at match time and have no payload.
+    """
+    if rule.response_type == "Text":
+        return rule.response_text
+
+    elif rule.response_type == "Template":
+        payload = {
+            "use_template": 1,
+            "template": rule.response_template,
+            "message_type": "Template"
+        }
+        if rule.template_parameters:
+            payload["body_param"] = rule.template_parameters
+        return payload
+
+    elif rule.response_type == "Media":
+        return {
+            "content_type": rule.media_type.lower() if rule.media_type else "image",
+            "media_image": rule.media_url if rule.media_type == "Image" else None,
+            "media_video": rule.media_url if rule.media_type == "Video" else None,
+            "media_audio": rule.media_url if rule.media_type == "Audio" else None,
+            "media_document": rule.media_url if rule.media_type == "Document" else None,
+            "message": rule.media_caption or ""
+        }
+
+    return None
+
+
+def get_keyword_index(whatsapp_account=None):
+    """Return the compiled keyword index of an account.
+
+    Each process keeps its compiled indexes until the version in Redis
+    changes, which happens whenever a WhatsApp Keyword Reply or a WhatsApp
+    Template is saved or deleted. The index only holds the rules active
+    now; when one starts or ends it is rebuilt from the rules already loaded.
+    """
+    version = frappe.cache.get_value(KEYWORD_INDEX_VERSION_KEY)
+    if not version:
+        version = bump_keyword_index_version()
+
+    now = datetime.now()
+    key = (getattr(frappe.local, "site", None), whatsapp_account)
+    cached = _indexes.get(key)
+    if cached and cached[0] == version:
+        rules, index = cached[1], cached[2]
+        if not index.is_expired(now):
+            return index
+    else:
+        rules = load_rules(whatsapp_account, now)
+
+    index = KeywordIndex(rules, now)
+    _indexes[key] = (version, rules, index)
+    return index
+
+
+def load_rules(whatsapp_account=None, now=None):
+    """Load enabled keyword rules for an account, highest priority first.
+
+    Rules that ended before ``now`` are left out.
+    """
+    or_filters = None
+    if now:
+        or_filters = [["active_until", "is", "not set"], ["active_until", ">=", now]]
+
+    try:
+        rules = frappe.get_all(
+            "WhatsApp Keyword Reply",
+            filters={"enabled": 1},
+            or_filters=or_filters,
+            fields=RULE_FIELDS,
+            order_by="priority desc, creation asc"
+        )
+    except Exception as e:
+        frappe.log_error(f"KeywordMatcher load_rules error: {str(e)}")
+        return []
+
+    # Rules without an account apply to every account
+    return [
+        rule for rule in rules
+        if not rule.whatsapp_account or rule.whatsapp_account == whatsapp_account
+    ]
+
+
+def bump_keyword_index_version():
+    """Give keyword rules a new version so every process recompiles them."""
+    version = frappe.generate_hash(length=12)
+    frappe.cache.set_value(KEYWORD_INDEX_VERSION_KEY, version)
+    return version
+
+
+def clear_keyword_index(doc=None, method=None):
+    """Invalidate the compiled keyword indexes on every worker.
+
+    The version changes right away and again once the transaction commits,
+    so an index rebuilt from the old rows in between is not kept.
+    """
+    bump_keyword_index_version()
+    frappe.db.after_commit.add(bump_keyword_index_version)
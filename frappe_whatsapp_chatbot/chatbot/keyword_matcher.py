@@ -1,6 +1,7 @@
 import frappe
-import re
-from datetime import datetime
+from frappe_whatsapp_chatbot.chatbot.expressions import evaluate_expression
+from frappe_whatsapp_chatbot.chatbot.keyword_index import get_keyword_index
+from frappe_whatsapp_chatbot.chatbot.utils import as_message
 
 
 class KeywordMatcher:
@@ -8,110 +9,39 @@ class KeywordMatcher:
 
     def __init__(self, whatsapp_account=None):
         self.account = whatsapp_account
-        self.rules = self.load_rules()
+        self.index = get_keyword_index(whatsapp_account)
 
-    def load_rules(self):
-        """Load active keyword rules sorted by priority."""
-        try:
-            rules = frappe.get_all(
-                "WhatsApp Keyword Reply",
-                filters={"enabled": 1},
-                fields=["*"],
-                order_by="priority desc"
-            )
-
-            # Filter by account and date range
-            now = datetime.now()
-            valid_rules = []
-
-            for rule in rules:
-                # Check account filter
-                if rule.whatsapp_account and rule.whatsapp_account != self.account:
-                    continue
+    @property
+    def rules(self):
+        """Enabled keyword rules of this account, sorted by priority."""
+        return self.index.rules
 
-                # Check date range
-                if rule.active_from and now < rule.active_from:
-                    continue
-                if rule.active_until and now > rule.active_until:
-                    continue
+    def match(self, message):
+        """Find the highest priority rule matching the message.
 
-                valid_rules.append(rule)
+        ``message`` is a NormalizedMessage or a plain text.
 
-            return valid_rules
-
-        except Exception as e:
-            frappe.log_error(f"KeywordMatcher load_rules error: {str(e)}")
-            return []
-
-    def match(self, message_text):
-        """Find matching keyword rule for message."""
-        if not message_text:
+        Returns the cached rule (a dict with the Keyword Reply's fields and
+        its prebuilt ``payload``), without querying the database. Rules
+        outside their active dates are not in the index.
+        """
+        message = as_message(message)
+        if not message.raw:
             return None
 
-        for rule in self.rules:
-            if self.rule_matches(rule, message_text):
-                # Check additional conditions
-                if rule.conditions:
-                    if not self.evaluate_conditions(rule.conditions, message_text):
-                        continue
-                return frappe.get_doc("WhatsApp Keyword Reply", rule.name)
+        for rule in self.index.iter_matches(message):
+            # Check additional conditions
+            if rule.conditions:
+                if not self.evaluate_conditions(rule.conditions, message.raw):
+                    continue
+            return rule
 
         return None
 
-    def rule_matches(self, rule, message_text):
-        """Check if a rule matches the message."""
-        if not rule.keywords:
-            return False
-
-        keywords = [k.strip() for k in rule.keywords.split(",") if k.strip()]
-
-        text = message_text if rule.case_sensitive else message_text.lower()
-
-        for keyword in keywords:
-            kw = keyword if rule.case_sensitive else keyword.lower()
-
-            if rule.match_type == "Exact":
-                if text == kw:
-                    return True
-
-            elif rule.match_type == "Contains":
-                if kw in text:
-                    return True
-
-            elif rule.match_type == "Starts With":
-                if text.startswith(kw):
-                    return True
-
-            elif rule.match_type == "Regex":
-                try:
-                    flags = 0 if rule.case_sensitive else re.IGNORECASE
-                    if re.search(kw, message_text, flags):
-                        return True
-                except re.error as e:
-                    frappe.log_error(
-                        f"Invalid regex in keyword rule '{rule.name}': {str(e)}"
-                    )
-
-        return False
-
     def evaluate_conditions(self, conditions, message_text):
-        """Evaluate Python conditions for rule."""
+        """Evaluate Python conditions for rule (compiled once, then cached)."""
         try:
-            # Create a safe evaluation context
-            eval_globals = {
-                "message": message_text,
-                "len": len,
-                "str": str,
-                "int": int,
-                "float": float,
-                "bool": bool,
-            }
-
-            return frappe.safe_eval(
-                conditions,
-                eval_globals=eval_globals,
-                eval_locals={}
-            )
+            return evaluate_expression(conditions, {"message": message_text})
         except Exception as e:
             frappe.log_error(f"Condition evaluation error: {str(e)}")
             return False
@@ -0,0 +1,402 @@
+import frappe
+import json
+import random
+import time
+from frappe_whatsapp_chatbot.chatbot.rate_limit import acquire_send_token
+
+# Send queue priorities, lowest is sent first
+PRIORITY_INTERACTIVE = 0  # replies to an incoming message
+PRIORITY_NOTIFICATION = 1  # session timeout notices
+PRIORITY_BULK = 2  # broadcasts and other bulk sends
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_NOTIFICATION, PRIORITY_BULK)
+
+# Accounts that have messages waiting in their send queue
+SEND_QUEUE_ACCOUNTS_KEY = "whatsapp_chatbot:send_queue_accounts"
+
+# Recipient whose earlier message is waiting for a retry: later messages to
+# them are pushed back behind it
+SEND_BLOCKED_KEY = "whatsapp_chatbot:send_blocked:{account}:{to}"
+
+MAX_SEND_ATTEMPTS = 5
+# Retry delay in seconds, doubled on every attempt
+BACKOFF_BASE = 2
+BACKOFF_MAX = 300
+# Longest a drain job keeps sending before it makes way for other jobs on
+# the queue (and queues itself again)
+DRAIN_MAX_RUNTIME = 30
+# Longest a drain job waits in place for a token or a retry; longer waits
+# are left to a delayed job
+DRAIN_MAX_SLEEP = 1
+
+
+class ResponseBatch:
+    """Collect the outgoing messages of one turn and send them together.
+
+    Responses are queued with add() while the turn is processed, then
+    flush() inserts one WhatsApp Message per response, in the order they
+    were added, and commits the turn (messages and session changes) once.
+    frappe_whatsapp sends a message when it is inserted, so insertion order
+    is delivery order.
+
+    Sends are rate limited per WhatsApp Account. Once the account is out of
+    tokens (or a send fails), the remaining responses go to the account's
+    send queue, still in order, and a background job delivers them. They
+    are only queued once the turn commits, so they never go out ahead of
+    it, or at all if it rolls back.
+    """
+
+    def __init__(self, phone_number, whatsapp_account, priority=PRIORITY_INTERACTIVE):
+        self.phone_number = phone_number
+        self.account = whatsapp_account
+        self.priority = priority
+        self.responses = []
+
+    def __len__(self):
+        return len(self.responses)
+
+    def add(self, response):
+        """Queue a response: a text, a message dict, or a list of those."""
+        if not response:
+            return
+
+        if isinstance(response, (list, tuple)):
+            for item in response:
+                self.add(item)
+            return
+
+        if isinstance(response, (str, dict)):
+            self.responses.append(response)
+
+    def build_message(self, response):
+        """Return the WhatsApp Message document for a queued response."""
+        return build_message(self.phone_number, self.account, response)
+
+    def flush(self, commit=True):
+        """Send all queued responses in order and commit the turn.
+
+        A response that fails to send is rolled back, logged and retried
+        from the send queue together with the ones after it.
+
+        Args:
+            commit: Commit the transaction after sending
+
+        Returns:
+            list of inserted WhatsApp Message names
+        """
+        sent = []
+        responses, self.responses = self.responses, []
+
+        # Don't overtake messages already waiting for this account
+        deferred = bool(responses) and has_pending_sends(self.account, self.priority)
+        ready_at = time.time()
+
+        for response in responses:
+            if not deferred:
+                deferred = not acquire_send_token(self.account)[0]
+
+            if deferred:
+                queue_message(
+                    self.phone_number, self.account, response, self.priority,
+                    not_before=ready_at, after_commit=True
+                )
+                ready_at += 0.000001  # Keep the order of the batch
+                continue
+
+            frappe.db.savepoint("chatbot_response")
+            try:
+                msg = self.build_message(response)
+                msg.insert(ignore_permissions=True)
+                sent.append(msg.name)
+            except Exception as e:
+                # Undo only this message, keep the rest of the turn
+                frappe.db.rollback(save_point="chatbot_response")
+                frappe.log_error(
+                    f"Chatbot send_response error: {str(e)}",
+                    "WhatsApp Chatbot Error"
+                )
+
+                deferred = True
+                backoff = get_backoff(1)
+                ready_at = time.time() + backoff
+                queue_message(
+                    self.phone_number, self.account, response, self.priority,
+                    attempts=1, not_before=ready_at, after_commit=True, block_for=backoff
+                )
+                ready_at += 0.000001
+
+        if commit:
+            frappe.db.commit()
+        return sent
+
+
+def build_message(phone_number, whatsapp_account, response):
+    """Return an outgoing WhatsApp Message document for a response."""
+    msg_data = {
+        "doctype": "WhatsApp Message",
+        "type": "Outgoing",
+        "to": phone_number,
+        "whatsapp_account": whatsapp_account
+    }
+
+    if isinstance(response, str):
+        # Simple text response
+        msg_data.update({"message": response, "content_type": "text"})
+    else:
+        # Complex response (template, media, buttons, etc.)
+        msg_data.update(response)
+
+    msg = frappe.get_doc(msg_data)
+    # Prevent the after_insert hook from processing our outgoing message
+    msg.flags.ignore_chatbot = True
+    return msg
+
+
+def get_send_queue_key(whatsapp_account, priority):
+    """Redis sorted set of queued messages, scored by when they may be sent."""
+    return frappe.cache.make_key(f"whatsapp_chatbot:send_queue:{whatsapp_account or ''}:{priority}")
+
+
+def get_backoff(attempts):
+    """Seconds to wait before retry number ``attempts``, with some jitter."""
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def queue_message(
+    phone_number, whatsapp_account, response, priority=PRIORITY_BULK, attempts=0,
+    not_before=None, after_commit=False, block_for=None
+):
+    """Add a message to the account's send queue and make sure it is drained.
+
+    Args:
+        phone_number: Recipient
+        whatsapp_account: WhatsApp Account to send from
+        response: Text or message dict
+        priority: PRIORITY_INTERACTIVE, PRIORITY_NOTIFICATION or PRIORITY_BULK
+        attempts: Number of failed attempts so far
+        not_before: Optional timestamp before which the message is not sent
+        after_commit: Only queue it once the current transaction commits
+        block_for: Seconds this (retried) message was pushed back; later
+            messages to the same recipient are pushed back as much, so they
+            stay behind it
+
+    Returns:
+        id of the queued message
+    """
+    message_id = frappe.generate_hash(length=10)
+    payload = json.dumps({
+        "id": message_id,
+        "to": phone_number,
+        "whatsapp_account": whatsapp_account,
+        "response": response,
+        "priority": priority,
+        "attempts": attempts
+    }, default=str)
+    score = not_before or time.time()
+
+    def push():
+        if block_for:
+            block_recipient(whatsapp_account, phone_number, message_id, block_for)
+        frappe.cache.zadd(get_send_queue_key(whatsapp_account, priority), {payload: score})
+        frappe.cache.sadd(SEND_QUEUE_ACCOUNTS_KEY, whatsapp_account or "")
+        enqueue_drain(whatsapp_account)
+
+    if after_commit:
+        frappe.db.after_commit.add(push)
+    else:
+        push()
+
+    return message_id
+
+
+def get_blocked_key(whatsapp_account, phone_number):
+    return frappe.cache.make_key(SEND_BLOCKED_KEY.format(account=whatsapp_account or "", to=phone_number))
+
+
+def block_recipient(whatsapp_account, phone_number, message_id, shift):
+    """Keep later messages to a recipient behind a message waiting for a retry.
+
+    Args:
+        message_id: The message waiting for its retry
+        shift: Seconds it was pushed back
+    """
+    frappe.cache.set(
+        get_blocked_key(whatsapp_account, phone_number),
+        json.dumps({"id": message_id, "shift": shift}),
+        ex=int(shift) + BACKOFF_MAX
+    )
+
+
+def unblock_recipient(whatsapp_account, phone_number, message_id):
+    """Let messages to a recipient go once its retried message is done with."""
+    key = get_blocked_key(whatsapp_account, phone_number)
+    blocked = frappe.cache.get(key)
+    if blocked and json.loads(blocked)["id"] == message_id:
+        frappe.cache.delete(key)
+
+
+def get_recipient_shift(payload):
+    """Return how far a queued message must be pushed back to stay behind an
+    earlier message to the same recipient that is waiting for a retry, or 0."""
+    blocked = frappe.cache.get(get_blocked_key(payload["whatsapp_account"], payload["to"]))
+    if not blocked:
+        return 0
+
+    blocked = json.loads(blocked)
+    return 0 if blocked["id"] == payload["id"] else blocked["shift"]
+
+
+def has_pending_sends(whatsapp_account, priority=PRIORITY_BULK):
+    """Check if messages of ``priority`` or higher are waiting for an account."""
+    return any(
+        frappe.cache.zcard(get_send_queue_key(whatsapp_account, p))
+        for p in PRIORITIES if p <= priority
+    )
+
+
+def enqueue_drain(whatsapp_account, delay=0):
+    """Queue the job sending an account's queued messages.
+
+    Without ``delay`` the job is only queued if none is waiting already.
+    """
+    from frappe_whatsapp_chatbot.chatbot.dispatcher import enqueue_in, get_queue_name
+    from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+    method = "frappe_whatsapp_chatbot.chatbot.outbox.drain_send_queue"
+    queue = get_settings().background_queue
+
+    if delay:
+        enqueue_in(method, delay, queue, whatsapp_account=whatsapp_account)
+        return
+
+    frappe.enqueue(
+        method,
+        queue=get_queue_name(queue),
+        job_id=f"whatsapp_chatbot_send_queue:{frappe.local.site}:{whatsapp_account or ''}",
+        deduplicate=True,
+        whatsapp_account=whatsapp_account
+    )
+
+
+def drain_send_queues():
+    """Scheduled job: make sure every account with queued messages is drained.
+
+    Picks up retries whose delayed drain job did not run.
+    """
+    for account in frappe.cache.smembers(SEND_QUEUE_ACCOUNTS_KEY) or []:
+        account = account.decode() if isinstance(account, bytes) else account
+        enqueue_drain(account or None)
+
+
+def drain_send_queue(whatsapp_account=None):
+    """Background job: send an account's queued messages at its rate limit.
+
+    Higher priority messages go first; within a priority, messages are sent
+    in the order they were queued, and a recipient's messages never overtake
+    one of theirs waiting for a retry.
+
+    The job shares the chatbot queue with conversations, so it never waits
+    long: it sends for at most DRAIN_MAX_RUNTIME seconds and leaves longer
+    waits (slow rate limits, retries) to a delayed job.
+    """
+    deadline = time.time() + DRAIN_MAX_RUNTIME
+
+    while True:
+        if time.time() >= deadline:
+            enqueue_drain(whatsapp_account, delay=DRAIN_MAX_SLEEP)
+            return
+
+        item = get_next_queued(whatsapp_account)
+
+        if not item:
+            next_at = get_next_ready_at(whatsapp_account)
+            if next_at is None:
+                frappe.cache.srem(SEND_QUEUE_ACCOUNTS_KEY, whatsapp_account or "")
+                if not has_pending_sends(whatsapp_account):
+                    return
+                # Queued while we were finishing up
+                frappe.cache.sadd(SEND_QUEUE_ACCOUNTS_KEY, whatsapp_account or "")
+                continue
+
+            wait = next_at - time.time()
+
+        else:
+            key, member, score = item
+            payload = json.loads(member)
+
+            shift = get_recipient_shift(payload)
+            if shift:
+                # Behind a retry of the same recipient
+                frappe.cache.zadd(key, {member: score + shift}, xx=True)
+                continue
+
+            allowed, wait = acquire_send_token(whatsapp_account)
+            if allowed:
+                if frappe.cache.zrem(key, member):  # Unless another worker took it
+                    send_queued_message(payload, score)
+                continue
+
+        if wait > DRAIN_MAX_SLEEP:
+            enqueue_drain(whatsapp_account, delay=wait)
+            return
+
+        time.sleep(max(0, wait))
+
+
+def get_next_queued(whatsapp_account):
+    """Return (key, member, score) of the next message that may be sent now."""
+    now = time.time()
+    for priority in PRIORITIES:
+        key = get_send_queue_key(whatsapp_account, priority)
+        members = frappe.cache.zrangebyscore(key, "-inf", now, start=0, num=1, withscores=True)
+        if members:
+            return key, members[0][0], members[0][1]
+    return None
+
+
+def get_next_ready_at(whatsapp_account):
+    """Return when the next queued (backed off) message may be sent, if any."""
+    ready_at = []
+    for priority in PRIORITIES:
+        first = frappe.cache.zrange(get_send_queue_key(whatsapp_account, priority), 0, 0, withscores=True)
+        if first:
+            ready_at.append(first[0][1])
+    return min(ready_at) if ready_at else None
+
+
+def send_queued_message(payload, score=None):
+    """Send a message taken from the send queue, re-queueing it on failure.
+
+    A message being retried keeps the recipient's later messages behind it.
+    """
+    try:
+        msg = build_message(payload["to"], payload["whatsapp_account"], payload["response"])
+        msg.insert(ignore_permissions=True)
+        frappe.db.commit()
+
+    except Exception as e:
+        frappe.db.rollback()
+
+        attempts = (payload.get("attempts") or 0) + 1
+        if attempts >= MAX_SEND_ATTEMPTS:
+            unblock_recipient(payload["whatsapp_account"], payload["to"], payload["id"])
+            frappe.log_error(
+                f"Chatbot message to {payload['to']} dropped after {attempts} attempts: {str(e)}",
+                "WhatsApp Chatbot Error"
+            )
+            return
+
+        retry_at = time.time() + get_backoff(attempts)
+        # Its id changes: the old block (if any) is replaced by the new one
+        queue_message(
+            payload["to"],
+            payload["whatsapp_account"],
+            payload["response"],
+            payload.get("priority", PRIORITY_BULK),
+            attempts=attempts,
+            not_before=retry_at,
+            block_for=retry_at - (score or time.time())
+        )
+        return
+
+    unblock_recipient(payload["whatsapp_account"], payload["to"], payload["id"])
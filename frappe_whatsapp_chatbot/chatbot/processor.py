@@ -1,9 +1,6 @@
 import frappe
+import time
 from frappe import _
-from datetime import datetime
-
-# Flag to prevent recursive processing
-_processing_messages = set()
 
 
 class ChatbotProcessor:
@@ -20,6 +17,7 @@ class ChatbotProcessor:
         self.message_name = message_data.get("name")
         self.phone_number = message_data.get("from") or message_data.get("from_")
         self.message_text = message_data.get("message") or ""
+        self.message = None  # NormalizedMessage, built when processing starts
         self.content_type = message_data.get("content_type") or "text"
         self.account = message_data.get("whatsapp_account")
         self.button_payload = None
@@ -43,18 +41,32 @@ class ChatbotProcessor:
                     self.flow_response = flow_response_data
 
         self.settings = None
+        self.session = None  # SessionState of the active session, flushed after the turn
+
+        from frappe_whatsapp_chatbot.chatbot.outbox import ResponseBatch
+        from frappe_whatsapp_chatbot.chatbot.tracing import Trace
+        self.batch = ResponseBatch(self.phone_number, self.account)
+        self.trace = Trace(self.message_name, sampled=False)
+
+    def get_message(self):
+        """Return the NormalizedMessage shared by every matching stage."""
+        if self.message is None:
+            from frappe_whatsapp_chatbot.chatbot.utils import normalize_message
+            self.message = normalize_message(self.message_text, self.phone_number)
+        return self.message
 
     def get_chatbot_settings(self):
-        """Get chatbot configuration."""
+        """Get chatbot configuration snapshot."""
         if self.settings is not None:
             return self.settings
 
         try:
-            if frappe.db.exists("WhatsApp Chatbot"):
-                settings = frappe.get_single("WhatsApp Chatbot")
-                if settings.enabled:
-                    self.settings = settings
-                    return settings
+            from frappe_whatsapp_chatbot.chatbot.settings import get_enabled_settings
+
+            settings = get_enabled_settings()
+            if settings:
+                self.settings = settings
+                return settings
         except Exception as e:
             frappe.log_error(f"get_chatbot_settings error: {str(e)}")
 
@@ -78,8 +90,8 @@ class ChatbotProcessor:
                 return False
 
         # Check excluded numbers
-        excluded = [row.phone_number for row in settings.excluded_numbers]
-        if self.phone_number in excluded:
+        from frappe_whatsapp_chatbot.chatbot.exclusions import is_excluded
+        if is_excluded(self.phone_number):
             return False
 
         # Check if transferred to agent
@@ -91,143 +103,156 @@ class ChatbotProcessor:
     def is_transferred_to_agent(self):
         """Check if this conversation has been transferred to a human agent."""
         try:
-            return frappe.db.exists("WhatsApp Agent Transfer", {
-                "phone_number": self.phone_number,
-                "status": "Active"
-            })
+            from frappe_whatsapp_chatbot.chatbot.agent_transfers import get_active_transfer
+            return bool(get_active_transfer(self.phone_number))
         except Exception:
             # If doctype doesn't exist yet, don't block processing
             return False
 
     def process(self):
-        """Process the incoming message."""
+        """Process the incoming message and send the replies of this turn."""
+        from frappe_whatsapp_chatbot.chatbot.tracing import start_trace
+
+        self.trace = start_trace(self.message_name)
+        # Normalize once for every stage
+        self.get_message()
+        try:
+            self.handle_message()
+            if self.session:
+                # Single write of the session changes of this turn
+                with self.trace.span("session"):
+                    self.session.flush()
+            with self.trace.span("send"):
+                self.batch.flush()
+        finally:
+            self.trace.finish()
+
+    def handle_message(self):
+        """Run the message through the flow/keyword/AI pipeline.
+
+        Each stage is timed as a span of the message trace, and the trace's
+        branch is set to the stage that produced the reply.
+        """
+        trace = self.trace
+
+        # Already loaded (and timed) by start_trace()
         settings = self.get_chatbot_settings()
 
         if not settings:
             return
 
-        if not self.should_process():
-            return
+        with trace.span("filters"):
+            if not self.should_process():
+                return
 
         # Check business hours (send out of hours message if needed)
         if settings.business_hours_only:
-            if not self.is_business_hours():
+            with trace.span("business_hours"):
+                is_open = self.is_business_hours()
+            if not is_open:
                 if settings.out_of_hours_message:
-                    self.send_response(settings.out_of_hours_message)
+                    trace.branch = "out_of_hours"
+                    self.send_response(
+                        self.build_out_of_hours_message(settings.out_of_hours_message)
+                    )
                 return
 
         from frappe_whatsapp_chatbot.chatbot.session_manager import SessionManager
         from frappe_whatsapp_chatbot.chatbot.keyword_matcher import KeywordMatcher
         from frappe_whatsapp_chatbot.chatbot.flow_engine import FlowEngine
+        from frappe_whatsapp_chatbot.chatbot.rule_hits import record_hit
 
         # Initialize managers
         session_mgr = SessionManager(self.phone_number, self.account)
-        keyword_matcher = KeywordMatcher(self.account)
+        with trace.span("keyword_rules"):
+            keyword_matcher = KeywordMatcher(self.account)
         flow_engine = FlowEngine(self.phone_number, self.account)
 
         response = None
 
         # 1. Check for active flow session
-        active_session = session_mgr.get_active_session()
+        with trace.span("session"):
+            active_session = self.session = flow_engine.session = session_mgr.get_active_session()
         if active_session:
-            # If this is a flow response, process the flow data
-            if self.content_type == "flow" and self.flow_response:
-                response = self.process_flow_response_in_session(
-                    active_session,
-                    flow_engine
-                )
-            else:
-                response = flow_engine.process_input(
-                    active_session,
-                    self.message_text,
-                    self.button_payload
-                )
+            with trace.span("flow_engine"):
+                # If this is a flow response, process the flow data
+                if self.content_type == "flow" and self.flow_response:
+                    response = self.process_flow_response_in_session(
+                        active_session,
+                        flow_engine
+                    )
+                else:
+                    response = flow_engine.process_input(
+                        active_session,
+                        self.get_message(),
+                        self.button_payload
+                    )
             if response:
+                trace.branch = "session"
                 self.send_response(response)
                 return
 
         # 2. Check keyword matches
-        keyword_match = keyword_matcher.match(self.message_text)
+        with trace.span("keyword_match"):
+            keyword_match = keyword_matcher.match(self.get_message())
         if keyword_match:
+            record_hit("WhatsApp Keyword Reply", keyword_match.name)
             if keyword_match.response_type == "Flow":
                 # Trigger a new flow
-                response = flow_engine.start_flow(keyword_match.trigger_flow)
+                with trace.span("flow_engine"):
+                    response = flow_engine.start_flow(keyword_match.trigger_flow)
             else:
-                response = self.build_keyword_response(keyword_match)
+                with trace.span("keyword_response"):
+                    response = self.build_keyword_response(keyword_match)
 
             if response:
+                trace.branch = "keyword"
                 self.send_response(response)
                 return
 
         # 3. Check if message triggers a flow directly
-        flow_trigger = flow_engine.check_flow_trigger(self.message_text, self.button_payload)
-        if flow_trigger:
-            response = flow_engine.start_flow(flow_trigger)
-            if response:
-                self.send_response(response)
-                return
+        with trace.span("flow_engine"):
+            flow_trigger = flow_engine.check_flow_trigger(self.get_message(), self.button_payload)
+            if flow_trigger:
+                record_hit("WhatsApp Chatbot Flow", flow_trigger)
+                response = flow_engine.start_flow(flow_trigger)
+        if flow_trigger and response:
+            trace.branch = "flow_trigger"
+            self.send_response(response)
+            return
 
         # 4. AI Fallback (if enabled)
         if settings.enable_ai:
+            frappe.db.savepoint("chatbot_ai")
             try:
-                from frappe_whatsapp_chatbot.chatbot.ai_responder import AIResponder
-                ai_responder = AIResponder(settings, phone_number=self.phone_number)
-                response = ai_responder.generate_response(
-                    self.message_text,
-                    session_mgr.get_conversation_history()
-                )
+                with trace.span("ai"):
+                    from frappe_whatsapp_chatbot.chatbot.ai_responder import AIResponder
+                    ai_responder = AIResponder(settings, phone_number=self.phone_number)
+                    response = ai_responder.generate_response(
+                        self.get_message(),
+                        session_mgr.get_conversation_history()
+                    )
                 if response:
+                    trace.branch = "ai"
                     self.send_response(response)
                     return
             except Exception as e:
                 frappe.log_error(f"AI Fallback error: {str(e)}")
-                # Rollback any failed transaction
-                frappe.db.rollback()
+                # Roll back the failed AI call, keep the rest of the turn
+                frappe.db.rollback(save_point="chatbot_ai")
 
         # 5. Default response
         if settings.default_response:
+            trace.branch = "default"
             self.send_response(settings.default_response)
 
     def send_response(self, response):
-        """Send response message."""
-        try:
-            # Use flags to prevent the after_insert hook from processing our outgoing message
-            flags = frappe._dict(ignore_chatbot=True)
-
-            if isinstance(response, str):
-                # Simple text response
-                msg = frappe.get_doc({
-                    "doctype": "WhatsApp Message",
-                    "type": "Outgoing",
-                    "to": self.phone_number,
-                    "message": response,
-                    "content_type": "text",
-                    "whatsapp_account": self.account
-                })
-                msg.flags.ignore_chatbot = True
-                msg.insert(ignore_permissions=True)
-                frappe.db.commit()
-
-            elif isinstance(response, dict):
-                # Complex response (template, media, buttons, etc.)
-                msg_data = {
-                    "doctype": "WhatsApp Message",
-                    "type": "Outgoing",
-                    "to": self.phone_number,
-                    "whatsapp_account": self.account
-                }
-                msg_data.update(response)
+        """Queue a response (text, message dict or list of those) for this turn.
 
-                msg = frappe.get_doc(msg_data)
-                msg.flags.ignore_chatbot = True
-                msg.insert(ignore_permissions=True)
-                frappe.db.commit()
-
-        except Exception as e:
-            frappe.log_error(
-                f"Chatbot send_response error: {str(e)}",
-                "WhatsApp Chatbot Error"
-            )
+        Responses are sent in order, with a single commit, when the turn
+        ends (see ResponseBatch).
+        """
+        self.batch.add(response)
 
     def process_flow_response_in_session(self, session, flow_engine):
         """Process a WhatsApp Flow response within an active chatbot session.
@@ -239,18 +264,12 @@ class ChatbotProcessor:
         Returns:
             Response message to send
         """
-        import json
+        from frappe_whatsapp_chatbot.chatbot.flow_graph import get_flow_graph
 
         try:
-            flow = frappe.get_doc("WhatsApp Chatbot Flow", session.current_flow)
-
-            # Find current step
-            current_step = None
-            for step in flow.steps:
-                if step.step_name == session.current_step:
-                    current_step = step
-                    break
+            flow = get_flow_graph(session.current_flow)
 
+            current_step = flow.get_step(session.current_step)
             if not current_step:
                 return flow_engine.complete_flow(session, flow)
 
@@ -259,7 +278,7 @@ class ChatbotProcessor:
                 # Unexpected flow response, treat as regular text input
                 return flow_engine.process_input(
                     session,
-                    self.message_text,
+                    self.get_message(),
                     self.button_payload
                 )
 
@@ -269,7 +288,7 @@ class ChatbotProcessor:
                 session,
                 self.flow_response
             )
-            session.session_data = json.dumps(session_data)
+            session.session_data = session_data
 
             # Log the flow response
             session.add_message("Incoming", f"Flow completed: {self.message_text}", current_step.step_name)
@@ -277,7 +296,7 @@ class ChatbotProcessor:
             # Continue to next step (same logic as process_input)
             return flow_engine.process_input(
                 session,
-                self.message_text,  # Use summary as input
+                self.get_message(),  # Use summary as input
                 None
             )
 
@@ -285,35 +304,21 @@ class ChatbotProcessor:
             frappe.log_error(f"process_flow_response_in_session error: {str(e)}")
             return "An error occurred processing your form. Please try again."
 
-    def build_keyword_response(self, keyword_doc):
-        """Build response from keyword match."""
-        if keyword_doc.response_type == "Text":
-            return keyword_doc.response_text
-
-        elif keyword_doc.response_type == "Template":
-            response = {
-                "use_template": 1,
-                "template": keyword_doc.response_template,
-                "message_type": "Template"
-            }
-            if keyword_doc.template_parameters:
-                response["body_param"] = keyword_doc.template_parameters
-            return response
-
-        elif keyword_doc.response_type == "Media":
-            return {
-                "content_type": keyword_doc.media_type.lower() if keyword_doc.media_type else "image",
-                "media_image": keyword_doc.media_url if keyword_doc.media_type == "Image" else None,
-                "media_video": keyword_doc.media_url if keyword_doc.media_type == "Video" else None,
-                "media_audio": keyword_doc.media_url if keyword_doc.media_type == "Audio" else None,
-                "media_document": keyword_doc.media_url if keyword_doc.media_type == "Document" else None,
-                "message": keyword_doc.media_caption or ""
-            }
-
-        elif keyword_doc.response_type == "Script":
-            return self.execute_script(keyword_doc.script)
+    def build_keyword_response(self, keyword_rule):
+        """Build response from keyword match.
 
-        return None
+        Text, Template and Media payloads are prebuilt in the keyword index.
+        """
+        if keyword_rule.response_type == "Script":
+            return self.execute_script(keyword_rule.script)
+
+        payload = keyword_rule.get("payload")
+        if payload is None:
+            from frappe_whatsapp_chatbot.chatbot.keyword_index import build_payload
+            payload = build_payload(keyword_rule)
+
+        # Never hand out the cached dict itself
+        return dict(payload) if isinstance(payload, dict) else payload
 
     def execute_script(self, script):
         """Execute a Server Script or method path.
@@ -368,66 +373,48 @@ class ChatbotProcessor:
             )
             return None
 
+    def get_business_schedule(self):
+        """Get the compiled business hours schedule of this account."""
+        from frappe_whatsapp_chatbot.chatbot.business_hours import get_schedule
+        return get_schedule(self.account)
+
     def is_business_hours(self):
-        """Check if current time is within business hours for today."""
+        """Check if the current time is within this account's business hours."""
         try:
-            settings = self.get_chatbot_settings()
-            if not settings:
-                return True
-
-            if not settings.business_hours:
+            schedule = self.get_business_schedule()
+            if not schedule:
                 return True  # No business hours configured
 
-            now = datetime.now()
-            current_time = now.time()
-            day_name = now.strftime("%A")  # Monday, Tuesday, etc.
-
-            # Find the business hours entry for today
-            for row in settings.business_hours:
-                if row.day == day_name:
-                    # Check if this day is enabled (open)
-                    if not row.enabled:
-                        return False  # Closed on this day
-
-                    # Check time range
-                    start = self._parse_time(row.start_time)
-                    end = self._parse_time(row.end_time)
-
-                    if start and end:
-                        return start <= current_time <= end
-                    return True  # Day is enabled but no specific times set
-
-            # No entry for this day - default to closed
-            return False
+            return schedule.is_open()
 
         except Exception as e:
             frappe.log_error(f"is_business_hours error: {str(e)}")
         return True  # Default to open if there's an error
 
-    def _parse_time(self, time_value):
-        """Parse time value to time object."""
-        if not time_value:
-            return None
+    def build_out_of_hours_message(self, message):
+        """Fill in the {next_opening} placeholder of the out of hours message."""
+        if "{next_opening}" not in message:
+            return message
 
-        if isinstance(time_value, str):
-            from datetime import time
-            try:
-                parts = time_value.split(":")
-                return time(int(parts[0]), int(parts[1]), int(parts[2]) if len(parts) > 2 else 0)
-            except (ValueError, IndexError):
-                return None
+        from frappe_whatsapp_chatbot.chatbot.business_hours import format_opening
+
+        next_opening = None
+        try:
+            schedule = self.get_business_schedule()
+            if schedule:
+                next_opening = schedule.next_opening()
+        except Exception as e:
+            frappe.log_error(f"next_opening error: {str(e)}")
 
-        # Already a time object
-        return time_value
+        return message.replace("{next_opening}", format_opening(next_opening))
 
 
 def process_incoming_message(doc, method=None):
     """
     Hook function called when WhatsApp Message is created.
-    Process synchronously but safely - never raise exceptions.
+    Process synchronously (or enqueue when background processing is
+    enabled) but safely - never raise exceptions.
     """
-    global _processing_messages
-
     try:
         # Skip if this is an outgoing message
         if getattr(doc, "type", None) != "Incoming":
@@ -437,9 +424,8 @@ def process_incoming_message(doc, method=None):
         if getattr(doc.flags, "ignore_chatbot", False):
             return
 
-        # Skip if already being processed (prevent infinite loops)
         doc_name = getattr(doc, "name", None)
-        if not doc_name or doc_name in _processing_messages:
+        if not doc_name:
             return
 
         # Only process text, button, and flow content types
@@ -447,12 +433,12 @@ def process_incoming_message(doc, method=None):
         if content_type not in ["text", "button", "flow"]:
             return
 
-        # Quick check if chatbot is enabled (without full initialization)
+        # Quick check if chatbot is enabled (cached settings snapshot)
         try:
-            if not frappe.db.exists("WhatsApp Chatbot"):
-                return
-            enabled = frappe.db.get_single_value("WhatsApp Chatbot", "enabled")
-            if not enabled:
+            from frappe_whatsapp_chatbot.chatbot.settings import get_enabled_settings
+
+            config = get_enabled_settings()
+            if not config:
                 return
         except Exception:
             return
@@ -468,16 +454,15 @@ def process_incoming_message(doc, method=None):
             "flow_response": getattr(doc, "flow_response", None)
         }
 
-        # Mark as being processed to prevent loops
-        _processing_messages.add(doc_name)
+        from frappe_whatsapp_chatbot.chatbot.dispatcher import enqueue_message, process_message
 
-        try:
-            # Process synchronously - this is fast enough and more reliable
-            processor = ChatbotProcessor(message_data)
-            processor.process()
-        finally:
-            # Clean up processing flag
-            _processing_messages.discard(doc_name)
+        # Hand over to a background worker and return to the webhook quickly
+        if config.process_in_background:
+            enqueue_message(message_data, config.background_queue)
+            return
+
+        # Process synchronously, one message per conversation at a time
+        process_message(message_data, config.background_queue)
 
     except Exception as e:
         # Log error but NEVER re-raise - we must not break the incoming message save
@@ -491,10 +476,11 @@ def process_incoming_message(doc, method=None):
 
 
 def run_processor(message_data):
-    """Background job to process message (kept for compatibility)."""
-    global _processing_messages
+    """Process a single message; called by the dispatcher for queued messages."""
+    from frappe_whatsapp_chatbot.chatbot.dispatcher import record_job_stats
 
     message_name = message_data.get("name", "unknown")
+    started_at = time.time()
 
     try:
         processor = ChatbotProcessor(message_data)
@@ -505,5 +491,4 @@ def run_processor(message_data):
             "WhatsApp Chatbot Error"
         )
     finally:
-        # Clean up processing flag
-        _processing_messages.discard(message_name)
+        record_job_stats(message_data, started_at)
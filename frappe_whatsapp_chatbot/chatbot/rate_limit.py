@@ -0,0 +1,67 @@
+import frappe
+
+# Token bucket, refilled at ``rate`` tokens per second up to ``capacity``.
+# Runs atomically in Redis with Redis' own clock, so every worker of the
+# cluster shares the same bucket. Returns {allowed, seconds to wait}.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+    allowed = 1
+else
+    wait = (requested - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+
+return {allowed, tostring(wait)}
+"""
+
+_token_bucket = None
+
+
+def get_rate_limit(whatsapp_account=None):
+    """Return (messages per second, burst) for an account; rate 0 is unlimited."""
+    from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+    settings = get_settings()
+    rate = (settings.account_rate_limits or {}).get(whatsapp_account)
+    if rate is None:
+        rate = settings.send_rate_limit or 0
+
+    burst = settings.send_burst or 0
+    return rate, max(burst, rate, 1) if rate > 0 else 0
+
+
+def acquire_send_token(whatsapp_account=None):
+    """Take one send token from the account's bucket.
+
+    Returns:
+        (allowed, seconds until a token is available)
+    """
+    rate, capacity = get_rate_limit(whatsapp_account)
+    if rate <= 0:
+        return True, 0
+
+    global _token_bucket
+    if _token_bucket is None:
+        _token_bucket = frappe.cache.register_script(TOKEN_BUCKET_SCRIPT)
+
+    key = frappe.cache.make_key(f"whatsapp_chatbot:send_bucket:{whatsapp_account or ''}")
+    allowed, wait = _token_bucket(keys=[key], args=[rate, capacity, 1], client=frappe.cache)
+    return bool(int(allowed)), float(wait)
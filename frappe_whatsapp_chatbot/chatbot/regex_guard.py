@@ -0,0 +1,146 @@
+import frappe
+import re
+import signal
+import threading
+from functools import lru_cache
+
+# Sorted set counting, per pattern source, the searches that ran out of time
+REGEX_TIMEOUTS_KEY = "whatsapp_chatbot:regex_timeouts"
+DEFAULT_REGEX_TIMEOUT = 100  # milliseconds
+
+
+class RegexTimeout(Exception):
+    pass
+
+
+class GuardedPattern:
+    """A user-authored regex that can't pin a worker on a hostile message.
+
+    Runs on the first engine available for the pattern:
+
+    - ``re2`` (google-re2), linear time, when installed and the pattern
+      uses no backreferences or lookarounds
+    - the ``regex`` module, when installed, with its ``timeout`` argument
+    - ``re`` under a CPU timer (SIGVTALRM) that interrupts the search;
+      outside the main thread, where signals can't be used, it is unguarded
+
+    A search that runs out of time returns ``default`` and is counted
+    against ``source`` (e.g. the keyword rule).
+    """
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+        self.compiled = re.compile(pattern, flags)
+        self.engine, self.guarded = self.compile_guarded(pattern, flags)
+
+    @staticmethod
+    def compile_guarded(pattern, flags):
+        try:
+            import re2
+
+            inline = "(?i)" if flags & re.IGNORECASE else ""
+            return "re2", re2.compile(inline + pattern)
+        except Exception:
+            pass
+
+        try:
+            import regex
+
+            return "regex", regex.compile(pattern, flags)
+        except Exception:
+            pass
+
+        return "re", None
+
+    def search(self, text, source=None, default=None, timeout=None):
+        return self.run("search", text, source, default, timeout)
+
+    def match(self, text, source=None, default=None, timeout=None):
+        return self.run("match", text, source, default, timeout)
+
+    def run(self, method, text, source, default, timeout=None):
+        """Run ``method`` within ``timeout`` seconds (default: the configured limit)."""
+        if timeout is None:
+            timeout = get_regex_timeout()
+        try:
+            if self.engine == "re2":
+                return getattr(self.guarded, method)(text)
+            if self.engine == "regex":
+                try:
+                    return getattr(self.guarded, method)(text, timeout=timeout)
+                except TimeoutError:
+                    raise RegexTimeout
+            return run_with_cpu_timer(getattr(self.compiled, method), text, timeout)
+        except RegexTimeout:
+            record_timeout(source or self.pattern, self.pattern, timeout)
+            return default
+
+
+def run_with_cpu_timer(function, text, timeout):
+    """Call ``function(text)``, raising RegexTimeout after ``timeout`` CPU seconds."""
+    if not timeout or threading.current_thread() is not threading.main_thread():
+        return function(text)
+
+    def on_timeout(signum, frame):
+        raise RegexTimeout
+
+    # The sre engine checks for signals while it backtracks
+    previous = signal.signal(signal.SIGVTALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_VIRTUAL, timeout)
+    try:
+        return function(text)
+    finally:
+        signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+        signal.signal(signal.SIGVTALRM, previous)
+
+
+@lru_cache(maxsize=256)
+def get_pattern(pattern, flags=0):
+    """Return a cached GuardedPattern (raises re.error if invalid)."""
+    return GuardedPattern(pattern, flags)
+
+
+def get_regex_timeout():
+    """Return the regex time limit in seconds (0 disables the limit)."""
+    from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+    try:
+        timeout = get_settings().regex_timeout
+    except Exception:
+        timeout = None
+    if timeout is None:
+        timeout = DEFAULT_REGEX_TIMEOUT
+    return timeout / 1000
+
+
+def record_timeout(source, pattern, timeout):
+    """Count a search that ran out of time, logging the first one of each source."""
+    try:
+        count = frappe.cache.zincrby(frappe.cache.make_key(REGEX_TIMEOUTS_KEY), 1, source)
+    except Exception:
+        count = None
+
+    if count == 1:
+        frappe.log_error(
+            f"Regex '{pattern}' of {source} ran longer than {int(timeout * 1000)} ms and was treated as not matching",
+            "WhatsApp Chatbot Regex Timeout"
+        )
+
+
+def get_regex_timeouts():
+    """Return {source: number of timeouts}, most timeouts first."""
+    rows = frappe.cache.zrevrange(frappe.cache.make_key(REGEX_TIMEOUTS_KEY), 0, -1, withscores=True)
+    return {
+        (source.decode() if isinstance(source, bytes) else source): int(count)
+        for source, count in rows or []
+    }
+
+
+def clear_regex_timeouts(source=None):
+    """Forget the timeouts of one source (e.g. after fixing a rule) or all of them."""
+    key = frappe.cache.make_key(REGEX_TIMEOUTS_KEY)
+    if source:
+        frappe.cache.zrem(key, source)
+    else:
+        frappe.cache.delete(key)
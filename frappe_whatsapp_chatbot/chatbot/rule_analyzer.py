@@ -0,0 +1,237 @@
+import frappe
+from frappe_whatsapp_chatbot.chatbot.keyword_index import RULE_FIELDS, KeywordIndex
+from frappe_whatsapp_chatbot.chatbot.utils import fold_text, normalize_text
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+NEVER_FIRES = "Never Fires"
+SHADOWED_KEYWORD = "Shadowed Keyword"
+OVERLAP = "Overlapping Keyword"
+CATASTROPHIC_REGEX = "Catastrophic Regex"
+
+REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+
+
+class RuleAnalyzer:
+    """Find keyword rules that conflict with each other.
+
+    Uses the compiled KeywordIndex of an account: each keyword of a rule is
+    looked up as if it were a message, so finding the rules that cover it
+    costs one automaton or trie pass per keyword.
+
+    A keyword is shadowed when a higher priority rule without conditions
+    or active dates answers every message the keyword would match:
+
+    - Exact: a higher rule matches the keyword itself
+    - Starts With: a higher Starts With rule's keyword is a prefix of it,
+      or a higher Contains rule's keyword is inside it
+    - Contains: a higher Contains rule's keyword is inside it
+
+    Regex and Fuzzy keywords are not checked for shadowing, but their
+    rules can shadow others.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.findings = []
+        self.seen = set()
+
+    def analyze(self):
+        """Return the list of findings (dicts) over all rules and accounts."""
+        accounts = {rule.whatsapp_account for rule in self.rules}
+        accounts.add(None)
+
+        for account in sorted(accounts, key=lambda a: a or ""):
+            # Rules without an account apply to every account
+            rules = [
+                rule for rule in self.rules
+                if not rule.whatsapp_account or rule.whatsapp_account == account
+            ]
+            if rules:
+                self.analyze_account(KeywordIndex(rules), account)
+
+        self.find_catastrophic_regexes()
+        return self.findings
+
+    def analyze_account(self, index, account):
+        overlaps = {}
+        ranks = {id(rule): rank for rank, rule in enumerate(index.rules)}
+
+        for rank, rule in enumerate(index.rules):
+            if rule.match_type in ("Regex", "Fuzzy"):
+                continue
+
+            keywords = get_keywords(rule)
+            shadowed = 0
+
+            for keyword in keywords:
+                key = normalize_text(keyword) if rule.case_sensitive else fold_text(keyword)
+                if not key:
+                    continue
+
+                shadowers = [
+                    other for other in self.get_covering_rules(index, rule, key)
+                    if ranks[id(other)] < rank and is_always_active(other)
+                ]
+                if shadowers:
+                    shadowed += 1
+                    self.add(SHADOWED_KEYWORD, rule, keyword, shadowers[0], account,
+                        f"'{keyword}' is always answered by higher priority rule '{shadowers[0].title}'")
+
+                overlaps.setdefault((bool(rule.case_sensitive), key), []).append((rule, keyword, shadowers))
+
+            if keywords and shadowed == len(keywords):
+                self.add(NEVER_FIRES, rule, None, None, account,
+                    "Every keyword is shadowed by higher priority rules")
+
+        for entries in overlaps.values():
+            first_rule, _, _ = entries[0]
+            for rule, keyword, shadowers in entries[1:]:
+                if rule is first_rule or any(other is first_rule for other in shadowers):
+                    continue
+                self.add(OVERLAP, rule, keyword, first_rule, account,
+                    f"'{keyword}' is also a keyword of '{first_rule.title}'")
+
+    def get_covering_rules(self, index, rule, key):
+        """Return the rules matching every message that ``key`` matches for ``rule``."""
+        # Case-insensitive keywords are only covered by case-insensitive rules
+        cases = [False] if not rule.case_sensitive else [True, False]
+
+        if rule.match_type == "Exact":
+            return [
+                other for other in index.iter_matches(key)
+                if other is not rule and (rule.case_sensitive or not other.case_sensitive)
+            ]
+
+        ranks = set()
+        for case_sensitive in cases:
+            value = key if case_sensitive else fold_text(key)
+            ranks.update(index.contains[case_sensitive].search(value))
+            if rule.match_type == "Starts With":
+                ranks.update(index.starts_with[case_sensitive].search(value))
+
+        return [index.rules[rank] for rank in sorted(ranks) if index.rules[rank] is not rule]
+
+    def find_catastrophic_regexes(self):
+        for rule in self.rules:
+            if rule.match_type != "Regex":
+                continue
+            for keyword in get_keywords(rule):
+                reason = find_catastrophic_pattern(keyword)
+                if reason:
+                    self.add(CATASTROPHIC_REGEX, rule, keyword, None, rule.whatsapp_account, reason)
+
+    def add(self, issue, rule, keyword, other, account, details):
+        key = (issue, rule.name, keyword, other.name if other else None)
+        if key in self.seen:
+            return
+        self.seen.add(key)
+
+        self.findings.append({
+            "issue": issue,
+            "rule": rule.name,
+            "title": rule.title,
+            "priority": rule.priority,
+            "whatsapp_account": account,
+            "keyword": keyword,
+            "conflicting_rule": other.name if other else None,
+            "details": details
+        })
+
+
+def get_keywords(rule):
+    return [k.strip() for k in (rule.keywords or "").split(",") if k.strip()]
+
+
+def is_always_active(rule):
+    """Check if a rule answers every message it matches, at any time."""
+    return not rule.conditions and not rule.active_from and not rule.active_until
+
+
+def find_catastrophic_pattern(pattern):
+    """Return why a regex may backtrack exponentially, or None.
+
+    Flags unbounded quantifiers applied to something that already has a
+    variable-length quantifier, like ``(a+)+`` or ``(\\w+\\s?)*``: a failing
+    match then tries every way of splitting the text between them.
+    Possessive quantifiers and atomic groups are safe.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return None  # Invalid patterns are reported when the rule is saved
+
+    def walk(items, outer):
+        for op, av in items:
+            if op in REPEATS:
+                low, high, sub = av
+                if outer and high != low:
+                    return f"Nested quantifier in '{pattern}' can backtrack exponentially"
+                found = walk(sub, outer or high == sre_constants.MAXREPEAT)
+                if found:
+                    return found
+            elif op == sre_constants.SUBPATTERN:
+                found = walk(av[-1], outer)
+                if found:
+                    return found
+            elif op == sre_constants.BRANCH:
+                for branch in av[1]:
+                    found = walk(branch, outer)
+                    if found:
+                        return found
+            elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+                found = walk(av[1], outer)
+                if found:
+                    return found
+        return None
+
+    return walk(parsed, False)
+
+
+def load_all_rules():
+    """Load every enabled keyword rule, highest priority first."""
+    return frappe.get_all(
+        "WhatsApp Keyword Reply",
+        filters={"enabled": 1},
+        fields=RULE_FIELDS,
+        order_by="priority desc, creation asc"
+    )
+
+
+def analyze_rules(rules=None):
+    """Return the conflicts between keyword rules (all enabled rules by default)."""
+    if rules is None:
+        rules = load_all_rules()
+    return RuleAnalyzer(rules).analyze()
+
+
+def get_rule_conflicts(doc):
+    """Return the findings involving a Keyword Reply being saved.
+
+    The document's unsaved values are analyzed together with the other
+    enabled rules.
+    """
+    current = frappe._dict({field: doc.get(field) for field in RULE_FIELDS}) if doc.enabled else None
+
+    rules = []
+    for rule in load_all_rules():
+        if rule.name == doc.name:
+            if current:
+                rules.append(current)
+            current = None
+        else:
+            rules.append(rule)
+    if current:
+        rules.append(current)  # New or re-enabled: newest of its priority
+
+    # Stable, so rules of equal priority keep their creation order
+    rules.sort(key=lambda rule: -(rule.priority or 0))
+
+    return [
+        finding for finding in analyze_rules(rules)
+        if doc.name in (finding["rule"], finding["conflicting_rule"])
+    ]
@@ -0,0 +1,159 @@
+import csv
+import json
+import time
+from frappe_whatsapp_chatbot.chatbot.utils import normalize_message
+
+# Unmatched messages kept as examples in the report
+UNMATCHED_SAMPLES = 20
+
+
+class RuleEvaluator:
+    """Run sample messages through the keyword rules and flow triggers.
+
+    The keyword index and the trigger flows are loaded once, so thousands
+    of messages can be checked without touching the database. A message
+    goes through the same order as live processing: keyword rules first,
+    then flow trigger keywords. Active sessions are not simulated.
+    """
+
+    def __init__(self, whatsapp_account=None):
+        from frappe_whatsapp_chatbot.chatbot.flow_engine import FlowEngine
+        from frappe_whatsapp_chatbot.chatbot.keyword_matcher import KeywordMatcher
+
+        self.account = whatsapp_account
+        self.matcher = KeywordMatcher(whatsapp_account)
+        self.flow_engine = FlowEngine(None, whatsapp_account)
+
+        self.messages = 0
+        self.unmatched = 0
+        self.unmatched_samples = []
+        self.rule_hits = {rule.name: 0 for rule in self.matcher.rules}
+        self.rule_shadowed = {rule.name: 0 for rule in self.matcher.rules}
+        self.flow_hits = {flow.name: 0 for flow in self.flow_engine.get_trigger_flows()}
+        self.elapsed = 0
+
+    def evaluate(self, text):
+        """Evaluate one message and count the result.
+
+        Returns:
+            dict with the message, the winning rule or flow, and the other
+            rules that matched but lost on priority
+        """
+        started_at = time.perf_counter()
+        message = normalize_message(text)
+
+        matched = []
+        for rule in self.matcher.index.iter_matches(message):
+            if rule.conditions and not self.matcher.evaluate_conditions(rule.conditions, message.raw):
+                continue
+            matched.append(rule.name)
+
+        result = {"message": text, "rule": None, "flow": None, "shadowed": matched[1:]}
+        if matched:
+            result["rule"] = matched[0]
+        elif message.folded:
+            result["flow"] = self.flow_engine.check_flow_trigger(message)
+
+        self.elapsed += time.perf_counter() - started_at
+        self.count(result)
+        return result
+
+    def count(self, result):
+        self.messages += 1
+
+        if result["rule"]:
+            self.rule_hits[result["rule"]] += 1
+        elif result["flow"]:
+            self.flow_hits[result["flow"]] += 1
+        else:
+            self.unmatched += 1
+            if len(self.unmatched_samples) < UNMATCHED_SAMPLES:
+                self.unmatched_samples.append(result["message"])
+
+        for name in result["shadowed"]:
+            self.rule_shadowed[name] += 1
+
+    def get_report(self):
+        """Return hit counts per rule and flow, unmatched rate and throughput."""
+        rules = {
+            rule.name: {
+                "title": rule.title,
+                "priority": rule.priority,
+                "hits": self.rule_hits[rule.name],
+                "shadowed": self.rule_shadowed[rule.name]
+            }
+            for rule in self.matcher.rules
+        }
+
+        return {
+            "whatsapp_account": self.account,
+            "messages": self.messages,
+            "unmatched": self.unmatched,
+            "unmatched_rate": round(self.unmatched / self.messages, 4) if self.messages else 0,
+            "unmatched_samples": self.unmatched_samples,
+            "rules": rules,
+            "flows": self.flow_hits,
+            # Rules that matched messages but always lost to a higher priority rule
+            "shadowed_rules": [
+                name for name, counts in rules.items() if counts["shadowed"] and not counts["hits"]
+            ],
+            "unused_rules": [
+                name for name, counts in rules.items() if not counts["shadowed"] and not counts["hits"]
+            ],
+            "elapsed": round(self.elapsed, 4),
+            "messages_per_second": round(self.messages / self.elapsed) if self.elapsed else 0
+        }
+
+
+def evaluate_messages(messages, whatsapp_account=None, results=None):
+    """Evaluate an iterable of message texts against the current rules.
+
+    Args:
+        messages: Iterable of texts (may be a generator, it is read once)
+        whatsapp_account: Account whose rules are used
+        results: Optional callable receiving each message's result
+
+    Returns:
+        The report of RuleEvaluator.get_report
+    """
+    evaluator = RuleEvaluator(whatsapp_account)
+    for text in messages:
+        result = evaluator.evaluate(text)
+        if results:
+            results(result)
+    return evaluator.get_report()
+
+
+def read_corpus(path):
+    """Stream the message texts of a corpus file.
+
+    ``.jsonl`` files hold one JSON string or object (with a "message" or
+    "text" key) per line; ``.csv`` files have a header row and the
+    "message" column is used (or the first one); any other file is read as
+    one message per line.
+    """
+    with open(path, newline="", encoding="utf-8") as corpus:
+        if path.endswith(".jsonl"):
+            for line in corpus:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if isinstance(row, dict):
+                    row = row.get("message") or row.get("text") or ""
+                yield str(row)
+
+        elif path.endswith(".csv"):
+            reader = csv.reader(corpus)
+            header = next(reader, None)
+            if not header:
+                return
+            column = header.index("message") if "message" in header else 0
+            for row in reader:
+                if len(row) > column:
+                    yield row[column]
+
+        else:
+            for line in corpus:
+                line = line.rstrip("\n")
+                if line:
+                    yield line
@@ -0,0 +1,171 @@
+import frappe
+import time
+from datetime import datetime, timezone
+
+# Sorted sets of "<doctype>|<name>": hits since the last rollup, and the
+# time of the latest hit
+HIT_COUNTS_KEY = "whatsapp_chatbot:rule_hits"
+LAST_HITS_KEY = "whatsapp_chatbot:rule_last_hits"
+
+KEYWORD_REPLY = "WhatsApp Keyword Reply"
+CHATBOT_FLOW = "WhatsApp Chatbot Flow"
+
+
+def record_hit(reference_doctype, reference_name):
+    """Count a hit of a keyword reply or flow trigger.
+
+    Only touches Redis (one pipelined round trip); counts reach the
+    database with the hourly rollup.
+    """
+    member = f"{reference_doctype}|{reference_name}"
+    try:
+        pipe = frappe.cache.pipeline()
+        pipe.zincrby(frappe.cache.make_key(HIT_COUNTS_KEY), 1, member)
+        pipe.zadd(frappe.cache.make_key(LAST_HITS_KEY), {member: time.time()})
+        pipe.execute()
+    except Exception:
+        pass  # Analytics never fail processing
+
+
+def get_pending_hits():
+    """Return {(doctype, name): (hits, last hit)} not rolled up yet."""
+    counts = read_counts(frappe.cache.make_key(HIT_COUNTS_KEY))
+    pending = read_counts(get_flushing_key())
+    for member, hits in pending.items():
+        counts[member] = counts.get(member, 0) + hits
+    return with_last_hits(counts)
+
+
+def flush_rule_hits():
+    """Scheduled job: add the hits counted in Redis to WhatsApp Rule Hits.
+
+    The counts are moved aside atomically, so hits keep being counted
+    while the rollup runs. If it fails, they are merged into the next one.
+    """
+    key = frappe.cache.make_key(HIT_COUNTS_KEY)
+    flushing = get_flushing_key()
+
+    pipe = frappe.cache.pipeline()
+    pipe.zunionstore(flushing, [flushing, key])
+    pipe.delete(key)
+    pipe.execute()
+
+    hits = with_last_hits(read_counts(flushing))
+    if hits:
+        save_hits(hits, frappe.utils.today())
+        frappe.db.commit()
+
+    frappe.cache.delete(flushing)
+
+
+def save_hits(hits, date):
+    """Add hit counts to the day's WhatsApp Rule Hits rows."""
+    existing = {
+        (row.reference_doctype, row.reference_name): row
+        for row in frappe.get_all(
+            "WhatsApp Rule Hits",
+            filters={"date": date, "reference_name": ["in", [name for _, name in hits]]},
+            fields=["name", "reference_doctype", "reference_name", "hits", "last_hit"]
+        )
+    }
+
+    for (reference_doctype, reference_name), (count, last_hit) in hits.items():
+        row = existing.get((reference_doctype, reference_name))
+        if row:
+            frappe.db.set_value("WhatsApp Rule Hits", row.name, {
+                "hits": (row.hits or 0) + count,
+                "last_hit": max(filter(None, [row.last_hit, last_hit]))
+            }, update_modified=False)
+
+        elif frappe.db.exists(reference_doctype, reference_name):
+            frappe.get_doc({
+                "doctype": "WhatsApp Rule Hits",
+                "reference_doctype": reference_doctype,
+                "reference_name": reference_name,
+                "date": date,
+                "hits": count,
+                "last_hit": last_hit
+            }).insert(ignore_permissions=True)
+
+
+def get_rule_hits(reference_doctype=None, days=30):
+    """Return hits per keyword reply and flow over the last ``days`` days.
+
+    Includes hits not rolled up yet, and enabled rules without any hit.
+
+    Returns:
+        list of dicts (reference_doctype, reference_name, hits, last_hit),
+        most hits first
+    """
+    doctypes = [reference_doctype] if reference_doctype else [KEYWORD_REPLY, CHATBOT_FLOW]
+
+    totals = {}
+    for doctype in doctypes:
+        for name in frappe.get_all(doctype, filters={"enabled": 1}, pluck="name"):
+            totals[(doctype, name)] = [0, None]
+
+    rows = frappe.get_all(
+        "WhatsApp Rule Hits",
+        filters={
+            "reference_doctype": ["in", doctypes],
+            "date": [">=", frappe.utils.add_days(frappe.utils.today(), -int(days))]
+        },
+        fields=["reference_doctype", "reference_name", "sum(hits) as hits", "max(last_hit) as last_hit"],
+        group_by="reference_doctype, reference_name"
+    )
+    for row in rows:
+        totals[(row.reference_doctype, row.reference_name)] = [row.hits or 0, row.last_hit]
+
+    for key, (count, last_hit) in get_pending_hits().items():
+        if key[0] not in doctypes:
+            continue
+        total = totals.setdefault(key, [0, None])
+        total[0] += count
+        total[1] = max(filter(None, [total[1], last_hit]), default=None)
+
+    result = [
+        {"reference_doctype": doctype, "reference_name": name, "hits": count, "last_hit": last_hit}
+        for (doctype, name), (count, last_hit) in totals.items()
+    ]
+    result.sort(key=lambda row: -row["hits"])
+    return result
+
+
+def get_flushing_key():
+    return frappe.cache.make_key(HIT_COUNTS_KEY + ":flushing")
+
+
+def read_counts(key):
+    counts = {}
+    for member, score in frappe.cache.zrange(key, 0, -1, withscores=True) or []:
+        member = member.decode() if isinstance(member, bytes) else member
+        reference_doctype, _, reference_name = member.partition("|")
+        counts[(reference_doctype, reference_name)] = int(score)
+    return counts
+
+
+def with_last_hits(counts):
+    """Pair each count with the time of its rule's latest hit."""
+    if not counts:
+        return {}
+
+    last_hits_key = frappe.cache.make_key(LAST_HITS_KEY)
+    pipe = frappe.cache.pipeline()
+    for doctype, name in counts:
+        pipe.zscore(last_hits_key, f"{doctype}|{name}")
+    scores = pipe.execute()
+    return {
+        key: (count, to_system_datetime(score))
+        for (key, count), score in zip(counts.items(), scores)
+    }
+
+
+def to_system_datetime(timestamp):
+    """Convert a Unix timestamp to a naive datetime in the system timezone."""
+    if not timestamp:
+        return None
+
+    from frappe.utils import convert_utc_to_system_timezone
+
+    utc = datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+    return convert_utc_to_system_timezone(utc).replace(tzinfo=None, microsecond=0)
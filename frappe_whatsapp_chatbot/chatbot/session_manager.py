@@ -1,5 +1,10 @@
 import frappe
 from datetime import datetime, timedelta
+from frappe_whatsapp_chatbot.chatbot.flow_graph import get_flow_graph
+from frappe_whatsapp_chatbot.chatbot.session_state import SessionState
+from frappe_whatsapp_chatbot.chatbot.session_store import end_session, get_hot_session, is_hot_store_enabled
+from frappe_whatsapp_chatbot.chatbot.settings import get_enabled_settings, get_settings
+from frappe_whatsapp_chatbot.chatbot.tracing import span
 
 
 class SessionManager:
@@ -13,81 +18,68 @@ class SessionManager:
     def get_timeout(self):
         """Get session timeout from settings."""
         try:
-            if frappe.db.exists("WhatsApp Chatbot"):
-                settings = frappe.get_single("WhatsApp Chatbot")
-                return settings.session_timeout_minutes or 30
+            return get_settings().session_timeout_minutes or 30
         except Exception:
             pass
         return 30
 
     def get_active_session(self):
-        """Get active session for this phone number."""
-        try:
-            # Check for expired sessions first
-            self.expire_old_sessions()
+        """Get the active session for this phone number as a SessionState.
 
-            session = frappe.db.get_value(
-                "WhatsApp Chatbot Session",
-                {
-                    "phone_number": self.phone_number,
-                    "whatsapp_account": self.account,
-                    "status": "Active"
-                },
-                "name"
-            )
-
-            if session:
-                return frappe.get_doc("WhatsApp Chatbot Session", session)
+        The caller flushes the state once the turn is processed. With Keep
+        Active Sessions in Redis, a session found in Redis is returned
+        without querying the database.
+        """
+        try:
+            hot = is_hot_store_enabled()
+            if hot:
+                values = get_hot_session(self.account, self.phone_number)
+                if values:
+                    return SessionState(values, hot=True)
 
-            return None
+            # Check for expired sessions first
+            with span("session_expiry"):
+                self.expire_old_sessions()
+
+            session = SessionState.load({
+                "phone_number": self.phone_number,
+                "whatsapp_account": self.account,
+                "status": "Active"
+            })
+            if session and hot:
+                session.keep_hot()
+            return session
 
         except Exception as e:
             frappe.log_error(f"SessionManager get_active_session error: {str(e)}")
             return None
 
     def expire_old_sessions(self):
-        """Mark old sessions as timed out."""
+        """Mark old sessions as timed out.
+
+        Changes are committed with the rest of the turn.
+        """
         try:
             timeout_threshold = datetime.now() - timedelta(minutes=self.timeout_minutes)
 
-            expired = frappe.get_all(
-                "WhatsApp Chatbot Session",
-                filters={
-                    "status": "Active",
-                    "last_activity": ["<", timeout_threshold]
-                },
-                pluck="name"
-            )
+            expired = get_expired_sessions(timeout_threshold)
 
-            for session_name in expired:
-                session = frappe.get_doc("WhatsApp Chatbot Session", session_name)
-                session.status = "Timeout"
-                session.completed_at = datetime.now()
-                session.save(ignore_permissions=True)
+            for session in expired:
+                timeout_session(session.name)
 
                 # Send timeout message
                 if session.current_flow:
-                    flow = frappe.get_doc("WhatsApp Chatbot Flow", session.current_flow)
+                    flow = get_flow_graph(session.current_flow)
                     if flow.timeout_message:
                         self.send_timeout_message(session, flow.timeout_message)
 
-            if expired:
-                frappe.db.commit()
-
         except Exception as e:
             frappe.log_error(f"SessionManager expire_old_sessions error: {str(e)}")
 
     def send_timeout_message(self, session, message):
         """Send session timeout message."""
         try:
-            frappe.get_doc({
-                "doctype": "WhatsApp Message",
-                "type": "Outgoing",
-                "to": session.phone_number,
-                "message": message,
-                "content_type": "text",
-                "whatsapp_account": session.whatsapp_account
-            }).insert(ignore_permissions=True)
+            send_timeout_message(session.phone_number, session.whatsapp_account, message)
         except Exception as e:
             frappe.log_error(f"SessionManager send_timeout_message error: {str(e)}")
 
@@ -129,45 +121,29 @@ def cleanup_expired_sessions():
     """Scheduled job to clean up expired sessions."""
     try:
         # Get settings
-        if not frappe.db.exists("WhatsApp Chatbot"):
-            return
-
-        settings = frappe.get_single("WhatsApp Chatbot")
-        if not settings.enabled:
+        settings = get_enabled_settings()
+        if not settings:
             return
 
         timeout_minutes = settings.session_timeout_minutes or 30
         timeout_threshold = datetime.now() - timedelta(minutes=timeout_minutes)
 
         # Find all expired active sessions
-        expired_sessions = frappe.get_all(
-            "WhatsApp Chatbot Session",
-            filters={
-                "status": "Active",
-                "last_activity": ["<", timeout_threshold]
-            },
-            fields=["name", "phone_number", "whatsapp_account", "current_flow"]
-        )
+        expired_sessions = get_expired_sessions(timeout_threshold)
 
         for session_data in expired_sessions:
             try:
-                session = frappe.get_doc("WhatsApp Chatbot Session", session_data.name)
-                session.status = "Timeout"
-                session.completed_at = datetime.now()
-                session.save(ignore_permissions=True)
+                timeout_session(session_data.name)
 
                 # Send timeout message
                 if session_data.current_flow:
-                    flow = frappe.get_doc("WhatsApp Chatbot Flow", session_data.current_flow)
+                    flow = get_flow_graph(session_data.current_flow)
                     if flow.timeout_message:
-                        frappe.get_doc({
-                            "doctype": "WhatsApp Message",
-                            "type": "Outgoing",
-                            "to": session_data.phone_number,
-                            "message": flow.timeout_message,
-                            "content_type": "text",
-                            "whatsapp_account": session_data.whatsapp_account
-                        }).insert(ignore_permissions=True)
+                        send_timeout_message(
+                            session_data.phone_number,
+                            session_data.whatsapp_account,
+                            flow.timeout_message
+                        )
 
             except Exception as e:
                 frappe.log_error(
@@ -179,3 +155,51 @@ def cleanup_expired_sessions():
 
     except Exception as e:
         frappe.log_error(f"cleanup_expired_sessions error: {str(e)}")
+
+
+def get_expired_sessions(timeout_threshold):
+    """Return the active sessions idle since before ``timeout_threshold``.
+
+    With Keep Active Sessions in Redis, sessions still in Redis have not
+    timed out (their last activity may not be written yet); the queued
+    changes of the others are written before they are returned.
+    """
+    sessions = frappe.get_all(
+        "WhatsApp Chatbot Session",
+        filters={
+            "status": "Active",
+            "last_activity": ["<", timeout_threshold]
+        },
+        fields=["name", "phone_number", "whatsapp_account", "current_flow"]
+    )
+
+    hot = is_hot_store_enabled()
+    expired = []
+    for session in sessions:
+        if hot and get_hot_session(session.whatsapp_account, session.phone_number):
+            continue
+        end_session(session.name, session.whatsapp_account, session.phone_number)
+        expired.append(session)
+
+    return expired
+
+
+def timeout_session(session_name):
+    """Mark a session as timed out, without loading its message history."""
+    frappe.db.set_value("WhatsApp Chatbot Session", session_name, {
+        "status": "Timeout",
+        "active_conversation": None,
+        "completed_at": datetime.now()
+    })
+
+
+def send_timeout_message(phone_number, whatsapp_account, message):
+    """Send a session timeout notice, behind interactive replies of the account.
+
+    The notice is committed with the caller's transaction.
+    """
+    from frappe_whatsapp_chatbot.chatbot.outbox import PRIORITY_NOTIFICATION, ResponseBatch
+
+    batch = ResponseBatch(phone_number, whatsapp_account, PRIORITY_NOTIFICATION)
+    batch.add(message)
+    batch.flush(commit=False)
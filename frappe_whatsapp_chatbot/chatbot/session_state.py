@@ -0,0 +1,160 @@
+import frappe
+from frappe_whatsapp_chatbot.chatbot.session_store import (
+    MESSAGE_DOCTYPE, SESSION_DOCTYPE, end_session, get_pending_messages, set_hot_session,
+    write_behind, write_session
+)
+from frappe_whatsapp_chatbot.chatbot.utils import parse_json
+
+SESSION_FIELDS = [
+    "name", "phone_number", "whatsapp_account", "status", "current_flow", "current_step",
+    "step_retries", "session_data", "started_at", "last_activity", "completed_at"
+]
+
+
+class SessionState:
+    """A WhatsApp Chatbot Session changed in memory during one turn.
+
+    Loaded with a single query, without the message history (see
+    get_messages() to read it). ``session_data``
+    is parsed once and stays a dict, assigned fields are tracked and added
+    messages are queued. flush() then writes the turn at once: one update
+    of the changed fields and one insert of the new message rows, leaving
+    the existing rows alone.
+
+    A hot state (Keep Active Sessions in Redis) is kept in Redis while the
+    session is active, and its changes are queued for the persist_sessions
+    job; only the end of the session is written to the database right away.
+
+    Fields, save() and add_message() behave like the session document's, so
+    FlowEngine works with either; save() leaves the writing to flush().
+    Other document attributes load the full document on first use.
+    """
+
+    def __init__(self, values, hot=False):
+        self._values = frappe._dict(values)
+        self._values.session_data = parse_json(self._values.session_data, {})
+        self._dirty = set()
+        self._messages = []
+        self._doc = None
+        self._hot = hot
+        self._ended = False
+
+    @classmethod
+    def load(cls, filters):
+        """Return the state of the session matching ``filters``, or None."""
+        values = frappe.db.get_value(SESSION_DOCTYPE, filters, SESSION_FIELDS, as_dict=True)
+        return cls(values) if values else None
+
+    def keep_hot(self):
+        """Keep this active session in Redis from now on."""
+        self._hot = True
+        set_hot_session(self._values)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in self._values:
+            return self._values[name]
+        return getattr(self.get_doc(), name)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+            return
+
+        if name == "session_data":
+            value = parse_json(value, {})
+        self._values[name] = value
+        self._dirty.add(name)
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def get_doc(self):
+        """Return the session document (loaded once, without this turn's changes)."""
+        if self._doc is None:
+            self._doc = frappe.get_doc(SESSION_DOCTYPE, self._values.name)
+        return self._doc
+
+    @property
+    def messages(self):
+        """Message history, like the document's child table (loaded on each use)."""
+        return self.get_messages()
+
+    def get_messages(self, limit=None):
+        """Load the message history, oldest first, including unwritten messages.
+
+        Args:
+            limit: Only return the latest ``limit`` messages
+
+        Returns:
+            list of dicts (direction, message, step_name, timestamp)
+        """
+        rows = frappe.get_all(
+            MESSAGE_DOCTYPE,
+            filters={"parent": self._values.name, "parenttype": SESSION_DOCTYPE},
+            fields=["direction", "message", "step_name", "timestamp"],
+            order_by="idx desc",
+            limit=limit
+        )
+        rows.reverse()
+
+        unwritten = get_pending_messages(self._values.name) if self._hot else []
+        rows.extend(frappe._dict(message) for message in unwritten + self._messages)
+
+        return rows[-limit:] if limit else rows
+
+    def add_message(self, direction, message, step_name=None):
+        """Queue a message for the session history."""
+        self._messages.append({
+            "direction": direction,
+            "message": message,
+            "timestamp": frappe.utils.now_datetime(),
+            "step_name": step_name
+        })
+
+    def end(self, status):
+        """Mark the session as ended elsewhere during this turn (e.g. cancelled
+        because a new flow started).
+
+        flush() then leaves its final state alone and does not keep it in
+        Redis again; only the messages of the turn are added to its history.
+        """
+        self._values.status = status
+        self._ended = True
+        self._hot = False
+
+    def save(self, ignore_permissions=False):
+        """Kept for compatibility with the document: changes are written by flush()."""
+        return self
+
+    @property
+    def is_dirty(self):
+        return bool(self._dirty or self._messages)
+
+    def flush(self):
+        """Write the changed fields and the new messages of the turn."""
+        if not self.is_dirty:
+            return
+
+        if self._ended:
+            write_session(self._values.name, {}, self._messages)
+            self._dirty.clear()
+            self._messages = []
+            return
+
+        changes = {field: self._values[field] for field in self._dirty}
+        if self._values.status == "Active":
+            changes["last_activity"] = self._values.last_activity = frappe.utils.now_datetime()
+
+        if self._hot and self._values.status == "Active":
+            write_behind(self._values, changes, self._messages)
+        else:
+            if self._hot:
+                # Earlier turns first, then the end of the session
+                end_session(self._values.name, self._values.whatsapp_account, self._values.phone_number)
+                self._hot = False
+            write_session(self._values.name, changes, self._messages)
+
+        self._dirty.clear()
+        self._messages = []
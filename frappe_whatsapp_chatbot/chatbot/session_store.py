@@ -0,0 +1,304 @@
+import frappe
+import json
+from functools import partial
+from redis.exceptions import LockError
+
+SESSION_DOCTYPE = "WhatsApp Chatbot Session"
+MESSAGE_DOCTYPE = "WhatsApp Session Message"
+
+# State of an active session, per account and phone number, expiring with
+# the session timeout
+HOT_SESSION_KEY = "whatsapp_chatbot:session:{account}:{phone}"
+# Writes not persisted yet: a list per session, and the set of sessions
+# that have some
+PENDING_WRITES_KEY = "whatsapp_chatbot:session_writes:{name}"
+DIRTY_SESSIONS_KEY = "whatsapp_chatbot:dirty_sessions"
+# Held by the process writing a session's queued changes and messages,
+# until its transaction ends
+SESSION_WRITE_LOCK_KEY = "whatsapp_chatbot:session_write_lock:{name}"
+SESSION_LOCK_TIMEOUT = 600
+SESSION_LOCK_WAIT = 10
+
+MESSAGE_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by", "docstatus",
+    "parent", "parenttype", "parentfield", "idx",
+    "direction", "message", "step_name", "timestamp"
+]
+
+
+class SessionWriteLocked(Exception):
+    pass
+
+
+def is_hot_store_enabled():
+    """Check if active sessions are kept in Redis (Keep Active Sessions in Redis)."""
+    from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+    try:
+        return bool(get_settings().cache_active_sessions)
+    except Exception:
+        return False
+
+
+def get_session_ttl():
+    from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+    try:
+        return (get_settings().session_timeout_minutes or 30) * 60
+    except Exception:
+        return 30 * 60
+
+
+def get_hot_key(whatsapp_account, phone_number):
+    return frappe.cache.make_key(HOT_SESSION_KEY.format(account=whatsapp_account or "", phone=phone_number))
+
+
+def get_active_conversation(whatsapp_account, phone_number, status):
+    """Return the active_conversation of a session.
+
+    It is the session's conversation while the session is active and None
+    once it has ended; the column is unique, so a conversation can only
+    have one active session.
+    """
+    from frappe_whatsapp_chatbot.chatbot.dispatcher import get_conversation_key
+
+    if status != "Active":
+        return None
+    return get_conversation_key(whatsapp_account, phone_number)
+
+
+def get_pending_key(session_name):
+    return frappe.cache.make_key(PENDING_WRITES_KEY.format(name=session_name))
+
+
+def get_hot_session(whatsapp_account, phone_number):
+    """Return the values of the active session kept in Redis, or None."""
+    value = frappe.cache.get(get_hot_key(whatsapp_account, phone_number))
+    return json.loads(value) if value else None
+
+
+def set_hot_session(values):
+    """Keep the values of an active session in Redis for the session timeout."""
+    frappe.cache.set(
+        get_hot_key(values["whatsapp_account"], values["phone_number"]),
+        dump(values),
+        ex=get_session_ttl()
+    )
+
+
+def drop_hot_session(whatsapp_account, phone_number):
+    frappe.cache.delete(get_hot_key(whatsapp_account, phone_number))
+
+
+def write_behind(values, changes, messages):
+    """Refresh the Redis state of an active session and queue its changes.
+
+    Args:
+        values: All values of the session
+        changes: Changed fields to write to the database
+        messages: New message rows
+    """
+    pipe = frappe.cache.pipeline()
+    pipe.set(get_hot_key(values["whatsapp_account"], values["phone_number"]), dump(values), ex=get_session_ttl())
+    pipe.rpush(get_pending_key(values["name"]), dump({"values": changes, "messages": messages}))
+    pipe.sadd(frappe.cache.make_key(DIRTY_SESSIONS_KEY), values["name"])
+    pipe.execute()
+
+
+def take_pending_writes(session_name, blocking_timeout=SESSION_LOCK_WAIT):
+    """Return the queued changes of a session, merged, to write them.
+
+    The session's write lock is held until the transaction ends, and the
+    entries returned are only removed from the queue once it commits; after
+    a rollback they are written again later.
+
+    Returns:
+        (changed fields, message rows) tuple, or None if another process
+        is writing them
+    """
+    if not lock_session_writes(session_name, blocking_timeout):
+        return None
+
+    held = get_held_session_locks()[session_name]
+    pipe = frappe.cache.pipeline()
+    pipe.lrange(get_pending_key(session_name), held["taken"], -1)
+    entries = pipe.execute()[0] or []
+    held["taken"] += len(entries)
+
+    values, messages = {}, []
+    for entry in entries:
+        entry = json.loads(entry)
+        values.update(entry["values"])
+        messages.extend(entry["messages"])
+    return values, messages
+
+
+def remove_pending_writes(session_name, count):
+    """Remove the first ``count`` (written) entries of a session's queue."""
+    key = get_pending_key(session_name)
+    dirty_key = frappe.cache.make_key(DIRTY_SESSIONS_KEY)
+
+    pipe = frappe.cache.pipeline()
+    pipe.ltrim(key, count, -1)
+    pipe.srem(dirty_key, session_name)
+    pipe.llen(key)
+    if pipe.execute()[2]:
+        # Queued by a turn in the meantime
+        pipe.sadd(dirty_key, session_name)
+        pipe.execute()
+
+
+def get_held_session_locks():
+    """Session write locks held in this transaction, by session name."""
+    if getattr(frappe.local, "whatsapp_chatbot_session_locks", None) is None:
+        frappe.local.whatsapp_chatbot_session_locks = {}
+    return frappe.local.whatsapp_chatbot_session_locks
+
+
+def lock_session_writes(session_name, blocking_timeout=SESSION_LOCK_WAIT):
+    """Hold the write lock of a session until the current transaction ends.
+
+    Queued changes and message rows of a session are written by one process
+    at a time, so message rows get consecutive idx values and no queued
+    entry is written twice. Taking the lock again in the same transaction
+    is a no-op.
+
+    Returns:
+        True if the lock is held
+    """
+    held = get_held_session_locks()
+    if session_name in held:
+        return True
+
+    lock = frappe.cache.lock(
+        frappe.cache.make_key(SESSION_WRITE_LOCK_KEY.format(name=session_name)),
+        timeout=SESSION_LOCK_TIMEOUT
+    )
+    if not lock.acquire(blocking=bool(blocking_timeout), blocking_timeout=blocking_timeout):
+        return False
+
+    if not held:
+        frappe.db.after_commit.add(release_session_locks)
+        frappe.db.after_rollback.add(partial(release_session_locks, committed=False))
+
+    held[session_name] = {"lock": lock, "taken": 0}
+    return True
+
+
+def release_session_locks(committed=True):
+    """Release the session write locks of the transaction that just ended.
+
+    Once it committed, the queued entries it wrote are removed first.
+    """
+    held = get_held_session_locks()
+    while held:
+        session_name, state = held.popitem()
+        try:
+            if committed and state["taken"]:
+                remove_pending_writes(session_name, state["taken"])
+        finally:
+            try:
+                state["lock"].release()
+            except LockError:
+                pass  # Expired while we were writing
+
+
+def get_pending_messages(session_name):
+    """Return the queued message rows of a session, without removing them."""
+    pipe = frappe.cache.pipeline()
+    pipe.lrange(get_pending_key(session_name), 0, -1)
+    entries = pipe.execute()[0]
+
+    messages = []
+    for entry in entries or []:
+        messages.extend(json.loads(entry)["messages"])
+    return messages
+
+
+def persist_sessions():
+    """Scheduled job: write the queued changes of active sessions to the database.
+
+    Sessions whose changes another process is writing are left for the next
+    run.
+    """
+    pipe = frappe.cache.pipeline()
+    pipe.smembers(frappe.cache.make_key(DIRTY_SESSIONS_KEY))
+    names = pipe.execute()[0] or []
+
+    for name in names:
+        name = name.decode() if isinstance(name, bytes) else name
+        pending = take_pending_writes(name, blocking_timeout=None)
+        if pending is None:
+            continue
+
+        try:
+            write_session(name, *pending, only_active=True)
+            frappe.db.commit()
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error(f"persist_sessions error for {name}: {str(e)}")
+
+
+def write_session(session_name, values, messages, only_active=False):
+    """Write changed fields and new message rows of a session.
+
+    Args:
+        only_active: Leave the fields of a session that has ended alone
+            (its final state was written when it ended)
+    """
+    if values:
+        if "session_data" in values and not isinstance(values["session_data"], str):
+            values = dict(values, session_data=json.dumps(values["session_data"]))
+        if values.get("status") and values["status"] != "Active":
+            values = dict(values, active_conversation=None)
+
+        filters = {"name": session_name, "status": "Active"} if only_active else session_name
+        frappe.db.set_value(SESSION_DOCTYPE, filters, values)
+
+    if messages:
+        insert_messages(session_name, messages)
+
+
+def insert_messages(session_name, messages):
+    """Append message rows to a session's history in one insert.
+
+    Rows are numbered after the highest idx of the session, under its write
+    lock, so concurrent writers never reuse an idx.
+
+    Raises:
+        SessionWriteLocked: if another process kept the lock for longer
+            than SESSION_LOCK_WAIT seconds
+    """
+    now = frappe.utils.now_datetime()
+    user = frappe.session.user
+
+    if not lock_session_writes(session_name):
+        raise SessionWriteLocked(session_name)
+    idx = frappe.db.sql(
+        """select ifnull(max(idx), 0) from `tabWhatsApp Session Message`
+        where parent = %s and parenttype = %s""",
+        (session_name, SESSION_DOCTYPE)
+    )[0][0]
+
+    rows = []
+    for message in messages:
+        idx += 1
+        rows.append((
+            frappe.generate_hash(length=10), now, now, user, user, 0,
+            session_name, SESSION_DOCTYPE, "messages", idx,
+            message["direction"], message["message"], message["step_name"], message["timestamp"]
+        ))
+
+    frappe.db.bulk_insert(MESSAGE_DOCTYPE, MESSAGE_FIELDS, rows)
+
+
+def end_session(session_name, whatsapp_account, phone_number):
+    """Persist the queued changes of a session that is ending and forget its Redis state."""
+    drop_hot_session(whatsapp_account, phone_number)
+    pending = take_pending_writes(session_name)
+    if pending is not None:  # Otherwise persist_sessions writes them
+        write_session(session_name, *pending, only_active=True)
+
+
+def dump(value):
+    return json.dumps(value, default=str)
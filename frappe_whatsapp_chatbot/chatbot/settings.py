@@ -0,0 +1,142 @@
+import frappe
+from frappe.model import no_value_fields, table_fields
+from frappe_whatsapp_chatbot.chatbot.business_hours import compile_schedule
+
+SETTINGS_VERSION_KEY = "whatsapp_chatbot:settings_version"
+SETTINGS_SNAPSHOT_KEY = "whatsapp_chatbot:settings_snapshot"
+
+# Compiled snapshots kept in process memory, per site
+_snapshots = {}
+
+
+class ChatbotSettings:
+    """Read-only snapshot of the WhatsApp Chatbot settings.
+
+    Scalar fields are available as attributes like on the document. The
+    business hours are compiled into a BusinessSchedule (business_schedule),
+    with the schedules of individual accounts in account_schedules.
+
+    The API key is not part of the snapshot; use get_password().
+    """
+
+    def __init__(self, values, version):
+        object.__setattr__(self, "_values", values)
+        object.__setattr__(self, "version", version)
+
+    def __getattr__(self, key):
+        if key.startswith("__"):
+            raise AttributeError(key)
+        return self._values.get(key)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("WhatsApp Chatbot settings snapshot is read-only")
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def get_password(self, fieldname="ai_api_key"):
+        """Decrypt a password field of the settings (not cached)."""
+        from frappe.utils.password import get_decrypted_password
+
+        return get_decrypted_password(
+            "WhatsApp Chatbot", "WhatsApp Chatbot", fieldname, raise_exception=False
+        )
+
+
+def get_settings():
+    """Return the current settings snapshot for this site.
+
+    A process reuses its compiled snapshot as long as the version in Redis
+    is unchanged; otherwise it loads the snapshot other workers already
+    stored in Redis, and only rebuilds it from the database when there is
+    none.
+    """
+    site = getattr(frappe.local, "site", None)
+
+    version = frappe.cache.get_value(SETTINGS_VERSION_KEY)
+    if not version:
+        version = bump_settings_version()
+
+    snapshot = _snapshots.get(site)
+    if snapshot and snapshot.version == version:
+        return snapshot
+
+    cached = frappe.cache.get_value(SETTINGS_SNAPSHOT_KEY)
+    if cached and cached.get("version") == version:
+        values = cached["values"]
+    else:
+        values = build_settings_values()
+        frappe.cache.set_value(SETTINGS_SNAPSHOT_KEY, {"version": version, "values": values})
+
+    snapshot = ChatbotSettings(values, version)
+    _snapshots[site] = snapshot
+    return snapshot
+
+
+def get_enabled_settings():
+    """Return the settings snapshot, or None if the chatbot is disabled."""
+    settings = get_settings()
+    return settings if settings.enabled else None
+
+
+def build_settings_values():
+    """Load the settings document and flatten it into plain values."""
+    doc = frappe.get_single("WhatsApp Chatbot")
+    meta = frappe.get_meta("WhatsApp Chatbot")
+
+    values = {}
+    for df in meta.fields:
+        if df.fieldtype in no_value_fields or df.fieldtype in table_fields:
+            continue
+        values[df.fieldname] = doc.get(df.fieldname)
+
+    values["business_schedule"] = compile_schedule(
+        doc.business_hours, doc.business_hours_timezone, doc.holidays
+    )
+    values["account_schedules"] = build_account_schedules(
+        doc.business_hours_timezone, doc.holidays
+    )
+    values["account_rate_limits"] = {
+        row.whatsapp_account: row.messages_per_second or 0
+        for row in doc.account_rate_limits
+    }
+
+    return values
+
+
+def build_account_schedules(default_timezone=None, default_holidays=None):
+    """Compile the WhatsApp Business Schedule of every account that has one.
+
+    Accounts without their own timezone or holidays use the ones of the
+    chatbot settings.
+    """
+    schedules = {}
+    for name in frappe.get_all("WhatsApp Business Schedule", pluck="name"):
+        doc = frappe.get_doc("WhatsApp Business Schedule", name)
+        schedule = compile_schedule(
+            doc.business_hours,
+            doc.timezone or default_timezone,
+            doc.holidays or default_holidays
+        )
+        if schedule:
+            schedules[doc.whatsapp_account] = schedule
+    return schedules
+
+
+def bump_settings_version():
+    """Give the settings a new version so every process recompiles them."""
+    version = frappe.generate_hash(length=12)
+    frappe.cache.set_value(SETTINGS_VERSION_KEY, version)
+    frappe.cache.delete_value(SETTINGS_SNAPSHOT_KEY)
+    return version
+
+
+def clear_settings_cache(doc=None, method=None):
+    """Invalidate the settings snapshot on every worker.
+
+    The version changes right away, so the rest of this transaction reads
+    the new settings, and again once it commits: a worker that rebuilt the
+    snapshot in between still read the old rows.
+    """
+    bump_settings_version()
+    frappe.db.after_commit.add(bump_settings_version)
@@ -0,0 +1,178 @@
+import frappe
+import json
+import random
+import time
+from contextlib import contextmanager
+
+# Redis list holding the most recent message traces (newest first)
+TRACES_KEY = "whatsapp_chatbot:traces"
+TRACES_SIZE = 1000
+
+
+class Trace:
+    """Timing of the stages of processing one message.
+
+    Each span records its wall time and the number of database queries
+    issued inside it. Spans with the same name add up, and spans may be
+    nested (the outer one includes the inner one). ``branch`` names the
+    stage that produced the reply.
+
+    An unsampled trace records nothing and costs next to nothing.
+    """
+
+    def __init__(self, message_name=None, sampled=True):
+        self.message_name = message_name
+        self.sampled = sampled
+        self.branch = None
+        self.spans = {}
+        self.queries = 0
+        self.started_at = time.perf_counter()
+        self._sql = None
+        self._db = None
+        self._override = None
+
+        if sampled:
+            self.count_queries()
+
+    def count_queries(self):
+        """Count queries by wrapping frappe.db.sql while the trace runs."""
+        self._db = frappe.db
+        # Keep an existing override (e.g. the recorder's) to put it back later
+        self._override = self._db.__dict__.get("sql")
+        self._sql = self._db.sql
+
+        def sql(*args, **kwargs):
+            self.queries += 1
+            return self._sql(*args, **kwargs)
+
+        self._db.sql = sql
+
+    @contextmanager
+    def span(self, name):
+        """Time a stage of processing."""
+        if not self.sampled:
+            yield
+            return
+
+        started_at = time.perf_counter()
+        queries = self.queries
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            span = self.spans.setdefault(name, [0, 0])
+            span[0] += elapsed
+            span[1] += self.queries - queries
+
+    def finish(self):
+        """Stop counting queries and store the trace."""
+        if get_current_trace() is self:
+            frappe.local.whatsapp_chatbot_trace = None
+
+        if not self.sampled:
+            return
+
+        if self._override:
+            self._db.sql = self._override
+        else:
+            del self._db.sql  # Back to the class method
+        self.sampled = False
+
+        try:
+            frappe.cache.lpush(TRACES_KEY, json.dumps({
+                "message": self.message_name,
+                "branch": self.branch,
+                "total": round(time.perf_counter() - self.started_at, 4),
+                "queries": self.queries,
+                "spans": {name: [round(t, 4), q] for name, (t, q) in self.spans.items()},
+                "at": time.time()
+            }))
+            frappe.cache.ltrim(TRACES_KEY, 0, TRACES_SIZE - 1)
+        except Exception:
+            pass  # Traces are best effort, never fail processing because of them
+
+
+def start_trace(message_name=None):
+    """Start the trace of a message, sampled at the configured rate.
+
+    The trace becomes the current one, used by span(). Loading the settings
+    to read the rate is recorded as the "settings" span (without queries).
+    """
+    from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+    started_at = time.perf_counter()
+    try:
+        rate = get_settings().trace_sample_rate or 0
+    except Exception:
+        rate = 0
+
+    trace = Trace(message_name, sampled=rate > 0 and random.random() < rate)
+    if trace.sampled:
+        trace.started_at = started_at
+        trace.spans["settings"] = [time.perf_counter() - started_at, 0]
+
+    frappe.local.whatsapp_chatbot_trace = trace
+    return trace
+
+
+def get_current_trace():
+    """Return the trace of the message being processed, if any."""
+    return getattr(frappe.local, "whatsapp_chatbot_trace", None)
+
+
+@contextmanager
+def span(name):
+    """Time a stage as part of the current trace (no-op without one)."""
+    trace = get_current_trace()
+    if not trace:
+        yield
+        return
+
+    with trace.span(name):
+        yield
+
+
+def get_traces():
+    """Return the stored traces, newest first."""
+    traces = []
+    for row in frappe.cache.lrange(TRACES_KEY, 0, -1) or []:
+        try:
+            traces.append(json.loads(row))
+        except Exception:
+            continue
+    return traces
+
+
+def get_processing_stats():
+    """Return p50/p95/p99/max time and queries per stage over recent traces.
+
+    Also includes the expression cache counters of the current process and
+    the regex time limit overruns per keyword rule or flow step.
+    """
+    from frappe_whatsapp_chatbot.chatbot.dispatcher import summarize
+    from frappe_whatsapp_chatbot.chatbot.expressions import get_expression_cache_info
+    from frappe_whatsapp_chatbot.chatbot.regex_guard import get_regex_timeouts
+
+    traces = get_traces()
+
+    times, queries, branches = {}, {}, {}
+    for trace in traces:
+        branch = trace.get("branch") or "none"
+        branches[branch] = branches.get(branch, 0) + 1
+
+        stages = dict(trace.get("spans") or {})
+        stages["total"] = [trace.get("total"), trace.get("queries")]
+        for name, (elapsed, count) in stages.items():
+            times.setdefault(name, []).append(elapsed)
+            queries.setdefault(name, []).append(count)
+
+    return {
+        "samples": len(traces),
+        "branches": branches,
+        "stages": {
+            name: {"time": summarize(times[name]), "queries": summarize(queries[name])}
+            for name in times
+        },
+        "expression_cache": get_expression_cache_info(),
+        "regex_timeouts": get_regex_timeouts()
+    }
@@ -0,0 +1,101 @@
+import json
+import unicodedata
+from typing import NamedTuple
+
+
+class NormalizedMessage(NamedTuple):
+    """An incoming message normalized once for every matching stage.
+
+    Attributes:
+        raw: Text as received
+        text: NFKC form, trimmed (full-width and compatibility characters
+            become their plain equivalents)
+        folded: ``text`` casefolded, for case-insensitive comparisons
+        unaccented: ``folded`` without accents
+        tokens: Words of ``folded``
+        phone: Sender's phone number in E.164 form
+    """
+
+    raw: str
+    text: str
+    folded: str
+    unaccented: str
+    tokens: tuple
+    phone: str
+
+
+def normalize_message(text, phone_number=None):
+    """Return the NormalizedMessage of an incoming text."""
+    raw = text or ""
+    normalized = normalize_text(raw)
+    folded = normalized.casefold()
+
+    return NormalizedMessage(
+        raw=raw,
+        text=normalized,
+        folded=folded,
+        unaccented=strip_accents(folded),
+        tokens=tuple(folded.split()),
+        phone=normalize_phone(phone_number)
+    )
+
+
+def as_message(message):
+    """Return ``message`` as a NormalizedMessage (it may be a plain text)."""
+    if isinstance(message, NormalizedMessage):
+        return message
+    return normalize_message(message)
+
+
+def normalize_text(text):
+    """Normalize a keyword the way NormalizedMessage.text is built."""
+    return unicodedata.normalize("NFKC", text or "").strip()
+
+
+def fold_text(text):
+    """Normalize a keyword the way NormalizedMessage.folded is built."""
+    return normalize_text(text).casefold()
+
+
+def strip_accents(text):
+    """Remove accents (combining marks), e.g. "café" becomes "cafe"."""
+    decomposed = unicodedata.normalize("NFD", text)
+    if decomposed == text:
+        return text
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return unicodedata.normalize("NFC", stripped)
+
+
+def normalize_phone(phone_number):
+    """Normalize a phone number to E.164 form (+<country code><number>).
+
+    WhatsApp sends numbers as bare digits including the country code, while
+    people type them with spaces, dashes, brackets, a leading + or an 00
+    international prefix. All of these map to the same key.
+
+    Returns an empty string if there are no digits.
+    """
+    if not phone_number:
+        return ""
+
+    phone_number = str(phone_number).strip()
+    digits = "".join(ch for ch in phone_number if ch.isdigit())
+
+    if not phone_number.startswith("+") and digits.startswith("00"):
+        digits = digits[2:]
+
+    return f"+{digits}" if digits else ""
+
+
+def parse_json(value, default=None):
+    """Safely parse JSON - handles both string and already-parsed dict/list."""
+    if value is None:
+        return default if default is not None else {}
+    if isinstance(value, (dict, list)):
+        return value
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except (json.JSONDecodeError, TypeError):
+            return default if default is not None else {}
+    return default if default is not None else {}
@@ -0,0 +1,61 @@
+import click
+from frappe.commands import pass_context
+from frappe.exceptions import SiteNotSpecifiedError
+
+
+@click.command("rebuild-chatbot-cache")
+@pass_context
+def rebuild_chatbot_cache(context):
+    """Repopulate the chatbot's cached agent transfers and excluded numbers from the database"""
+    import frappe
+    from frappe_whatsapp_chatbot.chatbot.agent_transfers import rebuild_agent_transfers_cache
+    from frappe_whatsapp_chatbot.chatbot.exclusions import rebuild_excluded_numbers_cache
+
+    if not context.sites:
+        raise SiteNotSpecifiedError
+
+    for site in context.sites:
+        frappe.init(site=site)
+        frappe.connect()
+        try:
+            transfers = rebuild_agent_transfers_cache()
+            excluded = rebuild_excluded_numbers_cache()
+            click.echo(f"{site}: {transfers} active agent transfers, {excluded} excluded numbers")
+        finally:
+            frappe.destroy()
+
+
+@click.command("evaluate-chatbot-rules")
+@click.argument("corpus", type=click.Path(exists=True, dir_okay=False))
+@click.option("--account", help="WhatsApp Account whose rules are evaluated")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write each message's result to this JSONL file")
+@pass_context
+def evaluate_chatbot_rules(context, corpus, account=None, output=None):
+    """Run a corpus of sample messages (.jsonl, .csv or .txt) through the keyword rules and flow triggers"""
+    import json
+    import frappe
+    from frappe_whatsapp_chatbot.chatbot.rule_evaluation import evaluate_messages, read_corpus
+
+    if not context.sites:
+        raise SiteNotSpecifiedError
+
+    site = context.sites[0]
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        if output:
+            with open(output, "w", encoding="utf-8") as results:
+                report = evaluate_messages(
+                    read_corpus(corpus),
+                    account,
+                    lambda result: results.write(json.dumps(result, ensure_ascii=False) + "\n")
+                )
+        else:
+            report = evaluate_messages(read_corpus(corpus), account)
+
+        click.echo(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+    finally:
+        frappe.destroy()
+
+
+commands = [rebuild_chatbot_cache, evaluate_chatbot_rules]
@@ -1,8 +1,9 @@
 # Copyright (c) 2025, Shridhar Patil and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests import IntegrationTestCase
+from frappe_whatsapp_chatbot.frappe_whatsapp_chatbot.doctype.whatsapp_agent_transfer.whatsapp_agent_transfer import WhatsAppAgentTransfer
 
 
 # On IntegrationTestCase, the doctype test records and all
@@ -19,4 +20,39 @@ class IntegrationTestWhatsAppAgentTransfer(IntegrationTestCase):
 	Use this class for testing interactions between multiple components.
 	"""
 
-	pass
+	def tearDown(self):
+		frappe.db.delete("WhatsApp Agent Transfer", {"phone_number": "+91 98765 11111"})
+
+	def test_transfer_status_is_cached(self):
+		doc = WhatsAppAgentTransfer.transfer_to_agent("+91 98765 11111", notes="Test")
+		frappe.db.after_commit.run()  # The cache is updated on commit
+
+		self.assertEqual(WhatsAppAgentTransfer.is_transferred("919876511111"), doc.name)
+
+		WhatsAppAgentTransfer.resume_chatbot("+91 98765 11111")
+		frappe.db.after_commit.run()
+
+		self.assertIsNone(WhatsAppAgentTransfer.is_transferred("919876511111"))
+
+	def test_phone_formats_match_same_transfer(self):
+		doc = WhatsAppAgentTransfer.transfer_to_agent("+91 98765 11111", notes="Test")
+
+		self.assertEqual(WhatsAppAgentTransfer.transfer_to_agent("919876511111").name, doc.name)
+		self.assertTrue(WhatsAppAgentTransfer.resume_chatbot("0091 98765 11111"))
+		frappe.db.after_commit.run()
+		self.assertIsNone(WhatsAppAgentTransfer.is_transferred("+91 98765 11111"))
+
+	def test_lost_cache_is_rebuilt(self):
+		from frappe_whatsapp_chatbot.chatbot.agent_transfers import (
+			AGENT_TRANSFERS_KEY, LOADED_MARKER, get_active_transfer, rebuild_agent_transfers_cache
+		)
+
+		doc = WhatsAppAgentTransfer.transfer_to_agent("+91 98765 11111", notes="Test")
+
+		rebuild_agent_transfers_cache()
+		self.assertTrue(frappe.cache.hexists(AGENT_TRANSFERS_KEY, LOADED_MARKER))
+
+		# As if Redis evicted the hash
+		frappe.cache.delete_value(AGENT_TRANSFERS_KEY)
+		self.assertEqual(get_active_transfer("919876511111")["name"], doc.name)
+		self.assertTrue(frappe.cache.hexists(AGENT_TRANSFERS_KEY, LOADED_MARKER))
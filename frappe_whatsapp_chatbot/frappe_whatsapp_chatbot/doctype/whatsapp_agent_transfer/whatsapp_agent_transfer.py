@@ -4,15 +4,28 @@
 import frappe
 from frappe.model.document import Document
 from frappe.utils import now_datetime
+from frappe_whatsapp_chatbot.chatbot.agent_transfers import get_active_transfer, update_transfer_cache
+from frappe_whatsapp_chatbot.chatbot.utils import normalize_phone
 
 
 class WhatsAppAgentTransfer(Document):
+    def validate(self):
+        self.normalized_number = normalize_phone(self.phone_number)
+
     def before_save(self):
         # If status changed to Resumed, record when and by whom
         if self.has_value_changed("status") and self.status == "Resumed":
             self.resumed_at = now_datetime()
             self.resumed_by = frappe.session.user
 
+    def on_update(self):
+        # Keep the cached transfer status used by the chatbot in sync
+        previous = self.get_doc_before_save()
+        update_transfer_cache(self.normalized_number, previous and previous.normalized_number)
+
+    def on_trash(self):
+        update_transfer_cache(self.normalized_number)
+
     @staticmethod
     def is_transferred(phone_number, whatsapp_account=None):
         """Check if a phone number is currently transferred to an agent.
@@ -22,16 +35,10 @@ class WhatsAppAgentTransfer(Document):
             whatsapp_account: Optional WhatsApp account filter
 
         Returns:
-            bool: True if transferred and active, False otherwise
+            Name of the active transfer (truthy), or None
         """
-        filters = {
-            "phone_number": phone_number,
-            "status": "Active"
-        }
-        if whatsapp_account:
-            filters["whatsapp_account"] = whatsapp_account
-
-        return frappe.db.exists("WhatsApp Agent Transfer", filters)
+        transfer = get_active_transfer(phone_number, whatsapp_account)
+        return transfer["name"] if transfer else None
 
     @staticmethod
     def transfer_to_agent(phone_number, whatsapp_account=None, agent=None, notes=None):
@@ -46,9 +53,9 @@ class WhatsAppAgentTransfer(Document):
         Returns:
             WhatsApp Agent Transfer document
         """
-        # Check if already transferred
+        # Check if already transferred (the number may be written differently)
         existing = frappe.db.exists("WhatsApp Agent Transfer", {
-            "phone_number": phone_number,
+            "normalized_number": normalize_phone(phone_number),
             "status": "Active"
         })
 
@@ -81,7 +88,7 @@ class WhatsAppAgentTransfer(Document):
             bool: True if resumed, False if no active transfer found
         """
         filters = {
-            "phone_number": phone_number,
+            "normalized_number": normalize_phone(phone_number),
             "status": "Active"
         }
         if whatsapp_account:
@@ -99,3 +106,7 @@ class WhatsAppAgentTransfer(Document):
 
         frappe.db.commit()
         return True
+
+
+def on_doctype_update():
+    frappe.db.add_index("WhatsApp Agent Transfer", ["normalized_number", "status"])
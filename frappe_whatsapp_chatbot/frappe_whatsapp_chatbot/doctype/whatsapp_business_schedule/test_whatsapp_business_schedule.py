@@ -0,0 +1,41 @@
+# Copyright (c) 2026, Shridhar Patil and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests import IntegrationTestCase
+
+
+# On IntegrationTestCase, the doctype test records and all
+# link-field test record dependencies are recursively loaded
+# Use these module variables to add/remove to/from that list
+EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+
+
+
+class IntegrationTestWhatsAppBusinessSchedule(IntegrationTestCase):
+	"""
+	Integration tests for WhatsAppBusinessSchedule.
+	Use this class for testing interactions between multiple components.
+	"""
+
+	def test_invalid_timezone(self):
+		doc = frappe.get_doc({
+			"doctype": "WhatsApp Business Schedule",
+			"timezone": "Mars/Olympus_Mons",
+			"business_hours": [{"day": "Monday", "enabled": 1}]
+		})
+
+		self.assertRaises(frappe.ValidationError, doc.validate)
+
+	def test_duplicate_days(self):
+		doc = frappe.get_doc({
+			"doctype": "WhatsApp Business Schedule",
+			"timezone": "Asia/Kolkata",
+			"business_hours": [
+				{"day": "Monday", "enabled": 1},
+				{"day": "Monday", "enabled": 0}
+			]
+		})
+
+		self.assertRaises(frappe.ValidationError, doc.validate)
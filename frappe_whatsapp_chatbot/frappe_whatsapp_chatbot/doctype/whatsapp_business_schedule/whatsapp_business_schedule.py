@@ -0,0 +1,21 @@
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe_whatsapp_chatbot.chatbot.business_hours import validate_timezone
+from frappe_whatsapp_chatbot.chatbot.settings import clear_settings_cache
+
+
+class WhatsAppBusinessSchedule(Document):
+    def validate(self):
+        validate_timezone(self.timezone)
+
+        days = [row.day for row in self.business_hours]
+        duplicates = {day for day in days if days.count(day) > 1}
+        if duplicates:
+            frappe.throw(_("Business hours are set more than once for {0}").format(", ".join(sorted(duplicates))))
+
+    def on_update(self):
+        clear_settings_cache()
+
+    def on_trash(self):
+        clear_settings_cache()
@@ -14,9 +14,22 @@ class WhatsAppChatbot(Document):
             if not self.business_hours or len(self.business_hours) == 0:
                 frappe.throw("Please configure business hours for at least one day")
 
+        from frappe_whatsapp_chatbot.chatbot.business_hours import validate_timezone
+        validate_timezone(self.business_hours_timezone)
+
         if self.ai_temperature and (self.ai_temperature < 0 or self.ai_temperature > 1):
             frappe.throw("AI Temperature must be between 0 and 1")
 
+        if self.coalesce_window_seconds and not self.process_in_background:
+            frappe.throw("Coalescing Window requires Process in Background")
+
+        if self.trace_sample_rate and self.trace_sample_rate > 1:
+            frappe.throw("Trace Sample Rate must be between 0 and 1")
+
+    def on_update(self):
+        from frappe_whatsapp_chatbot.chatbot.settings import clear_settings_cache
+        clear_settings_cache()
+
     @frappe.whitelist()
     def populate_default_business_hours(self):
         """Populate business hours table with default weekday schedule."""
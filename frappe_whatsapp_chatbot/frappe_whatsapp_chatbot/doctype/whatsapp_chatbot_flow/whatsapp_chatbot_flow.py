@@ -1,11 +1,31 @@
 import frappe
 from frappe.model.document import Document
+from frappe_whatsapp_chatbot.chatbot.expressions import validate_expression
+from frappe_whatsapp_chatbot.chatbot.flow_graph import clear_flow_graphs, find_trigger_collisions
 
 
 class WhatsAppChatbotFlow(Document):
     def validate(self):
         self.validate_steps()
         self.validate_completion_action()
+        self.validate_triggers()
+
+    def on_update(self):
+        clear_flow_graphs()
+
+    def on_trash(self):
+        clear_flow_graphs()
+
+    def validate_triggers(self):
+        if not self.enabled:
+            return
+
+        collisions = find_trigger_collisions(self)
+        if collisions:
+            frappe.throw("<br>".join(
+                f"Trigger '{trigger}' is already used by flow '{other}'"
+                for trigger, other in collisions
+            ), title="Duplicate Flow Trigger")
 
     def validate_steps(self):
         if not self.steps:
@@ -17,6 +37,8 @@ class WhatsAppChatbotFlow(Document):
                 frappe.throw(f"Duplicate step name: {step.step_name}")
             step_names.append(step.step_name)
 
+            validate_expression(step.skip_condition, f"skip condition for step {step.step_name}")
+
             # Validate next_step references
             if step.next_step and step.next_step not in step_names:
                 # It might reference a later step, so we'll check after collecting all names
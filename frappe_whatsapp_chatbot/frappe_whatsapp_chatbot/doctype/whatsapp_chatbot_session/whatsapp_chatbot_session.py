@@ -1,13 +1,46 @@
 import frappe
+from frappe import _
 from frappe.model.document import Document
+from frappe_whatsapp_chatbot.chatbot.session_store import drop_hot_session, get_active_conversation
 
 
 class WhatsAppChatbotSession(Document):
+    def validate(self):
+        if self.is_new() and self.status == "Active":
+            self.validate_single_active_session()
+
+        # Unique while active: the database refuses a second active session
+        # even when two are inserted at the same time
+        self.active_conversation = get_active_conversation(
+            self.whatsapp_account, self.phone_number, self.status
+        )
+
     def before_save(self):
         # Update last_activity on every save
         if self.status == "Active":
             self.last_activity = frappe.utils.now_datetime()
 
+    def on_update(self):
+        # Edited outside a turn: the next message reloads it from the database
+        drop_hot_session(self.whatsapp_account, self.phone_number)
+
+    def on_trash(self):
+        drop_hot_session(self.whatsapp_account, self.phone_number)
+
+    def validate_single_active_session(self):
+        """A conversation can never have two active sessions."""
+        existing = frappe.db.get_value("WhatsApp Chatbot Session", {
+            "phone_number": self.phone_number,
+            "whatsapp_account": self.whatsapp_account,
+            "status": "Active"
+        }, "name")
+
+        if existing:
+            frappe.throw(
+                _("Session {0} is already active for {1}").format(existing, self.phone_number),
+                frappe.DuplicateEntryError
+            )
+
     def add_message(self, direction, message, step_name=None):
         """Add a message to the session history."""
         self.append("messages", {
@@ -16,3 +49,7 @@ class WhatsAppChatbotSession(Document):
             "timestamp": frappe.utils.now_datetime(),
             "step_name": step_name
         })
+
+
+def on_doctype_update():
+    frappe.db.add_index("WhatsApp Chatbot Session", ["phone_number", "whatsapp_account", "status"])
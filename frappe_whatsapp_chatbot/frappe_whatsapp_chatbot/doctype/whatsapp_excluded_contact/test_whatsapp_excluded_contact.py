@@ -0,0 +1,38 @@
+# Copyright (c) 2026, Shridhar Patil and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests import IntegrationTestCase
+
+
+# On IntegrationTestCase, the doctype test records and all
+# link-field test record dependencies are recursively loaded
+# Use these module variables to add/remove to/from that list
+EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+
+
+
+class IntegrationTestWhatsAppExcludedContact(IntegrationTestCase):
+	"""
+	Integration tests for WhatsAppExcludedContact.
+	Use this class for testing interactions between multiple components.
+	"""
+
+	def tearDown(self):
+		frappe.db.delete("WhatsApp Excluded Contact", {"normalized_number": "+919876500000"})
+
+	def test_excluded_number_lookup_is_normalized(self):
+		from frappe_whatsapp_chatbot.chatbot.exclusions import is_excluded
+
+		doc = frappe.get_doc({
+			"doctype": "WhatsApp Excluded Contact",
+			"phone_number": "+91 98765-00000",
+			"reason": "Test device"
+		}).insert(ignore_permissions=True)
+
+		self.assertEqual(doc.normalized_number, "+919876500000")
+		self.assertTrue(is_excluded("919876500000"))
+
+		doc.delete(ignore_permissions=True)
+		self.assertFalse(is_excluded("919876500000"))
@@ -0,0 +1,33 @@
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe_whatsapp_chatbot.chatbot.exclusions import update_cache
+from frappe_whatsapp_chatbot.chatbot.utils import normalize_phone
+
+
+class WhatsAppExcludedContact(Document):
+    def validate(self):
+        self.normalized_number = normalize_phone(self.phone_number)
+        if not self.normalized_number:
+            frappe.throw(_("Please enter a valid phone number"))
+
+        existing = frappe.db.get_value(
+            "WhatsApp Excluded Contact",
+            {"normalized_number": self.normalized_number, "name": ["!=", self.name]},
+            "name"
+        )
+        if existing:
+            frappe.throw(
+                _("{0} is already excluded ({1})").format(self.phone_number, existing),
+                frappe.DuplicateEntryError
+            )
+
+    def on_update(self):
+        previous = self.get_doc_before_save()
+        removed = []
+        if previous and previous.normalized_number != self.normalized_number:
+            removed.append(previous.normalized_number)
+        update_cache(added=[self.normalized_number], removed=removed)
+
+    def on_trash(self):
+        update_cache(removed=[self.normalized_number])
@@ -1,5 +1,8 @@
 import frappe
 from frappe.model.document import Document
+from frappe_whatsapp_chatbot.chatbot.expressions import validate_expression
+from frappe_whatsapp_chatbot.chatbot.keyword_index import MAX_EDIT_DISTANCE, clear_keyword_index
+from frappe_whatsapp_chatbot.chatbot.regex_guard import clear_regex_timeouts
 
 
 class WhatsAppKeywordReply(Document):
@@ -7,6 +10,16 @@ class WhatsAppKeywordReply(Document):
         self.validate_keywords()
         self.validate_response()
         self.validate_dates()
+        validate_expression(self.conditions, "conditions")
+        self.warn_conflicts()
+
+    def on_update(self):
+        clear_keyword_index()
+        # A fixed pattern starts with a clean slate
+        clear_regex_timeouts(self.name)
+
+    def on_trash(self):
+        clear_keyword_index()
 
     def validate_keywords(self):
         if not self.keywords or not self.keywords.strip():
@@ -22,6 +35,10 @@ class WhatsAppKeywordReply(Document):
                 except re.error as e:
                     frappe.throw(f"Invalid regex pattern '{keyword}': {str(e)}")
 
+        if self.match_type == "Fuzzy":
+            if not 1 <= (self.max_edit_distance or 0) <= MAX_EDIT_DISTANCE:
+                frappe.throw(f"Max Edit Distance must be between 1 and {MAX_EDIT_DISTANCE}")
+
     def validate_response(self):
         if self.response_type == "Text" and not self.response_text:
             frappe.throw("Please enter Response Text for Text response type")
@@ -35,6 +52,21 @@ class WhatsAppKeywordReply(Document):
         elif self.response_type == "Flow" and not self.trigger_flow:
             frappe.throw("Please select a Flow for Flow response type")
 
+    def warn_conflicts(self):
+        """Warn about keywords other rules make unreachable (or this rule does)."""
+        if frappe.flags.in_import or frappe.flags.in_migrate or frappe.flags.in_install:
+            return
+
+        from frappe_whatsapp_chatbot.chatbot.rule_analyzer import get_rule_conflicts
+
+        conflicts = get_rule_conflicts(self)
+        if conflicts:
+            frappe.msgprint(
+                "<br>".join(f"{c['issue']}: {frappe.utils.escape_html(c['details'])}" for c in conflicts),
+                title="Keyword Rule Conflicts",
+                indicator="orange"
+            )
+
     def validate_dates(self):
         if self.active_from and self.active_until:
             if self.active_from > self.active_until:
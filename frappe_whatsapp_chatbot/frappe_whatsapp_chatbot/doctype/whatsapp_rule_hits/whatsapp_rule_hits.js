@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Shridhar Patil and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("WhatsApp Rule Hits", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,19 @@
+// Copyright (c) 2026, Shridhar Patil and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Keyword Rule Conflicts"] = {
+	filters: [
+		{
+			fieldname: "whatsapp_account",
+			label: __("WhatsApp Account"),
+			fieldtype: "Link",
+			options: "WhatsApp Account",
+		},
+		{
+			fieldname: "issue",
+			label: __("Issue"),
+			fieldtype: "Select",
+			options: "\nNever Fires\nShadowed Keyword\nOverlapping Keyword\nCatastrophic Regex\nRegex Timeout",
+		},
+	],
+};
@@ -0,0 +1,62 @@
+# Copyright (c) 2026, Shridhar Patil and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+
+
+def execute(filters=None):
+    from frappe_whatsapp_chatbot.chatbot.rule_analyzer import analyze_rules
+
+    filters = frappe._dict(filters or {})
+
+    findings = analyze_rules() + get_regex_timeout_findings()
+    if filters.whatsapp_account:
+        findings = [
+            f for f in findings
+            if f["whatsapp_account"] in (None, filters.whatsapp_account)
+        ]
+    if filters.issue:
+        findings = [f for f in findings if f["issue"] == filters.issue]
+
+    return get_columns(), findings
+
+
+def get_regex_timeout_findings():
+    """Keyword rules whose regex ran out of time on live messages."""
+    from frappe_whatsapp_chatbot.chatbot.regex_guard import get_regex_timeouts
+
+    timeouts = get_regex_timeouts()
+    if not timeouts:
+        return []
+
+    rules = frappe.get_all(
+        "WhatsApp Keyword Reply",
+        filters={"name": ["in", list(timeouts)]},
+        fields=["name", "title", "priority", "whatsapp_account"]
+    )
+    return [
+        {
+            "issue": "Regex Timeout",
+            "rule": rule.name,
+            "title": rule.title,
+            "priority": rule.priority,
+            "whatsapp_account": rule.whatsapp_account,
+            "keyword": None,
+            "conflicting_rule": None,
+            "details": _("Ran out of time on {0} messages and was treated as not matching").format(timeouts[rule.name])
+        }
+        for rule in rules
+    ]
+
+
+def get_columns():
+    return [
+        {"fieldname": "issue", "label": _("Issue"), "fieldtype": "Data", "width": 160},
+        {"fieldname": "rule", "label": _("Rule"), "fieldtype": "Link", "options": "WhatsApp Keyword Reply", "width": 200},
+        {"fieldname": "priority", "label": _("Priority"), "fieldtype": "Int", "width": 80},
+        {"fieldname": "whatsapp_account", "label": _("WhatsApp Account"), "fieldtype": "Link", "options": "WhatsApp Account", "width": 150},
+        {"fieldname": "keyword", "label": _("Keyword"), "fieldtype": "Data", "width": 150},
+        {"fieldname": "conflicting_rule", "label": _("Conflicting Rule"), "fieldtype": "Link", "options": "WhatsApp Keyword Reply", "width": 200},
+        {"fieldname": "details", "label": _("Details"), "fieldtype": "Data", "width": 350},
+    ]
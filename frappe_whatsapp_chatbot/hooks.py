@@ -10,13 +10,27 @@ required_apps = ["shridarpatil/frappe_whatsapp"]
 doc_events = {
     "WhatsApp Message": {
         "after_insert": "frappe_whatsapp_chatbot.chatbot.processor.process_incoming_message"
+    },
+    "WhatsApp Templates": {
+        "on_update": "frappe_whatsapp_chatbot.chatbot.keyword_index.clear_keyword_index",
+        "on_trash": "frappe_whatsapp_chatbot.chatbot.keyword_index.clear_keyword_index"
     }
 }
 
+# Migration
+# Recompile the settings snapshot after fields or schedules change
+after_migrate = ["frappe_whatsapp_chatbot.chatbot.settings.clear_settings_cache"]
+
 # Scheduler Events
 scheduler_events = {
+    "all": [
+        "frappe_whatsapp_chatbot.chatbot.dispatcher.process_deferred_conversations",
+        "frappe_whatsapp_chatbot.chatbot.outbox.drain_send_queues",
+        "frappe_whatsapp_chatbot.chatbot.session_store.persist_sessions"
+    ],
     "hourly": [
-        "frappe_whatsapp_chatbot.chatbot.session_manager.cleanup_expired_sessions"
+        "frappe_whatsapp_chatbot.chatbot.session_manager.cleanup_expired_sessions",
+        "frappe_whatsapp_chatbot.chatbot.rule_hits.flush_rule_hits"
     ]
 }
 
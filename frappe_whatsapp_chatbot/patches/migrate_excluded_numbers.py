@@ -0,0 +1,20 @@
+import frappe
+
+
+def execute():
+    """Move excluded numbers from the WhatsApp Chatbot child table to WhatsApp Excluded Contact."""
+    if not frappe.db.table_exists("WhatsApp Excluded Number"):
+        return
+
+    frappe.reload_doc("frappe_whatsapp_chatbot", "doctype", "whatsapp_excluded_contact")
+
+    from frappe_whatsapp_chatbot.chatbot.exclusions import exclude_numbers
+
+    rows = frappe.db.sql(
+        """select phone_number, reason from `tabWhatsApp Excluded Number`
+        where parenttype = 'WhatsApp Chatbot' order by idx""",
+        as_dict=True
+    )
+
+    for row in rows:
+        exclude_numbers([row.phone_number], row.reason)
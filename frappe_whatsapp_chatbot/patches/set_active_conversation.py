@@ -0,0 +1,28 @@
+import frappe
+from frappe_whatsapp_chatbot.chatbot.session_store import get_active_conversation
+
+
+def execute():
+    """Mark active sessions with their conversation, cancelling older duplicates."""
+    sessions = frappe.get_all(
+        "WhatsApp Chatbot Session",
+        filters={"status": "Active"},
+        fields=["name", "phone_number", "whatsapp_account"],
+        order_by="creation desc"
+    )
+
+    seen = set()
+    for session in sessions:
+        conversation = get_active_conversation(session.whatsapp_account, session.phone_number, "Active")
+        if conversation in seen:
+            frappe.db.set_value("WhatsApp Chatbot Session", session.name, {
+                "status": "Cancelled",
+                "completed_at": frappe.utils.now_datetime()
+            }, update_modified=False)
+            continue
+
+        seen.add(conversation)
+        frappe.db.set_value(
+            "WhatsApp Chatbot Session", session.name, "active_conversation", conversation,
+            update_modified=False
+        )
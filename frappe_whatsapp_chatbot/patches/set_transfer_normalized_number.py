@@ -0,0 +1,17 @@
+import frappe
+from frappe_whatsapp_chatbot.chatbot.utils import normalize_phone
+
+
+def execute():
+    """Fill the normalized number of existing WhatsApp Agent Transfer records."""
+    transfers = frappe.get_all(
+        "WhatsApp Agent Transfer",
+        filters={"normalized_number": ["is", "not set"]},
+        fields=["name", "phone_number"]
+    )
+
+    for transfer in transfers:
+        frappe.db.set_value(
+            "WhatsApp Agent Transfer", transfer.name, "normalized_number",
+            normalize_phone(transfer.phone_number), update_modified=False
+        )
@@ -75,6 +75,261 @@ class TestKeywordMatcher(IntegrationTestCase):
         result = matcher.match("goodbye")
         self.assertIsNone(result)
 
+    def test_evaluate_messages(self):
+        """Test that a corpus is evaluated against the rules in one pass."""
+        from frappe_whatsapp_chatbot.chatbot.rule_evaluation import evaluate_messages
+
+        name = frappe.db.get_value("WhatsApp Keyword Reply", {"title": "Test Greeting"})
+        report = evaluate_messages(["hello", "Hey ", "goodbye"])
+
+        self.assertEqual(report["messages"], 3)
+        self.assertEqual(report["rules"][name]["hits"], 2)
+        self.assertIn("goodbye", report["unmatched_samples"])
+
+
+class TestKeywordIndex(IntegrationTestCase):
+    """Test the compiled keyword index."""
+
+    def get_index(self, *rules, now=None):
+        from frappe_whatsapp_chatbot.chatbot.keyword_index import KeywordIndex
+
+        return KeywordIndex([
+            frappe._dict({"name": f"R{i}", "case_sensitive": 0, **rule}) for i, rule in enumerate(rules)
+        ], now=now)
+
+    def matches(self, index, text):
+        return [rule.name for rule in index.iter_matches(text)]
+
+    def test_matches_in_priority_order(self):
+        """Test that every match type is found and ranked by priority."""
+        index = self.get_index(
+            {"keywords": "order\\s+\\d+", "match_type": "Regex"},
+            {"keywords": "status", "match_type": "Contains"},
+            {"keywords": "where, order", "match_type": "Starts With"},
+            {"keywords": "order 42 status", "match_type": "Exact"},
+        )
+
+        self.assertEqual(self.matches(index, "Order 42 status"), ["R0", "R1", "R2", "R3"])
+        self.assertEqual(self.matches(index, "where is my order"), ["R2"])
+        self.assertEqual(self.matches(index, "goodbye"), [])
+
+    def test_contains_finds_overlapping_keywords(self):
+        """Test that the automaton finds keywords inside other keywords."""
+        index = self.get_index(
+            {"keywords": "refund", "match_type": "Contains"},
+            {"keywords": "fun", "match_type": "Contains"},
+        )
+
+        self.assertEqual(self.matches(index, "I want a REFUND"), ["R0", "R1"])
+
+    def test_case_sensitive_rule(self):
+        """Test that case sensitive rules only match the exact case."""
+        index = self.get_index({"keywords": "SALE", "match_type": "Contains", "case_sensitive": 1})
+
+        self.assertEqual(self.matches(index, "big SALE today"), ["R0"])
+        self.assertEqual(self.matches(index, "big sale today"), [])
+
+    def test_regex_with_group_reference(self):
+        """Test that back-references still work next to other patterns."""
+        index = self.get_index(
+            {"keywords": "(a|b)c", "match_type": "Regex"},
+            {"keywords": "(xy)\\1", "match_type": "Regex"},
+        )
+
+        self.assertEqual(self.matches(index, "xyxy"), ["R1"])
+
+    def test_fuzzy_match(self):
+        """Test that fuzzy keywords tolerate typos up to their edit distance."""
+        index = self.get_index(
+            {"keywords": "order status", "match_type": "Fuzzy", "max_edit_distance": 1},
+            {"keywords": "hello", "match_type": "Fuzzy", "max_edit_distance": 2},
+        )
+
+        self.assertEqual(self.matches(index, "ordr  status"), ["R0"])
+        self.assertEqual(self.matches(index, "Helo"), ["R1"])
+        self.assertEqual(self.matches(index, "hlo"), ["R1"])
+        self.assertEqual(self.matches(index, "odr stats"), [])
+
+    def test_prebuilt_payloads(self):
+        """Test that responses are built once, when the index is compiled."""
+        index = self.get_index(
+            {"keywords": "hi", "match_type": "Exact", "response_type": "Text", "response_text": "Hello!"},
+            {
+                "keywords": "menu", "match_type": "Exact", "response_type": "Media",
+                "media_type": "Document", "media_url": "/files/menu.pdf", "media_caption": "Our menu"
+            },
+            {"keywords": "help", "match_type": "Exact", "response_type": "Script", "script": "response = 'x'"},
+        )
+
+        self.assertEqual(index.rules[0].payload, "Hello!")
+        self.assertEqual(index.rules[1].payload["content_type"], "document")
+        self.assertEqual(index.rules[1].payload["media_document"], "/files/menu.pdf")
+        self.assertIsNone(index.rules[2].payload)
+
+    def test_time_window(self):
+        """Test that only active rules are indexed until the next boundary."""
+        from datetime import datetime
+
+        rules = (
+            {"keywords": "sale", "match_type": "Contains", "active_from": datetime(2026, 11, 20)},
+            {"keywords": "sale", "match_type": "Contains", "active_until": datetime(2026, 1, 31)},
+            {"keywords": "sale", "match_type": "Contains", "active_until": datetime(2026, 12, 31)},
+        )
+
+        index = self.get_index(*rules, now=datetime(2026, 11, 1))
+        self.assertEqual(self.matches(index, "sale"), ["R2"])
+        self.assertEqual(index.expires_at, datetime(2026, 11, 20))
+        self.assertFalse(index.is_expired(datetime(2026, 11, 19)))
+        self.assertTrue(index.is_expired(datetime(2026, 11, 20)))
+
+        index = self.get_index(*rules, now=datetime(2026, 11, 20))
+        self.assertEqual(self.matches(index, "sale"), ["R0", "R2"])
+
+
+class TestRuleAnalyzer(IntegrationTestCase):
+    """Test detection of conflicting keyword rules."""
+
+    def analyze(self, *rules):
+        from frappe_whatsapp_chatbot.chatbot.rule_analyzer import RuleAnalyzer
+
+        findings = RuleAnalyzer([
+            frappe._dict({"name": f"R{i}", "title": f"R{i}", "case_sensitive": 0, **rule})
+            for i, rule in enumerate(rules)
+        ]).analyze()
+        return {(f["issue"], f["rule"], f["conflicting_rule"]) for f in findings}
+
+    def test_contains_shadows_lower_rules(self):
+        """Test that a broad Contains rule makes narrower lower rules unreachable."""
+        findings = self.analyze(
+            {"keywords": "order", "match_type": "Contains"},
+            {"keywords": "order status", "match_type": "Exact"},
+            {"keywords": "track order, refund", "match_type": "Starts With"},
+        )
+
+        self.assertIn(("Shadowed Keyword", "R1", "R0"), findings)
+        self.assertIn(("Never Fires", "R1", None), findings)
+        self.assertIn(("Shadowed Keyword", "R2", "R0"), findings)
+        self.assertNotIn(("Never Fires", "R2", None), findings)
+
+    def test_conditional_rule_does_not_shadow(self):
+        """Test that rules with conditions only overlap lower rules."""
+        findings = self.analyze(
+            {"keywords": "refund", "match_type": "Exact", "conditions": "len(message) < 10"},
+            {"keywords": "refund", "match_type": "Exact"},
+        )
+
+        self.assertEqual(findings, {("Overlapping Keyword", "R1", "R0")})
+
+    def test_catastrophic_regex(self):
+        """Test that nested quantifiers are flagged and safe patterns are not."""
+        from frappe_whatsapp_chatbot.chatbot.rule_analyzer import find_catastrophic_pattern
+
+        self.assertTrue(find_catastrophic_pattern(r"(\w+\s?)*$"))
+        self.assertTrue(find_catastrophic_pattern(r"(a+)+b"))
+        self.assertIsNone(find_catastrophic_pattern(r"order\s+\d+"))
+        self.assertIsNone(find_catastrophic_pattern(r"(?>a+)+b"))
+
+
+class TestRegexGuard(IntegrationTestCase):
+    """Test time limited regex searches."""
+
+    def test_catastrophic_pattern_times_out(self):
+        """Test that a backtracking pattern gives up and returns the default."""
+        import time
+        from frappe_whatsapp_chatbot.chatbot.regex_guard import GuardedPattern, clear_regex_timeouts
+
+        pattern = GuardedPattern(r"(\w+\s?)*$")
+        started_at = time.perf_counter()
+
+        self.assertIsNone(pattern.search("a" * 40 + "!", source="Test Regex Guard", timeout=0.05))
+        self.assertLess(time.perf_counter() - started_at, 2)
+        clear_regex_timeouts("Test Regex Guard")
+
+    def test_normal_pattern(self):
+        """Test that ordinary patterns match as with re."""
+        import re
+        from frappe_whatsapp_chatbot.chatbot.regex_guard import GuardedPattern
+
+        pattern = GuardedPattern(r"order\s+\d+", re.IGNORECASE)
+        self.assertTrue(pattern.search("ORDER 42 please", timeout=0.05))
+        self.assertIsNone(pattern.match("my order 42", timeout=0.05))
+
+
+class TestRuleHits(IntegrationTestCase):
+    """Test keyword rule hit counting and rollup."""
+
+    def setUp(self):
+        self.rule = frappe.get_doc({
+            "doctype": "WhatsApp Keyword Reply",
+            "title": "Test Rule Hits",
+            "keywords": "hits test",
+            "match_type": "Exact",
+            "response_type": "Text",
+            "response_text": "Counted",
+            "enabled": 1
+        }).insert(ignore_permissions=True)
+
+    def tearDown(self):
+        frappe.db.delete("WhatsApp Rule Hits", {"reference_name": self.rule.name})
+        frappe.db.delete("WhatsApp Keyword Reply", {"name": self.rule.name})
+
+    def test_hits_are_rolled_up(self):
+        """Test that hits are kept in Redis until the rollup adds them up."""
+        from frappe_whatsapp_chatbot.chatbot.rule_hits import (
+            KEYWORD_REPLY, flush_rule_hits, get_pending_hits, get_rule_hits, record_hit
+        )
+
+        key = (KEYWORD_REPLY, self.rule.name)
+        for _ in range(3):
+            record_hit(KEYWORD_REPLY, self.rule.name)
+
+        self.assertEqual(get_pending_hits()[key][0], 3)
+        self.assertFalse(frappe.db.exists("WhatsApp Rule Hits", {"reference_name": self.rule.name}))
+
+        flush_rule_hits()
+        record_hit(KEYWORD_REPLY, self.rule.name)
+        flush_rule_hits()
+
+        self.assertNotIn(key, get_pending_hits())
+        rows = frappe.get_all(
+            "WhatsApp Rule Hits",
+            filters={"reference_name": self.rule.name},
+            fields=["hits", "last_hit"]
+        )
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].hits, 4)
+        self.assertIsNotNone(rows[0].last_hit)
+
+        hits = {row["reference_name"]: row["hits"] for row in get_rule_hits(KEYWORD_REPLY)}
+        self.assertEqual(hits[self.rule.name], 4)
+
+
+class TestExpressionCache(IntegrationTestCase):
+    """Test compiled condition expressions."""
+
+    def test_compiled_once(self):
+        """Test that an expression is compiled once and then served from cache."""
+        from frappe_whatsapp_chatbot.chatbot.expressions import (
+            compile_expression,
+            evaluate_expression,
+        )
+
+        compile_expression.cache_clear()
+        self.assertTrue(evaluate_expression("len(message) > 3", {"message": "hello"}))
+        self.assertFalse(evaluate_expression("len(message) > 3", {"message": "hi"}))
+
+        info = compile_expression.cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 1)
+
+    def test_invalid_expression_rejected_on_save(self):
+        """Test that invalid conditions are reported when validating."""
+        from frappe_whatsapp_chatbot.chatbot.expressions import validate_expression
+
+        validate_expression("'order' in message", "conditions")
+        with self.assertRaises(frappe.ValidationError):
+            validate_expression("len(message >", "conditions")
+
 
 class TestFlowEngine(IntegrationTestCase):
     """Test flow engine functionality."""
@@ -304,3 +559,624 @@ class TestFlowEngineValidation(IntegrationTestCase):
         self.assertTrue(flow_engine.validate_input(MockStep(), "any input", None))
         self.assertTrue(flow_engine.validate_input(MockStep(), "", None))
         self.assertTrue(flow_engine.validate_input(MockStep(), None, None))
+
+
+class TestFlowGraph(IntegrationTestCase):
+    """Test compiled flow graphs."""
+
+    def get_graph(self):
+        from frappe_whatsapp_chatbot.chatbot.flow_graph import FlowGraph
+
+        def step(idx, name, **fields):
+            values = {field: None for field in (
+                "message", "message_type", "template", "response_script", "input_type", "options",
+                "buttons", "whatsapp_flow", "flow_cta", "flow_screen", "flow_field_mapping",
+                "validation_regex", "validation_error", "store_as", "next_step", "conditional_next",
+                "skip_condition", "retry_on_invalid", "max_retries"
+            )}
+            values.update(fields)
+            return frappe._dict(idx=idx, step_name=name, **values)
+
+        return FlowGraph(frappe._dict({
+            "name": "Test Flow Graph",
+            "cancel_keywords": "Cancel, STOP",
+            "steps": [
+                step(2, "confirm", conditional_next='{"yes": "done", "default": "ask_name"}'),
+                step(1, "ask_name", buttons='[{"id": "a", "title": "A"}]'),
+                step(3, "done")
+            ]
+        }))
+
+    def test_steps_are_compiled(self):
+        """Test that steps are ordered, indexed by name and their JSON parsed."""
+        graph = self.get_graph()
+
+        self.assertEqual(graph.first_step.step_name, "ask_name")
+        self.assertEqual(graph.get_step("confirm").conditional_next["yes"], "done")
+        self.assertEqual(graph.get_step("ask_name").buttons[0]["id"], "a")
+        self.assertIsNone(graph.get_step("missing"))
+        self.assertEqual(graph.cancel_words, {"cancel", "stop"})
+
+    def test_next_step(self):
+        """Test transitions through conditional, default and step order."""
+        from frappe_whatsapp_chatbot.chatbot.flow_engine import FlowEngine
+
+        graph = self.get_graph()
+        engine = FlowEngine("919876543210", None)
+
+        self.assertEqual(engine.get_next_step(graph.get_step("ask_name"), graph, "Bob", None), "confirm")
+        self.assertEqual(engine.get_next_step(graph.get_step("confirm"), graph, "YES", None), "done")
+        self.assertEqual(engine.get_next_step(graph.get_step("confirm"), graph, "no", None), "ask_name")
+        self.assertIsNone(engine.get_next_step(graph.get_step("done"), graph, "ok", None))
+
+    def test_trigger_index(self):
+        """Test flow triggers by folded keyword and button payload."""
+        from frappe_whatsapp_chatbot.chatbot.flow_graph import FlowTriggerIndex
+
+        index = FlowTriggerIndex([
+            frappe._dict(name="Sales", trigger_keywords="Sales, Buy", trigger_on_button=None),
+            frappe._dict(name="Support", trigger_keywords="help", trigger_on_button="support_btn"),
+            frappe._dict(name="Newer Sales", trigger_keywords="sales", trigger_on_button=None)
+        ])
+
+        self.assertEqual(index.match("buy"), "Sales")
+        self.assertEqual(index.match("sales"), "Sales")
+        self.assertEqual(index.match("buy", "support_btn"), "Support")
+        self.assertIsNone(index.match("hello"))
+
+
+class TestSessionState(IntegrationTestCase):
+    """Test the per-turn session unit of work."""
+
+    def test_changes_are_tracked(self):
+        """Test that session data is parsed once and changes are tracked in memory."""
+        from frappe_whatsapp_chatbot.chatbot.session_state import SessionState
+
+        state = SessionState({"name": "CHAT-TEST", "status": "Active", "session_data": '{"name": "Bob"}'})
+        self.assertFalse(state.is_dirty)
+        self.assertEqual(state.session_data, {"name": "Bob"})
+
+        state.current_step = "ask_email"
+        state.add_message("Incoming", "bob@example.com", "ask_email")
+        self.assertTrue(state.is_dirty)
+        self.assertEqual(state.current_step, "ask_email")
+
+    def test_flush_writes_once(self):
+        """Test that flush appends messages and updates fields without rewriting history."""
+        from frappe_whatsapp_chatbot.chatbot.session_state import SessionState
+
+        session = frappe.get_doc({
+            "doctype": "WhatsApp Chatbot Session",
+            "phone_number": "919800000023",
+            "status": "Active",
+            "current_step": "ask_name",
+            "session_data": "{}"
+        })
+        session.add_message("Outgoing", "What is your name?", "ask_name")
+        session.insert(ignore_permissions=True)
+
+        state = SessionState.load({"name": session.name})
+        state.session_data = {"name": "Bob"}
+        state.current_step = "ask_email"
+        state.add_message("Incoming", "Bob", "ask_name")
+        state.add_message("Outgoing", "What is your email?", "ask_email")
+        state.save(ignore_permissions=True)
+        state.flush()
+
+        session.reload()
+        self.assertEqual(session.current_step, "ask_email")
+        self.assertEqual(frappe.parse_json(session.session_data), {"name": "Bob"})
+        self.assertEqual([m.message for m in session.messages], ["What is your name?", "Bob", "What is your email?"])
+        self.assertEqual([m.idx for m in session.messages], [1, 2, 3])
+        self.assertFalse(state.is_dirty)
+
+        # History is only read on demand, with messages not written yet
+        state.add_message("Incoming", "bob@example.com", "ask_email")
+        self.assertEqual(
+            [m.message for m in state.get_messages(limit=2)],
+            ["What is your email?", "bob@example.com"]
+        )
+        self.assertEqual(len(state.messages), 4)
+
+        frappe.delete_doc("WhatsApp Chatbot Session", session.name, force=True)
+
+    def test_hot_session_writes_behind(self):
+        """Test that an active hot session goes to Redis and its changes are queued."""
+        from frappe_whatsapp_chatbot.chatbot.session_state import SessionState
+        from frappe_whatsapp_chatbot.chatbot.session_store import (
+            drop_hot_session, get_hot_session, take_pending_writes
+        )
+
+        state = SessionState({
+            "name": "CHAT-TEST-HOT",
+            "phone_number": "919800000024",
+            "whatsapp_account": None,
+            "status": "Active",
+            "current_step": "ask_name",
+            "session_data": "{}"
+        }, hot=True)
+        state.current_step = "ask_email"
+        state.session_data = {"name": "Bob"}
+        state.add_message("Incoming", "Bob", "ask_name")
+        state.flush()
+
+        self.assertEqual(get_hot_session(None, "919800000024")["current_step"], "ask_email")
+
+        values, messages = take_pending_writes("CHAT-TEST-HOT")
+        self.assertEqual(values["session_data"], {"name": "Bob"})
+        self.assertEqual([message["message"] for message in messages], ["Bob"])
+        self.assertEqual(take_pending_writes("CHAT-TEST-HOT"), ({}, []))
+
+        drop_hot_session(None, "919800000024")
+
+    def test_session_stays_dirty_with_writes_left(self):
+        """Test that a session with queued writes left after a write stays in the dirty set."""
+        from frappe_whatsapp_chatbot.chatbot.session_store import (
+            DIRTY_SESSIONS_KEY, get_pending_key, remove_pending_writes
+        )
+
+        dirty_key = frappe.cache.make_key(DIRTY_SESSIONS_KEY)
+        pending_key = get_pending_key("CHAT-TEST-DIRTY")
+
+        pipe = frappe.cache.pipeline()
+        pipe.rpush(pending_key, "{}", "{}")
+        pipe.sadd(dirty_key, "CHAT-TEST-DIRTY")
+        pipe.execute()
+
+        remove_pending_writes("CHAT-TEST-DIRTY", 1)
+
+        pipe.sismember(dirty_key, "CHAT-TEST-DIRTY")
+        pipe.llen(pending_key)
+        self.assertEqual(pipe.execute(), [True, 1])
+
+        remove_pending_writes("CHAT-TEST-DIRTY", 1)
+
+        pipe.sismember(dirty_key, "CHAT-TEST-DIRTY")
+        pipe.llen(pending_key)
+        self.assertEqual(pipe.execute(), [False, 0])
+
+    def test_cancelled_hot_session_is_not_revived(self):
+        """Test that a session cancelled during the turn is not written back to Redis."""
+        from frappe_whatsapp_chatbot.chatbot.session_state import SessionState
+        from frappe_whatsapp_chatbot.chatbot.session_store import get_hot_session
+
+        state = SessionState({
+            "name": "CHAT-TEST-HOT",
+            "phone_number": "919800000024",
+            "whatsapp_account": None,
+            "status": "Active",
+            "current_step": "ask_name",
+            "session_data": "{}"
+        }, hot=True)
+        state.current_step = "ask_email"
+        state.end("Cancelled")
+        state.flush()
+
+        self.assertIsNone(get_hot_session(None, "919800000024"))
+        self.assertFalse(state.is_dirty)
+
+
+class TestBackgroundDispatch(IntegrationTestCase):
+    """Test background processing helpers."""
+
+    def test_latency_summary(self):
+        """Test percentile summary of job durations."""
+        from frappe_whatsapp_chatbot.chatbot.dispatcher import summarize
+
+        summary = summarize([float(i) for i in range(1, 101)])
+
+        self.assertEqual(summary["p50"], 50.0)
+        self.assertEqual(summary["p95"], 95.0)
+        self.assertEqual(summary["p99"], 99.0)
+        self.assertEqual(summary["max"], 100.0)
+
+    def test_latency_summary_empty(self):
+        """Test that an empty sample set has no percentiles."""
+        from frappe_whatsapp_chatbot.chatbot.dispatcher import summarize
+
+        self.assertIsNone(summarize([])["p95"])
+
+    def test_coalesce_joins_text_burst(self):
+        """Test that consecutive texts are merged and buttons keep their order."""
+        from frappe_whatsapp_chatbot.chatbot.dispatcher import coalesce_messages
+
+        messages = [
+            {"name": "MSG-1", "message": "hi", "content_type": "text"},
+            {"name": "MSG-2", "message": "my order status", "content_type": "text"},
+            {"name": "MSG-3", "message": "yes", "content_type": "button"},
+        ]
+
+        result = coalesce_messages(messages)
+
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[0]["message"], "hi my order status")
+        self.assertEqual(result[0]["name"], "MSG-2")
+        self.assertEqual(result[0]["coalesced"], ["MSG-1", "MSG-2"])
+        self.assertEqual(result[1]["content_type"], "button")
+
+    def test_coalesce_delay(self):
+        """Test that a burst waits for a quiet window, up to three windows."""
+        import time
+        from frappe_whatsapp_chatbot.chatbot.dispatcher import get_coalesce_delay, get_inbox_key
+
+        inbox = get_inbox_key(f"_Test Coalesce:{frappe.generate_hash(length=6)}")
+        self.assertEqual(get_coalesce_delay(inbox, 5), 0)
+
+        now = time.time()
+        frappe.cache.rpush(inbox, frappe.as_json({"enqueued_at": now - 2}))
+        self.assertAlmostEqual(get_coalesce_delay(inbox, 5), 3, delta=0.5)
+
+        # The first message of the burst is answered after three windows at most
+        frappe.cache.delete_value(inbox)
+        frappe.cache.rpush(inbox, frappe.as_json({"enqueued_at": now - 14}))
+        frappe.cache.rpush(inbox, frappe.as_json({"enqueued_at": now}))
+        self.assertAlmostEqual(get_coalesce_delay(inbox, 5), 1, delta=0.5)
+
+        frappe.cache.delete_value(inbox)
+
+    def test_coalesce_latest_mode(self):
+        """Test that Latest mode only keeps the last text of a burst."""
+        from frappe_whatsapp_chatbot.chatbot.dispatcher import coalesce_messages
+
+        messages = [
+            {"name": "MSG-1", "message": "hi", "content_type": "text"},
+            {"name": "MSG-2", "message": "my order status", "content_type": "text"},
+        ]
+
+        result = coalesce_messages(messages, "Latest")
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]["message"], "my order status")
+
+
+class TestConversationOrdering(IntegrationTestCase):
+    """Test that a conversation is processed one message at a time."""
+
+    def test_conversation_lock_is_exclusive(self):
+        """Test that only one worker holds a conversation's lock."""
+        from frappe_whatsapp_chatbot.chatbot.dispatcher import conversation_lock
+
+        conversation = f"_Test Lock:{frappe.generate_hash(length=6)}"
+
+        with conversation_lock(conversation) as first:
+            with conversation_lock(conversation) as second:
+                self.assertTrue(first)
+                self.assertFalse(second)
+
+        with conversation_lock(conversation) as again:
+            self.assertTrue(again)
+
+    def test_inbox_keeps_arrival_order(self):
+        """Test that queued messages are taken out oldest first."""
+        from frappe_whatsapp_chatbot.chatbot.dispatcher import get_inbox_key, pop_messages
+
+        inbox = get_inbox_key(f"_Test Inbox:{frappe.generate_hash(length=6)}")
+        for name in ["MSG-1", "MSG-2", "MSG-3"]:
+            frappe.cache.rpush(inbox, frappe.as_json({"name": name}))
+
+        self.assertEqual([m["name"] for m in pop_messages(inbox)], ["MSG-1", "MSG-2", "MSG-3"])
+        self.assertEqual(pop_messages(inbox), [])
+
+    def test_single_active_session(self):
+        """Test that a conversation can never have two active sessions."""
+        phone_number = "919800000002"
+
+        def new_session(status="Active"):
+            return frappe.get_doc({
+                "doctype": "WhatsApp Chatbot Session",
+                "phone_number": phone_number,
+                "status": status
+            }).insert(ignore_permissions=True)
+
+        first = new_session()
+        self.assertRaises(frappe.DuplicateEntryError, new_session)
+
+        # Written without validation, as a concurrent insert would be
+        second = new_session("Completed")
+        second.status = "Active"
+        second.active_conversation = first.active_conversation
+        self.assertRaises(frappe.UniqueValidationError, second.db_update)
+
+        # Ending the session frees the conversation
+        first.status = "Completed"
+        first.save(ignore_permissions=True)
+        self.assertIsNone(first.active_conversation)
+        third = new_session()
+
+        for session in (first, second, third):
+            frappe.delete_doc("WhatsApp Chatbot Session", session.name, force=True)
+
+
+class TestResponseBatch(IntegrationTestCase):
+    """Test collecting the outgoing messages of a turn."""
+
+    def test_responses_keep_order(self):
+        """Test that lists are flattened and empty responses skipped."""
+        from frappe_whatsapp_chatbot.chatbot.outbox import ResponseBatch
+
+        batch = ResponseBatch("+919876543210", None)
+        batch.add("Welcome!")
+        batch.add(None)
+        batch.add(["", {"message": "Pick one", "content_type": "interactive"}, "Or type it"])
+
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.responses[0], "Welcome!")
+        self.assertEqual(batch.responses[1]["content_type"], "interactive")
+        self.assertEqual(batch.responses[2], "Or type it")
+
+    def test_text_message_document(self):
+        """Test that text responses become outgoing, non-chatbot messages."""
+        from frappe_whatsapp_chatbot.chatbot.outbox import ResponseBatch
+
+        msg = ResponseBatch("+919876543210", None).build_message("Hello")
+
+        self.assertEqual(msg.type, "Outgoing")
+        self.assertEqual(msg.to, "+919876543210")
+        self.assertEqual(msg.content_type, "text")
+        self.assertTrue(msg.flags.ignore_chatbot)
+
+
+class TestSendRateLimit(IntegrationTestCase):
+    """Test the per-account outgoing message rate limit."""
+
+    def setUp(self):
+        self.settings = frappe.get_single("WhatsApp Chatbot")
+        self.previous = (self.settings.send_rate_limit, self.settings.send_burst)
+        self.settings.send_rate_limit = 0.01
+        self.settings.send_burst = 2
+        self.settings.save(ignore_permissions=True)
+
+    def tearDown(self):
+        self.settings.send_rate_limit, self.settings.send_burst = self.previous
+        self.settings.save(ignore_permissions=True)
+
+    def test_bucket_allows_burst_then_limits(self):
+        """Test that only the burst is sent at once, then senders must wait."""
+        from frappe_whatsapp_chatbot.chatbot.rate_limit import acquire_send_token
+
+        account = f"_Test Rate Limit {frappe.generate_hash(length=6)}"
+
+        self.assertTrue(acquire_send_token(account)[0])
+        self.assertTrue(acquire_send_token(account)[0])
+
+        allowed, wait = acquire_send_token(account)
+        self.assertFalse(allowed)
+        self.assertGreater(wait, 0)
+
+    def test_backoff_grows_and_is_capped(self):
+        """Test the retry delay of failed sends."""
+        from frappe_whatsapp_chatbot.chatbot.outbox import BACKOFF_MAX, get_backoff
+
+        self.assertLess(get_backoff(1), get_backoff(4))
+        self.assertLessEqual(get_backoff(20), BACKOFF_MAX * 1.2)
+
+    def test_send_queue_keeps_order_and_priority(self):
+        """Test that queued messages keep their order and replies go before bulk sends."""
+        from frappe_whatsapp_chatbot.chatbot.outbox import (
+            PRIORITIES, PRIORITY_BULK, PRIORITY_INTERACTIVE, get_next_queued, get_send_queue_key, queue_message
+        )
+
+        account = f"_Test Send Queue {frappe.generate_hash(length=6)}"
+        queue_message("+919876500001", account, "bulk 1", PRIORITY_BULK)
+        queue_message("+919876500002", account, "bulk 2", PRIORITY_BULK)
+        queue_message("+919876500003", account, "reply 1", PRIORITY_INTERACTIVE)
+        queue_message("+919876500003", account, "reply 2", PRIORITY_INTERACTIVE)
+
+        sent = []
+        item = get_next_queued(account)
+        while item:
+            key, member, _ = item
+            frappe.cache.zrem(key, member)
+            sent.append(frappe.parse_json(member)["response"])
+            item = get_next_queued(account)
+
+        for priority in PRIORITIES:
+            frappe.cache.delete(get_send_queue_key(account, priority))
+
+        self.assertEqual(sent, ["reply 1", "reply 2", "bulk 1", "bulk 2"])
+
+    def test_retry_holds_back_recipient(self):
+        """Test that later messages to a recipient stay behind their retried message."""
+        from frappe_whatsapp_chatbot.chatbot.outbox import (
+            block_recipient, get_recipient_shift, unblock_recipient
+        )
+
+        account = f"_Test Send Queue {frappe.generate_hash(length=6)}"
+        block_recipient(account, "+919876500001", "retried", 4)
+
+        def payload(message_id, to="+919876500001"):
+            return {"id": message_id, "to": to, "whatsapp_account": account}
+
+        self.assertEqual(get_recipient_shift(payload("later")), 4)
+        self.assertEqual(get_recipient_shift(payload("retried")), 0)
+        self.assertEqual(get_recipient_shift(payload("other", "+919876500002")), 0)
+
+        unblock_recipient(account, "+919876500001", "retried")
+        self.assertEqual(get_recipient_shift(payload("later")), 0)
+
+
+class TestProcessingTrace(IntegrationTestCase):
+    """Test per-stage timing of message processing."""
+
+    def test_span_counts_queries(self):
+        """Test that spans record the queries issued inside them."""
+        from frappe_whatsapp_chatbot.chatbot.tracing import Trace
+
+        trace = Trace("TEST-MSG", sampled=True)
+        with trace.span("lookup"):
+            frappe.db.sql("select 1")
+            frappe.db.sql("select 2")
+        trace.finish()
+
+        self.assertEqual(trace.spans["lookup"][1], 2)
+        self.assertNotIn("sql", frappe.db.__dict__)
+
+    def test_unsampled_trace_records_nothing(self):
+        """Test that an unsampled trace leaves the database untouched."""
+        from frappe_whatsapp_chatbot.chatbot.tracing import Trace
+
+        trace = Trace("TEST-MSG", sampled=False)
+        with trace.span("lookup"):
+            frappe.db.sql("select 1")
+        trace.finish()
+
+        self.assertEqual(trace.spans, {})
+
+
+class TestSettingsSnapshot(IntegrationTestCase):
+    """Test the cached WhatsApp Chatbot settings snapshot."""
+
+    def test_snapshot_is_read_only(self):
+        """Test that the snapshot cannot be modified."""
+        from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+        settings = get_settings()
+        with self.assertRaises(AttributeError):
+            settings.enabled = 1
+
+    def test_snapshot_refreshes_on_save(self):
+        """Test that saving the settings invalidates the snapshot."""
+        from frappe_whatsapp_chatbot.chatbot.settings import get_settings
+
+        doc = frappe.get_single("WhatsApp Chatbot")
+        doc.session_timeout_minutes = 45
+        doc.save(ignore_permissions=True)
+
+        self.assertEqual(get_settings().session_timeout_minutes, 45)
+
+        doc.session_timeout_minutes = 30
+        doc.save(ignore_permissions=True)
+
+        self.assertEqual(get_settings().session_timeout_minutes, 30)
+
+
+
+class TestBusinessSchedule(IntegrationTestCase):
+    """Test the compiled business hours schedule."""
+
+    def get_schedule(self, rows, holidays=()):
+        from frappe_whatsapp_chatbot.chatbot.business_hours import BusinessSchedule, compile_schedule
+
+        schedule = compile_schedule([frappe._dict(row) for row in rows], "Asia/Kolkata")
+        return BusinessSchedule(schedule.timezone, schedule.minutes, holidays)
+
+    def test_parse_time(self):
+        """Test parsing of Time field values returned by the database."""
+        from datetime import time, timedelta
+        from frappe_whatsapp_chatbot.chatbot.business_hours import parse_time
+
+        self.assertEqual(parse_time("09:30:00"), time(9, 30))
+        self.assertEqual(parse_time(timedelta(hours=18)), time(18, 0))
+        self.assertEqual(parse_time(timedelta(0)), time(0, 0))
+        self.assertIsNone(parse_time(None))
+
+    def test_is_open_in_schedule_timezone(self):
+        """Test that the check uses the schedule's timezone, not the server's."""
+        from datetime import datetime, timezone
+
+        schedule = self.get_schedule([
+            {"day": "Monday", "enabled": 1, "start_time": "09:00:00", "end_time": "18:00:00"}
+        ])
+
+        # 2026-10-19 is a Monday; 04:00 UTC is 09:30 in Asia/Kolkata
+        self.assertTrue(schedule.is_open(datetime(2026, 10, 19, 4, 0, tzinfo=timezone.utc)))
+        self.assertFalse(schedule.is_open(datetime(2026, 10, 19, 3, 0, tzinfo=timezone.utc)))
+        self.assertFalse(schedule.is_open(datetime(2026, 10, 19, 12, 30, tzinfo=timezone.utc)))
+
+    def test_closes_after_midnight(self):
+        """Test that an end time before the start time runs into the next day."""
+        from datetime import datetime
+
+        schedule = self.get_schedule([
+            {"day": "Saturday", "enabled": 1, "start_time": "20:00:00", "end_time": "02:00:00"}
+        ])
+
+        self.assertTrue(schedule.is_open(datetime(2026, 10, 24, 23, 0)))
+        self.assertTrue(schedule.is_open(datetime(2026, 10, 25, 1, 30)))
+        self.assertFalse(schedule.is_open(datetime(2026, 10, 25, 2, 0)))
+
+    def test_next_opening_skips_holidays(self):
+        """Test that the next opening skips closed days and holidays."""
+        from datetime import date, datetime
+
+        rows = [
+            {"day": day, "enabled": 1, "start_time": "09:00:00", "end_time": "18:00:00"}
+            for day in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+        ]
+        schedule = self.get_schedule(rows, holidays=[date(2026, 10, 19).toordinal()])
+
+        # Friday evening: Monday is a holiday, so the next opening is Tuesday
+        next_opening = schedule.next_opening(datetime(2026, 10, 16, 19, 0))
+        self.assertEqual(next_opening.replace(tzinfo=None), datetime(2026, 10, 20, 9, 0))
+        self.assertFalse(schedule.is_open(datetime(2026, 10, 19, 10, 0)))
+
+        # Early on a working day, it opens the same day
+        next_opening = schedule.next_opening(datetime(2026, 10, 21, 7, 15))
+        self.assertEqual(next_opening.replace(tzinfo=None), datetime(2026, 10, 21, 9, 0))
+
+
+class TestMessageNormalization(IntegrationTestCase):
+    """Test the normalized message shared by the matching stages."""
+
+    def test_normalized_forms(self):
+        """Test that width, case, accents and spacing are normalized once."""
+        from frappe_whatsapp_chatbot.chatbot.utils import normalize_message
+
+        message = normalize_message("  Ｃafé  ORDER ", "0091 98765 43210")
+
+        self.assertEqual(message.raw, "  Ｃafé  ORDER ")
+        self.assertEqual(message.text, "Café  ORDER")
+        self.assertEqual(message.folded, "café  order")
+        self.assertEqual(message.unaccented, "cafe  order")
+        self.assertEqual(message.tokens, ("café", "order"))
+        self.assertEqual(message.phone, "+919876543210")
+
+    def test_keywords_match_normalized_text(self):
+        """Test that keyword keys are normalized like the message."""
+        from frappe_whatsapp_chatbot.chatbot.keyword_index import KeywordIndex
+
+        index = KeywordIndex([frappe._dict({
+            "name": "R0", "keywords": "STRASSE", "match_type": "Exact", "case_sensitive": 0
+        })])
+
+        self.assertEqual([rule.name for rule in index.iter_matches(" Straße ")], ["R0"])
+
+
+class TestPhoneNormalization(IntegrationTestCase):
+    """Test E.164 phone number normalization."""
+
+    def test_formats_map_to_same_number(self):
+        """Test that common ways of writing a number normalize identically."""
+        from frappe_whatsapp_chatbot.chatbot.utils import normalize_phone
+
+        for phone in ["919876543210", "+91 98765 43210", "+91-(98765)-43210", "0091 9876543210"]:
+            self.assertEqual(normalize_phone(phone), "+919876543210")
+
+    def test_invalid_number(self):
+        """Test that values without digits normalize to an empty string."""
+        from frappe_whatsapp_chatbot.chatbot.utils import normalize_phone
+
+        self.assertEqual(normalize_phone(None), "")
+        self.assertEqual(normalize_phone("abc"), "")
+
+
+class TestExcludedNumbers(IntegrationTestCase):
+    """Test the cached set of excluded numbers."""
+
+    def test_lost_set_is_rebuilt(self):
+        """Test that excluded numbers stay excluded after the set is lost."""
+        from frappe_whatsapp_chatbot.chatbot.exclusions import (
+            EXCLUDED_NUMBERS_KEY, exclude_numbers, include_numbers, is_excluded
+        )
+
+        exclude_numbers(["+91 98000 00005"])
+        frappe.db.after_commit.run()  # The set is updated on commit
+        self.assertTrue(is_excluded("919800000005"))
+
+        frappe.cache.delete_value(EXCLUDED_NUMBERS_KEY)
+        self.assertTrue(is_excluded("919800000005"))
+        self.assertFalse(is_excluded("919800000006"))
+
+        include_numbers(["919800000005"])
+        frappe.db.after_commit.run()
+        self.assertFalse(is_excluded("919800000005"))